@@ -1,13 +1,42 @@
+import abc
+import errno
+import hashlib
+import heapq
+import mmap
+import os
 import random
-from socket import socket, AF_INET, SOCK_DGRAM
+from contextlib import ExitStack
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF, timeout as socket_timeout
 import math
 import struct
 import time
 import asyncio
-from enum import IntEnum
-from typing import Dict, List, Tuple
-
-OVERALL_DATA = 0  # The position in the stats dictionary for overall data that was sent/received
+from bisect import bisect_left, bisect_right
+from collections import deque
+from enum import IntEnum, IntFlag
+from typing import AsyncIterator, Callable, Dict, List, Tuple, Optional, Sequence, Union
+
+from compression import (ASSUMED_SEND_RATE, AVAILABLE_CODECS, CODEC, COMPRESSION_CHUNK_SIZE, COMPRESSION_SAMPLE_SIZE,
+                         DECOMPRESSOR, compression_executor, create_compressor, read_chunks, select_codec)
+from congestion_control import CONGESTION_CONTROLLER, PACER, create_congestion_controller
+from datagram_io import BATCHED_DATAGRAM_TRANSPORT, open_datagram_transport
+from disk_writer import DISK_WRITE_SIZE, MAX_WRITE_BUFFERS, disk_write_executor, preallocate, write_at
+from fec import FEC_DECODER, FEC_ENCODER, FEC_REPAIR_FORMAT
+from flow_control import (CONNECTION_WINDOW_RATIO, INITIAL_MAX_DATA, INITIAL_MAX_STREAM_DATA,
+                          MAX_CONNECTION_RECEIVE_WINDOW, MAX_STREAM_RECEIVE_WINDOW, RECEIVE_WINDOW, SEND_CREDIT)
+from metrics import (CONNECTION_METRICS, METRICS_FORMATS, QLOG_TRACE, export_metrics_periodically, rate,
+                     seconds_between, write_metrics)
+from path_mtu import BLACK_HOLE_PTO_COUNT, PATH_MTU_DISCOVERY, disable_fragmentation
+from resumption import SESSION_TICKET, TICKET_ISSUER, TICKET_STORE, session_tickets
+from stream_scheduler import DEFAULT_STREAM_PRIORITY, DEFAULT_STREAM_WEIGHT, SEND_STREAM, STREAM_SCHEDULER
+from timer_wheel import TIMER, WHEEL_TICK, timer_wheel
+from varint import pack_varint_into, unpack_varint_from, varint_size
+
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024  # kernel receive buffer requested for every connection socket
+SYN_RETRANSMIT_TIMEOUT = 1.0  # seconds until a SYN without answer is sent again, doubled every time
+HANDSHAKE_TIMEOUT = 10.0  # seconds a client keeps sending the SYN before giving up on the server
+IDLE_TIMEOUT = 30.0  # seconds without a packet from the other side before the connection is dropped
+CLOSE_PTO_COUNT = 3  # times a closing side sends its FIN again, one probe timeout after the other, before giving up
 
 class FLAGS(IntEnum):
     SYN = 1
@@ -18,59 +47,302 @@ class FLAGS(IntEnum):
     FIN = 6
     FIRST_PACKET = 7
     LAST_PACKET = 8
+    PMTU_PROBE = 9  # padding only, sent to find out whether the path carries datagrams of its size
+    MAX_DATA = 10  # flow control: the new limit of the connection's stream data
+    MAX_STREAM_DATA = 11  # flow control: the new limits of one or more streams
+    REPAIR = 12  # forward error correction: rebuilds a lost packet of a group of stream packets, see fec
+    PING = 13  # keepalive: empty, only elicits an ACK so the other side's idle timer starts over
+
+
+class VERSION(IntEnum):
+    """
+    Wire formats of the packets after the handshake. The two high bits of the first byte of every packet are its
+    version minus one and the other bits its flag, so a receiver parses every version it supports without knowing
+    in advance which one arrives. SYN and SYN_ACK are always sent in the first version, which every peer reads.
+    """
+    FIXED_HEADERS = 1  # fixed-size packet and frame headers (see QUIC_PACKET.PACKET_HEADER and FRAME_HEADER)
+    VARINT_HEADERS = 2  # QUIC-style variable-length integers, and the last frame of a packet omits its length
+
+
+SUPPORTED_VERSIONS = (VERSION.VARINT_HEADERS, VERSION.FIXED_HEADERS)
+HANDSHAKE_FLAGS = (FLAGS.SYN, FLAGS.SYN_ACK)
+VERSION_SHIFT = 6
+FLAG_MASK = (1 << VERSION_SHIFT) - 1
+
+
+# Packets that carry stream frames, every other packet type carries no frames
+STREAM_PACKET_FLAGS = (FLAGS.FIRST_PACKET, FLAGS.DATA_PACKET, FLAGS.LAST_PACKET)
+# Packets the receiver has to acknowledge, the sender retransmits them until they are acknowledged
+# (except path MTU probes, a lost probe only means the path does not carry its size, and PINGs)
+ACK_ELICITING_FLAGS = (*STREAM_PACKET_FLAGS, FLAGS.END_OF_DATA, FLAGS.PMTU_PROBE, FLAGS.MAX_DATA,
+                       FLAGS.MAX_STREAM_DATA, FLAGS.FIN, FLAGS.PING)
+# Flow control window updates, a lost one is replaced by an update with the current limits instead of being resent
+WINDOW_UPDATE_FLAGS = (FLAGS.MAX_DATA, FLAGS.MAX_STREAM_DATA)
+# Streams opened with open_stream are bidirectional and numbered from BIDIRECTIONAL_STREAM_ID_BASE, apart from the
+# streams of send_data batches: the client opens the even ones and the server the odd ones, so both sides open
+# streams at any time without picking the same ID
+BIDIRECTIONAL_STREAM_ID_BASE = 1 << 24
+# Payload of an END_OF_DATA packet: the ID of the first stream of the batch and the number of streams that were sent
+STREAM_COUNT_FORMAT = struct.Struct('!II')
+# Payload of an ACK packet: the ACK delay in microseconds, the number of ranges, the number of packets the sender
+# of the ACK rebuilt from REPAIR packets so far (they are acknowledged like received ones),
+# followed by the first and last packet number of every acknowledged range, newest range first
+ACK_HEADER_FORMAT = struct.Struct('!IHI')
+ACK_RANGE_FORMAT = struct.Struct('!II')
+MAX_ACK_RANGES = 256
+# Payload of SYN and SYN_ACK: the flow control limits the sender of the packet starts with (the initial MAX_DATA of
+# the connection and the initial MAX_STREAM_DATA of every stream), the compression codecs it can decompress, and
+# the versions it reads as a bit mask (bit v - 1 for version v)
+TRANSPORT_PARAMETERS_FORMAT = struct.Struct('!QQBB')
+# The SYN of a resumed connection carries the server's ticket after the transport parameters (see resumption), and
+# the SYN_ACK carries whether the ticket resumed the session, followed by a new ticket for the next connection
+RESUMPTION_STATUS_FORMAT = struct.Struct('!B')
+# Payload of a MAX_DATA packet: the new limit, and of a MAX_STREAM_DATA packet: a (stream ID, new limit) per stream
+MAX_DATA_FORMAT = struct.Struct('!Q')
+MAX_STREAM_DATA_FORMAT = struct.Struct('!IQ')
+
+
+class FRAME_FLAGS(IntFlag):
+    NONE = 0
+    FIN = 1  # the frame is the last one of its stream, its end offset is the final size of the stream
+    # every frame of a compressed stream carries its codec, offsets and sizes count the compressed bytes
+    ZLIB = 2
+    LZMA = 4
+    # version VARINT_HEADERS only, on the wire: the frame header ends with the frame's length, without it the frame
+    # takes the rest of the packet
+    LENGTH = 8
+    # every frame of a stream sent with `verify` carries it, the stream ends with the STREAM_DIGEST of its data
+    DIGEST = 16
+
+
+CODEC_FRAME_FLAGS = {CODEC.ZLIB: FRAME_FLAGS.ZLIB, CODEC.LZMA: FRAME_FLAGS.LZMA}
+
+
+# End-to-end integrity check of the streams sent with `verify`, hashed incrementally on both sides
+STREAM_DIGEST = hashlib.sha256
+STREAM_DIGEST_SIZE = STREAM_DIGEST().digest_size
+
+# What send_data accepts for a stream: a bytes-like object, sliced without copying, or an async iterator of bytes
+STREAM_DATA = Union[bytes, bytearray, memoryview, mmap.mmap, AsyncIterator[bytes]]
 
 
 class QUIC_CONNECTION:
 
-    def __init__(self):
+    def __init__(self, server: Optional['QUIC_SERVER'] = None, congestion_control: str = 'newreno',
+                 qlog_path: Optional[str] = None, max_datagram_size: Optional[int] = None,
+                 stream_receive_window: int = INITIAL_MAX_STREAM_DATA,
+                 connection_receive_window: int = INITIAL_MAX_DATA, autotune_windows: bool = True,
+                 ticket_store: Optional[TICKET_STORE] = None, compression: bool = False,
+                 codecs: CODEC = AVAILABLE_CODECS, fec: bool = False,
+                 versions: Sequence[int] = SUPPORTED_VERSIONS, verify: bool = False,
+                 handshake_timeout: float = HANDSHAKE_TIMEOUT, idle_timeout: Optional[float] = IDLE_TIMEOUT,
+                 keepalive_interval: Optional[float] = None):
         # Initialize attributes for the connection state
-        self.sock = socket(AF_INET, SOCK_DGRAM)
+        # a connection created by a QUIC_SERVER shares the server's socket instead of owning one
+        self.server = server
+        self.sock = None
+        if server is None:
+            self.sock = socket(AF_INET, SOCK_DGRAM)
+            # a large receive buffer absorbs bursts while the event loop is busy with other streams
+            self.sock.setsockopt(SOL_SOCKET, SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+            # datagrams larger than the path MTU are dropped instead of fragmented, see path_mtu
+            disable_fragmentation(self.sock)
         self.is_closed = False
 
+        # the client picks a random connection ID in connect_to, every packet of the connection carries it
+        self.connection_id = 0
+
         # Variables to store host and port for reuse
         self.host_address = None
         self.port = None
+        # the address of the other side, known after the handshake
+        self.peer_address: Optional[Tuple[str, int]] = None
+
+        # Handshake: the payload of the SYN (client) or SYN_ACK (server) this side sends, sent again for a lost one.
+        # A client keeps the tickets servers issue in `ticket_store` and resumes with them, see `connect`
+        self.ticket_store = ticket_store if ticket_store is not None else session_tickets
+        self.handshake_payload = b''
+        self.handshake_complete = asyncio.Event()
+        self.handshake_timer: Optional[TIMER] = None
+        self.handshake_timeout = handshake_timeout
+        self.handshake_deadline = math.inf
+        # whether the connection was resumed from a ticket, its first data was sent with the SYN (0-RTT)
+        self.resumed = False
+        # the wire formats this side reads, advertised in the handshake, and the one it sends in: the newest version
+        # both sides read once the handshake is done, the first version before (0-RTT data)
+        self.versions = tuple(versions)
+        self.version = VERSION.FIXED_HEADERS
+
+        # asyncio transport, created lazily by the first async send/receive on the running loop
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.protocol: Optional[QUIC_PROTOCOL] = None
+        self.incoming_packets: Optional[asyncio.Queue] = None
+
+        # Loss recovery: every packet sent on the connection gets the next packet number, packets the receiver
+        # acknowledges are tracked by `recovery`, and the frames of lost packets wait in the retransmit queues
+        self.next_packet_number = 0
+        # packets start at the size every path carries, and grow as probes find a larger path MTU,
+        # up to `max_datagram_size` if it is given (never more than the QUIC_PACKET buffers hold)
+        self.path_mtu = PATH_MTU_DISCOVERY(min(max_datagram_size or QUIC_PACKET.Max_size, QUIC_PACKET.Max_size))
+        # the congestion controller (see congestion_control.CONGESTION_CONTROLLERS) limits the bytes in flight,
+        # and the pacer spreads the packets of all the streams evenly over the RTT
+        self.congestion_controller = create_congestion_controller(congestion_control,
+                                                                  self.path_mtu.max_datagram_size)
+        self.pacer = PACER(self.path_mtu.max_datagram_size)
+        self.recovery = LOSS_RECOVERY(self.on_packets_lost, self.congestion_controller, self.on_rtt_sample)
+        # packets that may be sent beyond the congestion window after a probe timeout
+        self.probe_packets_allowed = 0
+        self.retransmit_frames: deque = deque()
+        self.retransmit_control: List[Tuple[int, bytes]] = []
+        self.recovery_event = asyncio.Event()
+        # packet numbers received from the other side, reported back in every ACK
+        self.received_packet_numbers = RANGE_SET()
+        # one ACK is sent per batch of received packets, `ack_pending_since` is when the first of them arrived
+        self.ack_pending_since: Optional[float] = None
+
+        # Forward error correction (see fec): with `fec`, a REPAIR packet follows every group of stream packets
+        # this side sends, their payloads wait in `repair_payloads` for the packetizer. Every connection rebuilds
+        # lost packets from the REPAIR packets it receives.
+        self.fec_encoder = FEC_ENCODER() if fec else None
+        self.fec_decoder = FEC_DECODER()
+        self.repair_payloads: deque = deque()
 
         # Initialize stream-related attributes
-        self.stream_ID = 0  # each stream has a unique ID
+        self.stream_ID = 0  # each stream has a unique ID, never reused on the connection
+        # IDs of the streams that were already returned by receive_data, late retransmissions for them are ignored
+        self.finished_streams = RANGE_SET()
+        # the scheduler picks which streams fill each packet, `send_ready` wakes the packetizer when data is queued
+        self.scheduler = STREAM_SCHEDULER(self.path_mtu.max_datagram_size - QUIC_PACKET.HEADER_LENGTH -
+                                          QUIC_PACKET.FRAME_LENGTH)
+        self.send_ready = asyncio.Event()
 
         # Dictionaries to store incoming and outgoing streams
-        # Dictionaries to store stream statistics, and connection statistics for further analysis
-        self.in_streams: Dict[int, bytes] = {}
+        self.in_streams: Dict[int, STREAM_REASSEMBLER] = {}
         self.out_streams: Dict[int, bytes] = {}
-        self.streams_stats: Dict[int, Stats] = {}
-        self.connection_stats: Dict[int, Stats] = {}
-
-    def listen_to(self, host: str, port: int):
-        """Listen for incoming connections."""
+        # sends the frames of every stream, started when a stream gets data to send (see start_packetizer)
+        self.packetizer: Optional[asyncio.Task] = None
+
+        # Bidirectional streams (open_stream / accept_stream): the ID of the next stream this side opens, the readers
+        # of the open streams, the streams the other side opened until accept_stream returns them (None once the
+        # connection is closed), and the streams that were read to the end, late retransmissions for them are ignored
+        self.next_bidirectional_stream_id = BIDIRECTIONAL_STREAM_ID_BASE + (1 if server is not None else 0)
+        self.stream_readers: Dict[int, STREAM_READER] = {}
+        self.new_streams: asyncio.Queue = asyncio.Queue()
+        self.closed_streams = RANGE_SET()
+
+        # Flow control (see flow_control): the receive windows bound the stream data the other side may send ahead
+        # of what this side consumed, and are advertised to it in the handshake and in MAX_DATA/MAX_STREAM_DATA
+        # updates. The send side uses the credit the other side advertised the same way.
+        self.stream_receive_window = stream_receive_window
+        self.autotune_windows = autotune_windows
+        self.receive_window = RECEIVE_WINDOW(connection_receive_window, MAX_CONNECTION_RECEIVE_WINDOW,
+                                             autotune_windows)
+        self.stream_receive_windows: Dict[int, RECEIVE_WINDOW] = {}
+        self.send_credit = SEND_CREDIT(INITIAL_MAX_DATA)
+        self.peer_initial_max_stream_data = INITIAL_MAX_STREAM_DATA
+        # the streams being sent, by ID, so MAX_STREAM_DATA updates reach them
+        self.send_streams: Dict[int, SEND_STREAM] = {}
+
+        # Compression: `codecs` are the codecs this side decompresses (advertised in the handshake) and may compress
+        # with, the streams it sends are compressed (adaptively, see `send_compressed_stream_data`) with `compression`
+        self.compression = compression
+        self.codecs = codecs & AVAILABLE_CODECS
+        self.peer_codecs = CODEC.NONE
+        # every stream this side sends ends with a digest of its data with `verify`, the receiver checks it as the
+        # data arrives (see VERIFYING_STREAM)
+        self.verify = verify
+
+        # live counters and histograms of the connection and its streams, see metrics.CONNECTION_METRICS,
+        # exported periodically after `export_metrics`, and an optional qlog event trace
+        self.metrics = CONNECTION_METRICS()
+        self.metrics_export: Optional[Tuple[str, str, float]] = None
+        self.metrics_task: Optional[asyncio.Task] = None
+        self.trace = QLOG_TRACE(qlog_path, vantage_point='server' if server is not None else 'client') \
+            if qlog_path is not None else None
+
+        # Connection timers, on the timer wheel every connection of the event loop shares (see timer_wheel): the
+        # connection is dropped after `idle_timeout` seconds without a packet from the other side (None keeps it
+        # forever), and with `keepalive_interval` a PING is sent whenever this side sent nothing for that long, so
+        # the other side's idle timer does not drop a connection that is only waiting for its next transfer
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.idle_timer: Optional[TIMER] = None
+        self.keepalive_timer: Optional[TIMER] = None
+        self.last_received = time.monotonic()
+        self.last_sent = time.monotonic()
+
+    def listen_to(self, host: str, port: int, timeout: Optional[float] = None):
+        """
+        Listen for incoming connections. With `timeout`, gives up (and closes the socket) when no client connected
+        within that many seconds. A client that did not get the SYN_ACK sends its SYN again, and is answered again
+        once the connection is used (see `packet_received`).
+        """
         print(f"Listening for incoming connections on {host}:{port}")
         self.host_address = host
         self.port = port
+        # the listening side opens the odd bidirectional streams
+        self.next_bidirectional_stream_id = BIDIRECTIONAL_STREAM_ID_BASE + 1
         # bind the socket to the host and port
         self.sock.bind((self.host_address, self.port))
-        received_data, address = self.sock.recvfrom(QUIC_PACKET.Max_size)
-
-        received_packet = QUIC_PACKET.deserialize_data(received_data)[0]
-        if received_packet.packet_flag == FLAGS.SYN:
-            print(f"Received SYN packet from client in address: {address}")
-            received_packet.packet_flag = FLAGS.SYN_ACK
-            self.sock.sendto(received_packet.serialize_data(), address)
-        else:
-            # at this point we only want to receive SYN packets
-            raise Exception("Unexpected packet received")
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            if deadline is not None:
+                self.sock.settimeout(max(deadline - time.monotonic(), 0.001))
+            try:
+                received_data, address = self.sock.recvfrom(QUIC_PACKET.Max_size)
+            except socket_timeout:
+                self.sock.close()
+                self.is_closed = True
+                raise Exception(f"No client connected to {host}:{port} within {timeout} seconds")
+            received_packet = QUIC_PACKET.deserialize_data(received_data)[0]
+            if received_packet.packet_flag == FLAGS.SYN:
+                break
+            # at this point we only want to receive SYN packets, the 0-RTT data of a resumed client that overtook
+            # its SYN is dropped and sent again by the client's loss recovery
+        self.sock.settimeout(None)
+
+        print(f"Received SYN packet from client in address: {address}")
+        self.peer_address = address
+        self.connection_id = received_packet.connection_id
+        self.handshake_payload = self.accept_handshake(received_packet.packet_data, listen_ticket_issuer)
+        accept_packet = QUIC_PACKET(FLAGS.SYN_ACK, received_packet.packet_ID)
+        accept_packet.connection_id = self.connection_id
+        accept_packet.append_data(self.handshake_payload)
+        self.sock.sendto(accept_packet.serialize_data(), address)
+        self.handshake_complete.set()
 
     def connect_to(self, host: str, port: int):
         self.host_address = host
         self.port = port
-
-        # Create a packet of type SYN (synchronize) to initiate the connection
-        connect_packet = QUIC_PACKET(FLAGS.SYN)  # create a SYN type packet
-
-        # Send the SYN packet to the specified host and port using a socket
-        self.sock.sendto(connect_packet.serialize_data(), (self.host_address, self.port))
-
-        # Wait to receive data from the server
-        received_data, address = self.sock.recvfrom(QUIC_PACKET.Max_size)
+        self.peer_address = (host, port)
+        self.connection_id = random.getrandbits(64)
+        # the SYN is sent again, with a doubled timeout every time, until the SYN_ACK arrives or `handshake_timeout`
+        # seconds passed
+        deadline = time.monotonic() + self.handshake_timeout
+        retransmit_timeout = SYN_RETRANSMIT_TIMEOUT
+        while True:
+            # Create a packet of type SYN (synchronize) to initiate the connection
+            connect_packet = QUIC_PACKET(FLAGS.SYN)  # create a SYN type packet
+            connect_packet.connection_id = self.connection_id
+            # the SYN and the SYN_ACK carry the flow control limits each side starts with
+            connect_packet.append_data(self.transport_parameters())
+
+            # Send the SYN packet to the specified host and port using a socket
+            self.sock.sendto(connect_packet.serialize_data(), (self.host_address, self.port))
+
+            # Wait to receive data from the server
+            self.sock.settimeout(max(min(retransmit_timeout, deadline - time.monotonic()), 0.001))
+            try:
+                received_data, address = self.sock.recvfrom(QUIC_PACKET.Max_size)
+                break
+            except socket_timeout:
+                if time.monotonic() >= deadline:
+                    self.sock.close()
+                    self.is_closed = True
+                    raise Exception(f"Connection failed: no answer from {host}:{port} "
+                                    f"within {self.handshake_timeout} seconds")
+                retransmit_timeout *= 2
+        self.sock.settimeout(None)
 
         # Deserialize the received data into a QUIC_PACKET object
         received_packet = QUIC_PACKET.deserialize_data(received_data)[0]
@@ -78,243 +350,2182 @@ class QUIC_CONNECTION:
         # Check if the received packet has a SYN_ACK flag, which indicates that the server acknowledged the connection request
         if received_packet.packet_flag == FLAGS.SYN_ACK:
             print("GOT SYN_ACK FROM THE SERVER")
+            self.apply_handshake_response(received_packet.packet_data)
+            self.handshake_complete.set()
         else:
             raise Exception("Connection failed")
 
-    async def send_data(self, list_of_files: List[bytes]) -> None:
+    async def connect(self, host: str, port: int) -> None:
+        """
+        Connects without blocking the event loop.
+        With a ticket from an earlier connection to the same server (see resumption), the connection is resumed:
+        the SYN carries the ticket and this returns at once, so the first packets of data follow the SYN in the same
+        flight, under the flow control limits the ticket remembers (0-RTT). Otherwise this returns once the SYN_ACK
+        arrived. The SYN is sent again, with a doubled timeout every time, until the SYN_ACK arrives, and the
+        connection is closed if it did not arrive within `handshake_timeout` seconds (raised here, or by the sends of
+        a resumed connection).
+        """
+        self.host_address = host
+        self.port = port
+        self.peer_address = (host, port)
+        self.connection_id = random.getrandbits(64)
+        await self.open_transport()
+
+        session_ticket = self.ticket_store.get(self.peer_address)
+        self.handshake_payload = self.transport_parameters()
+        if session_ticket is not None:
+            self.resumed = True
+            self.handshake_payload += session_ticket.ticket
+            self.set_peer_limits(session_ticket.max_data, session_ticket.max_stream_data)
+        self.handshake_deadline = time.monotonic() + self.handshake_timeout
+        self.send_syn(SYN_RETRANSMIT_TIMEOUT)
+        if session_ticket is None:
+            try:
+                await asyncio.wait_for(self.handshake_complete.wait(), self.handshake_timeout)
+            except asyncio.TimeoutError:
+                if not self.is_closed:
+                    self.terminate_connection(f"No SYN_ACK within {self.handshake_timeout} seconds")
+                raise Exception(f"Connection failed: no answer from {host}:{port} "
+                                f"within {self.handshake_timeout} seconds")
+
+    def send_syn(self, timeout: float) -> None:
+        if self.handshake_complete.is_set() or self.is_closed:
+            return
+        if time.monotonic() >= self.handshake_deadline:
+            # the server never answered, a resumed connection stops sending its 0-RTT data
+            self.terminate_connection(f"No SYN_ACK within {self.handshake_timeout} seconds")
+            return
+        syn_packet = QUIC_PACKET(FLAGS.SYN)
+        syn_packet.append_data(self.handshake_payload)
+        self.send_packet(syn_packet)
+        self.handshake_timer = timer_wheel().call_later(min(timeout, self.handshake_deadline - time.monotonic()),
+                                                        self.send_syn, timeout * 2)
+
+    def transport_parameters(self) -> bytes:
+        """The payload of the SYN or SYN_ACK this side sends: its initial receive windows, codecs and versions."""
+        return TRANSPORT_PARAMETERS_FORMAT.pack(self.receive_window.max_offset, self.stream_receive_window, self.codecs,
+                                                sum(1 << (version - 1) for version in set(self.versions)))
+
+    def apply_transport_parameters(self, payload: memoryview, raise_only: bool = False) -> Optional[Tuple[int, int]]:
+        """
+        Starts the send credit from the other side's SYN or SYN_ACK (see `set_peer_limits`), learns which codecs it
+        decompresses and picks the newest version both sides read. Returns the other side's (max_data,
+        max_stream_data), a handshake without them keeps the defaults (uncompressed, in the first version).
+        """
+        if len(payload) < TRANSPORT_PARAMETERS_FORMAT.size:
+            return None
+        max_data, max_stream_data, peer_codecs, peer_versions = TRANSPORT_PARAMETERS_FORMAT.unpack_from(payload)
+        self.set_peer_limits(max_data, max_stream_data, raise_only)
+        self.peer_codecs = CODEC(peer_codecs & AVAILABLE_CODECS)
+        common_versions = [version for version in self.versions if peer_versions >> (version - 1) & 1]
+        self.version = VERSION(max(common_versions, default=VERSION.FIXED_HEADERS))
+        return max_data, max_stream_data
+
+    def set_peer_limits(self, max_data: int, max_stream_data: int, raise_only: bool = False) -> None:
+        """
+        Sets the initial credit of the connection and of its streams, also of the streams already being sent when
+        0-RTT data went out under the limits a ticket remembered. With `raise_only` the credit never shrinks.
+        """
+        if raise_only:
+            max_data = max(max_data, self.send_credit.max_data)
+            max_stream_data = max(max_stream_data, self.peer_initial_max_stream_data)
+        self.send_credit.max_data = max_data
+        self.peer_initial_max_stream_data = max_stream_data
+        for send_stream in self.send_streams.values():
+            send_stream.max_stream_data = max(send_stream.max_stream_data, max_stream_data) if raise_only \
+                else max_stream_data
+
+    def accept_handshake(self, payload: memoryview, ticket_issuer: TICKET_ISSUER) -> bytes:
+        """
+        Handles a client's SYN on the server side and returns the payload of the SYN_ACK:
+        1. start the send credit from the client's flow control limits
+        2. a valid ticket resumes the session, the receive windows start at least at the limits the ticket remembers,
+           which the client's 0-RTT data was sent under
+        3. a ticket that is not valid (expired, forged, issued by another server process or to another address) does
+           not resume the session and the windows keep their configured size, the limits it claims are not trusted
+        4. issue a new ticket for the client's next connection
+        """
+        self.apply_transport_parameters(payload)
+        ticket = bytes(payload[TRANSPORT_PARAMETERS_FORMAT.size:])
+        if ticket:
+            valid, remembered_limits = ticket_issuer.open(ticket, self.peer_address[0])
+            if valid:
+                max_data, max_stream_data = remembered_limits
+                self.receive_window.raise_initial_window(max_data)
+                self.stream_receive_window = max(self.stream_receive_window, max_stream_data)
+            self.resumed = valid
+        new_ticket = ticket_issuer.issue(self.peer_address[0], self.receive_window.max_offset,
+                                         self.stream_receive_window)
+        return self.transport_parameters() + RESUMPTION_STATUS_FORMAT.pack(self.resumed) + new_ticket
+
+    def apply_handshake_response(self, payload: memoryview) -> None:
+        """
+        Applies the server's SYN_ACK on the client side: its flow control limits, whether it resumed the session from
+        the ticket of the SYN, and the new ticket it issued, which replaces the old one in the ticket store.
+        """
+        status_end = TRANSPORT_PARAMETERS_FORMAT.size + RESUMPTION_STATUS_FORMAT.size
+        if len(payload) < status_end:
+            self.apply_transport_parameters(payload)
+            return
+        resumed = bool(RESUMPTION_STATUS_FORMAT.unpack_from(payload, TRANSPORT_PARAMETERS_FORMAT.size)[0])
+        # the server that accepted the ticket gives at least the limits 0-RTT data was sent under,
+        # one that did not may give less, and the credit follows it
+        max_data, max_stream_data = self.apply_transport_parameters(payload, raise_only=self.resumed and resumed)
+        self.resumed = self.resumed and resumed
+        new_ticket = bytes(payload[status_end:])
+        if new_ticket:
+            self.ticket_store.put(self.peer_address, SESSION_TICKET(new_ticket, max_data, max_stream_data))
+        else:
+            self.ticket_store.remove(self.peer_address)
+
+    async def open_transport(self) -> None:
+        """
+        Attaches the connection socket to the running event loop.
+        After this call every datagram is parsed by QUIC_PROTOCOL and handed to `packet_received`,
+        and every packet is sent through the non-blocking (batched, see datagram_io) transport, so many
+        connections and streams can share one loop without blocking each other.
+        """
+        self.start_metrics_export()
+        self.start_timers()
+        if self.transport is not None:
+            return
+        self.incoming_packets = asyncio.Queue()
+        self.transport, self.protocol = await open_datagram_transport(self.sock, lambda: QUIC_PROTOCOL(self))
+
+    def start_timers(self) -> None:
+        """Arms the idle and keepalive timers, once the connection runs on an event loop."""
+        if self.idle_timer is not None or self.keepalive_timer is not None or self.is_closed:
+            return
+        self.last_received = self.last_sent = time.monotonic()
+        if self.idle_timeout is not None:
+            self.idle_timer = timer_wheel().call_later(self.idle_timeout, self.on_idle_timeout)
+        if self.keepalive_interval is not None:
+            self.keepalive_timer = timer_wheel().call_later(self.keepalive_interval, self.on_keepalive_timeout)
+
+    def on_idle_timeout(self) -> None:
+        """
+        Drops the connection when nothing arrived from the other side for `idle_timeout` seconds, so a side whose
+        peer is gone (or whose FIN was lost) stops waiting and frees its socket: receive_data returns None,
+        and the sends and stream readers still waiting raise. Otherwise checks again when it could expire.
+        """
+        self.idle_timer = None
+        if self.is_closed:
+            return
+        idle_time = time.monotonic() - self.last_received
+        if idle_time < self.idle_timeout:
+            self.idle_timer = timer_wheel().call_later(self.idle_timeout - idle_time, self.on_idle_timeout)
+            return
+        self.terminate_connection(f"Nothing received for {self.idle_timeout} seconds")
+
+    def on_keepalive_timeout(self) -> None:
+        """Sends a PING if this side sent nothing for `keepalive_interval` seconds, and checks again later."""
+        self.keepalive_timer = None
+        if self.is_closed:
+            return
+        now = time.monotonic()
+        if now - self.last_sent >= self.keepalive_interval and self.handshake_complete.is_set():
+            # small and rare, sent outside the congestion window
+            self.send_packet(self.create_packet(FLAGS.PING))
+        self.keepalive_timer = timer_wheel().call_later(
+            max(self.last_sent + self.keepalive_interval - time.monotonic(), WHEEL_TICK), self.on_keepalive_timeout)
+
+    def send_packet(self, packet: 'QUIC_PACKET') -> None:
+        """
+        Sends a packet to the other side, through the transport if it is already open.
+        The packet gets the next packet number of the connection, and ack-eliciting packets are handed to
+        the loss recovery so they are retransmitted if they are not acknowledged.
+        """
+        packet.connection_id = self.connection_id
+        packet.packet_ID = self.next_packet_number
+        self.next_packet_number += 1
+        serialized_packet = packet.serialize_data()
+        packet_size = len(serialized_packet)
+        self.last_sent = time.monotonic()
+        if packet.packet_flag in ACK_ELICITING_FLAGS:
+            self.recovery.on_packet_sent(SENT_PACKET(packet, packet_size, self.last_sent))
+        if self.fec_encoder is not None and packet.packet_flag in STREAM_PACKET_FLAGS:
+            repair_payload = self.fec_encoder.protect(packet.packet_ID, packet.packet_type, packet.packet_data)
+            if repair_payload is not None:
+                self.repair_payloads.append(repair_payload)
+
+        self.metrics.packets_sent += 1
+        self.metrics.bytes_sent += packet_size
+        if packet.frames:
+            self.metrics.stream_bytes_sent += sum(len(frame) for frame in packet.frames)
+            self.metrics.on_data(time.perf_counter_ns())
+        if self.trace is not None:
+            self.trace_packet('transport:packet_sent', packet, packet.frames, packet_size)
+
+        if isinstance(self.transport, BATCHED_DATAGRAM_TRANSPORT):
+            # the send buffer goes back to the pool once the batch with the packet was flushed
+            self.transport.sendto(serialized_packet, self.peer_address, packet.release_buffer)
+            return
+        if self.transport is not None:
+            # asyncio's transport copies the datagram if it cannot send it right away
+            self.transport.sendto(serialized_packet, self.peer_address)
+        else:
+            self.sock.sendto(serialized_packet, self.peer_address)
+        packet.release_buffer()
+
+    def packet_received(self, received_packet: 'QUIC_PACKET', received_frames: List['QUIC_FRAME'],
+                        address: Tuple[str, int], received_size: int) -> None:
+        """
+        Handles a packet as soon as the transport reads it.
+        ACKs are processed right away by the loss recovery. Ack-eliciting packets are recorded for the next ACK,
+        which is sent once for the whole batch of packets the transport read, and duplicates are dropped.
+        Every other packet is queued for receive_data.
+        """
+        self.metrics.packets_received += 1
+        self.metrics.bytes_received += received_size
+        self.last_received = time.monotonic()
+        if self.trace is not None:
+            self.trace_packet('transport:packet_received', received_packet, received_frames, received_size)
+
+        if received_packet.packet_flag == FLAGS.SYN_ACK:
+            # repeated SYN_ACKs answer SYNs that were sent again
+            if not self.handshake_complete.is_set():
+                self.apply_handshake_response(received_packet.packet_data)
+                self.handshake_complete.set()
+                if self.handshake_timer is not None:
+                    self.handshake_timer.cancel()
+            return
+
+        if received_packet.packet_flag == FLAGS.SYN:
+            # the client did not get the SYN_ACK of listen_to and sent its SYN again
+            if self.server is None and self.handshake_payload:
+                accept_packet = QUIC_PACKET(FLAGS.SYN_ACK)
+                accept_packet.append_data(self.handshake_payload)
+                self.send_packet(accept_packet)
+            return
+
+        if received_packet.packet_flag == FLAGS.ACK:
+            ack_delay, ack_ranges, peer_recovered_packets = received_packet.read_ack_ranges()
+            acked_stream_packets = 0
+            for acked_packet in self.recovery.on_ack_received(ack_ranges, ack_delay):
+                if acked_packet.packet_flag == FLAGS.PMTU_PROBE:
+                    self.path_mtu.on_probe_acked(acked_packet.size)
+                    self.update_max_datagram_size()
+                elif acked_packet.packet_flag in STREAM_PACKET_FLAGS:
+                    acked_stream_packets += 1
+            if self.fec_encoder is not None:
+                self.fec_encoder.on_packets_acked(acked_stream_packets, peer_recovered_packets)
+            self.pacer.update_rate(self.congestion_controller.congestion_window, self.recovery.smoothed_rtt)
+            self.recovery_event.set()
+            if self.trace is not None:
+                self.trace.event('recovery:metrics_updated', {
+                    'smoothed_rtt': self.recovery.smoothed_rtt * 1000, 'latest_rtt': self.recovery.latest_rtt * 1000,
+                    'congestion_window': self.congestion_controller.congestion_window,
+                    'bytes_in_flight': self.recovery.bytes_in_flight})
+            return
+
+        if received_packet.packet_flag == FLAGS.REPAIR:
+            # recorded so the ACK ranges stay contiguous, but a REPAIR packet is never acknowledged or sent again
+            if received_packet.packet_ID not in self.received_packet_numbers:
+                self.received_packet_numbers.add(received_packet.packet_ID, received_packet.packet_ID + 1)
+                self.recover_packet(received_packet, address)
+            return
+
+        if received_packet.packet_flag in ACK_ELICITING_FLAGS:
+            is_duplicate = received_packet.packet_ID in self.received_packet_numbers
+            self.received_packet_numbers.add(received_packet.packet_ID, received_packet.packet_ID + 1)
+            if self.ack_pending_since is None:
+                # runs after the transport handed over the rest of the batch
+                self.ack_pending_since = time.monotonic()
+                asyncio.get_running_loop().call_soon(self.send_pending_ack)
+            if is_duplicate:
+                self.metrics.duplicate_packets += 1
+            # a path MTU probe and a PING only need the ACK
+            if is_duplicate or received_packet.packet_flag in (FLAGS.PMTU_PROBE, FLAGS.PING):
+                return
+            if received_packet.packet_flag in WINDOW_UPDATE_FLAGS:
+                self.on_window_update(received_packet)
+                return
+            if received_packet.packet_flag in STREAM_PACKET_FLAGS:
+                self.fec_decoder.on_packet_received(received_packet.packet_ID, received_packet.packet_type,
+                                                    received_packet.packet_data)
+                # the frames of bidirectional streams go to their readers right away, the others to receive_data
+                if any(frame.stream_id >= BIDIRECTIONAL_STREAM_ID_BASE for frame in received_frames):
+                    self.on_stream_frames([frame for frame in received_frames
+                                           if frame.stream_id >= BIDIRECTIONAL_STREAM_ID_BASE],
+                                          self.bidirectional_stream_reader)
+                    received_frames = [frame for frame in received_frames
+                                       if frame.stream_id < BIDIRECTIONAL_STREAM_ID_BASE]
+                    if not received_frames:
+                        return
+        if received_packet.packet_flag == FLAGS.FIN:
+            # the readers and accept_stream stop waiting, receive_data terminates the connection
+            self.close_streams()
+        self.incoming_packets.put_nowait((received_packet, received_frames, address, received_size))
+
+    def recover_packet(self, repair_packet: 'QUIC_PACKET', address: Tuple[str, int]) -> None:
+        """
+        Rebuilds the one missing packet of the REPAIR packet's group, if every other packet of the group arrived,
+        and handles it as if it was received: it is acknowledged, so the sender does not retransmit it.
+        """
+        recovered = self.fec_decoder.recover(repair_packet.packet_data, self.received_packet_numbers)
+        if recovered is None:
+            return
+        packet_number, packet_type, data = recovered
+        packet = QUIC_PACKET(packet_type & FLAG_MASK, packet_number, version=(packet_type >> VERSION_SHIFT) + 1)
+        packet.connection_id = repair_packet.connection_id
+        packet.append_data(data)
+        datagram = bytes(packet.serialize_data())
+        packet.release_buffer()
+        recovered_packet, recovered_frames = QUIC_PACKET.deserialize_data(datagram)
+        self.metrics.fec_recovered_packets += 1
+        self.packet_received(recovered_packet, recovered_frames, address, 0)
+
+    def send_pending_ack(self) -> None:
+        """Sends the ACK for every ack-eliciting packet received since the last ACK."""
+        if self.ack_pending_since is None or self.is_closed:
+            return
+        self.send_ack(time.monotonic() - self.ack_pending_since)
+        self.ack_pending_since = None
+
+    def on_packets_lost(self, lost_packets: List['SENT_PACKET'], is_probe: bool = False) -> None:
+        """
+        Queues the frames and control payloads of lost packets, they are sent again in new packets.
+        Probes sent after a probe timeout may exceed the congestion window, otherwise a full window of lost
+        packets would block the connection for good. Repeated probe timeouts may mean the path stopped carrying
+        packets of the current size, so the packet size falls back to the base size.
+        Lost path MTU probes and PINGs are not sent again (a lost probe only ends the probe of its size), and lost
+        window updates are replaced by updates with the current limits.
+        """
+        if is_probe:
+            # new data may be sent as probes too, when every packet in flight was already sent again
+            self.probe_packets_allowed = LOSS_RECOVERY.PTO_PROBE_PACKETS
+            if self.recovery.pto_count >= BLACK_HOLE_PTO_COUNT:
+                self.path_mtu.on_black_hole()
+                self.update_max_datagram_size()
+        if self.fec_encoder is not None and not is_probe:
+            self.fec_encoder.on_packets_lost(sum(1 for lost_packet in lost_packets
+                                                 if lost_packet.packet_flag in STREAM_PACKET_FLAGS))
+        for lost_packet in lost_packets:
+            if self.trace is not None:
+                self.trace.event('recovery:packet_lost', {'header': {'packet_number': lost_packet.packet_number},
+                                                          'trigger': 'pto_expired' if is_probe else 'threshold'})
+            if lost_packet.packet_flag == FLAGS.PMTU_PROBE:
+                self.path_mtu.on_probe_lost(lost_packet.size)
+            elif lost_packet.packet_flag == FLAGS.PING:
+                # the next keepalive replaces it
+                continue
+            elif lost_packet.packet_flag in WINDOW_UPDATE_FLAGS:
+                self.resend_window_update(lost_packet)
+            elif lost_packet.packet_flag in STREAM_PACKET_FLAGS:
+                self.retransmit_frames.extend(lost_packet.frames)
+            else:
+                self.retransmit_control.append((lost_packet.packet_flag, lost_packet.payload))
+        self.recovery_event.set()
+        self.send_ready.set()
+        # the streams of a connection that used the packetizer may have no one else to send their lost frames again
+        if self.retransmit_frames and self.packetizer is not None and not self.is_closed:
+            self.start_packetizer()
+
+    async def send_when_allowed(self, packet: 'QUIC_PACKET') -> None:
+        """
+        Sends an ack-eliciting packet once the congestion controller and the pacer allow it:
+        1. wait until the packet fits in the congestion window (or a probe may be sent)
+        2. wait until the pacer has enough tokens for the packet
+        3. wait while the transport buffer is full, then send
+        """
+        size = packet.header_length + packet.data_length
+        while (self.recovery.bytes_in_flight + size > self.congestion_controller.congestion_window and
+               self.recovery.has_packets_in_flight() and self.probe_packets_allowed == 0):
+            if self.is_closed:
+                raise Exception("The connection was closed before the packet was sent")
+            self.recovery_event.clear()
+            await self.recovery_event.wait()
+        if self.recovery.bytes_in_flight + size > self.congestion_controller.congestion_window:
+            self.probe_packets_allowed = max(0, self.probe_packets_allowed - 1)
+
+        delay = self.pacer.time_until_send(size, time.monotonic())
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self.protocol.writable.wait()
+        self.send_packet(packet)
+        self.pacer.on_packet_sent(size)
+
+    def on_rtt_sample(self, latest_rtt: float) -> None:
+        self.metrics.rtt.observe(latest_rtt)
+
+    def trace_packet(self, event_name: str, packet: 'QUIC_PACKET', frames: List['QUIC_FRAME'], size: int) -> None:
+        """Writes a qlog packet event, with the stream frames the packet carries."""
+        self.trace.event(event_name, {
+            'header': {'packet_type': FLAGS(packet.packet_flag).name, 'packet_number': packet.packet_ID},
+            'raw': {'length': size},
+            'frames': [{'frame_type': 'stream', 'stream_id': frame.stream_id, 'offset': frame.offset,
+                        'length': len(frame), 'fin': bool(frame.frame_flags & FRAME_FLAGS.FIN)} for frame in frames]})
+
+    def on_datagram_too_big(self) -> None:
+        """The kernel refused a datagram as larger than the path MTU."""
+        self.path_mtu.on_packet_too_big()
+        self.update_max_datagram_size()
+
+    def update_max_datagram_size(self) -> None:
+        """Applies the packet size path MTU discovery found to the congestion controller, pacer and scheduler."""
+        max_datagram_size = self.path_mtu.max_datagram_size
+        self.congestion_controller.set_max_datagram_size(max_datagram_size)
+        self.pacer.set_max_datagram_size(max_datagram_size)
+        # a stream of weight 1 fills a whole packet in its turn, so packets carry as few frame headers as possible
+        self.scheduler.quantum = max_datagram_size - QUIC_PACKET.HEADER_LENGTH - QUIC_PACKET.FRAME_LENGTH
+
+    def create_packet(self, flag: int) -> 'QUIC_PACKET':
+        """
+        Creates a packet of the largest size the path carries, in the version the connection sends. Stream packets
+        protected by forward error correction leave room for the header of the REPAIR packet, which carries as many
+        bytes of XOR as the largest of them.
+        """
+        if flag in HANDSHAKE_FLAGS:
+            return QUIC_PACKET(flag)
+        max_size = self.path_mtu.max_datagram_size
+        if self.fec_encoder is not None and flag in STREAM_PACKET_FLAGS:
+            max_size -= FEC_REPAIR_FORMAT.size
+        return QUIC_PACKET(flag, max_size=max_size, version=self.version)
+
+    async def send_mtu_probe(self, probe_size: int) -> None:
+        """Sends a padding-only packet of `probe_size` bytes, its ACK confirms that the path carries the size."""
+        probe_packet = QUIC_PACKET(FLAGS.PMTU_PROBE, max_size=probe_size, version=self.version)
+        probe_packet.append_padding()
+        await self.send_when_allowed(probe_packet)
+
+    def fill_packet(self, packet: 'QUIC_PACKET') -> None:
+        """
+        Fills the free space of a packet with frames: first the frames of lost packets, then the frames the
+        stream scheduler picks from the streams' queued data, as far as the flow control credit of the connection
+        and of each stream allows. A frame that does not fit whole is split, the rest of it stays queued with the
+        offset where it continues.
+        """
+        while packet.free_space() > packet.frame_header_size(0, 0):
+            if self.retransmit_frames:
+                frame = self.retransmit_frames.popleft()
+                room = packet.free_space() - packet.frame_header_size(frame.stream_id, frame.offset)
+                if room <= 0:
+                    self.retransmit_frames.appendleft(frame)
+                    break
+                codec_flags = frame.frame_flags & ~FRAME_FLAGS.FIN
+                if len(frame) > room:
+                    self.retransmit_frames.appendleft(QUIC_FRAME(frame.stream_id, frame.offset + room,
+                                                                 frame.frame_data[room:], frame.frame_flags))
+                    packet.link_frame(frame.stream_id, frame.offset, frame.frame_data[:room], False, codec_flags)
+                else:
+                    packet.link_frame(frame.stream_id, frame.offset, frame.frame_data,
+                                      bool(frame.frame_flags & FRAME_FLAGS.FIN), codec_flags)
+                continue
+
+            # new data uses the connection's flow control credit, retransmissions do not
+            next_frame = self.scheduler.next_frame(packet.free_space(), self.send_credit.available(),
+                                                   packet.frame_header_size)
+            if next_frame is None:
+                break
+            stream, offset, frame_data, is_last_frame = next_frame
+            self.send_credit.used += len(frame_data)
+            packet.link_frame(stream.stream_id, offset, frame_data, is_last_frame, stream.frame_flags)
+            if is_last_frame:
+                # a stream sent in full needs no more credit, retransmissions do not use any
+                del self.send_streams[stream.stream_id]
+
+    async def send_retransmissions(self) -> None:
+        """Sends the queued control packets and packs the queued frames of lost packets into new DATA packets."""
+        while self.retransmit_control or self.retransmit_frames:
+            control_packets, self.retransmit_control = self.retransmit_control, []
+            for packet_flag, payload in control_packets:
+                packet = self.create_packet(packet_flag)
+                packet.append_data(payload)
+                await self.send_when_allowed(packet)
+
+            if self.retransmit_frames:
+                packet = self.create_packet(FLAGS.DATA_PACKET)
+                self.fill_packet(packet)
+                await self.send_when_allowed(packet)
+
+    async def send_repair_packets(self, flush: bool = False) -> None:
+        """
+        Sends the REPAIR packets of the groups of stream packets that are complete, and with `flush` the REPAIR
+        packet of the group being filled too, so the last packets of a transfer are protected as well.
+        """
+        if self.fec_encoder is None:
+            return
+        if flush:
+            repair_payload = self.fec_encoder.flush()
+            if repair_payload is not None:
+                self.repair_payloads.append(repair_payload)
+        while self.repair_payloads:
+            repair_payload = self.repair_payloads.popleft()
+            repair_packet = QUIC_PACKET(FLAGS.REPAIR, max_size=QUIC_PACKET.HEADER_LENGTH + len(repair_payload),
+                                        version=self.version)
+            repair_packet.append_data(repair_payload)
+            await self.send_when_allowed(repair_packet)
+            self.metrics.fec_repair_packets_sent += 1
+
+    async def wait_for_acknowledgements(self) -> None:
+        """Retransmits lost packets until every ack-eliciting packet that was sent is acknowledged."""
+        while self.recovery.has_packets_in_flight() or self.retransmit_frames or self.retransmit_control:
+            if self.is_closed:
+                raise Exception("The connection was closed before the data was acknowledged")
+            await self.send_retransmissions()
+            await self.send_repair_packets(flush=True)
+            self.recovery_event.clear()
+            if self.recovery.has_packets_in_flight():
+                await self.recovery_event.wait()
+
+    async def send_data(self, list_of_files: List[STREAM_DATA], priorities: Optional[List[int]] = None,
+                        weights: Optional[List[int]] = None, compress: Optional[List[bool]] = None) -> None:
+        """
+        Sends every item of the list on its own stream. An item is a bytes-like object (bytes, bytearray,
+        memoryview, mmap), which is sliced without copying, or an async iterator of bytes, which is read lazily
+        as packets are built.
+        `priorities` and `weights` optionally give each stream a priority level (0 is the most urgent) and a
+        weight for its share of its level, see stream_scheduler.STREAM_SCHEDULER.
+        `compress` optionally turns compression on or off per stream, by default it follows the connection's
+        `compression`. A stream is only compressed when the other side supports a codec that pays off for it.
+        """
+        await self.open_transport()
 
-        # Store each file in the out_streams dictionary with a unique index as the key
-        for i, file in enumerate(list_of_files):
-            self.out_streams[i + 1] = file
+        # Store each file in the out_streams dictionary with a unique stream ID as the key
+        first_stream_id = self.stream_ID + 1
+        for file in list_of_files:
+            self.stream_ID += 1
+            self.out_streams[self.stream_ID] = file
 
         # Asynchronously send the data from all streams to the server
-        await self.send_to_streams()
-        print("Data sent successfully")
+        await self.send_to_streams(priorities, weights, compress)
 
         # Clear the out_streams dictionary to free memory or prepare for new data
         self.out_streams.clear()
 
-        # Create a packet signaling the end of data transmission using the END_OF_DATA flag
-        final_packet = QUIC_PACKET(FLAGS.END_OF_DATA)
+        # Create a packet signaling the end of data transmission using the END_OF_DATA flag,
+        # it carries the stream IDs of the batch so the receiver knows when all of them are complete
+        final_packet = self.create_packet(FLAGS.END_OF_DATA)
+        final_packet.append_data(STREAM_COUNT_FORMAT.pack(first_stream_id, len(list_of_files)))
 
         # Send the end-of-data packet to the server to signal the completion of data transmission
-        self.sock.sendto(final_packet.serialize_data(), (self.host_address, self.port))
+        await self.send_when_allowed(final_packet)
+
+        # Retransmit whatever was lost until the receiver acknowledged all of it
+        await self.wait_for_acknowledgements()
+        print("Data sent successfully")
+
+    async def send_files(self, file_paths: List[str], priorities: Optional[List[int]] = None,
+                         weights: Optional[List[int]] = None, compress: Optional[List[bool]] = None) -> None:
+        """
+        Sends every file on its own stream without loading it into memory.
+        The files are memory-mapped, so only the pages of the frames being packed are read from disk.
+        """
+        with ExitStack() as open_files:
+            stream_sources = []
+            for file_path in file_paths:
+                file = open_files.enter_context(open(file_path, "rb"))
+                if os.fstat(file.fileno()).st_size == 0:
+                    # an empty file cannot be memory-mapped
+                    stream_sources.append(b'')
+                else:
+                    stream_sources.append(open_files.enter_context(
+                        mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)))
+            await self.send_data(stream_sources, priorities, weights, compress)
+            stream_sources.clear()
+
+    async def send_to_streams(self, priorities: Optional[List[int]] = None, weights: Optional[List[int]] = None,
+                              compress: Optional[List[bool]] = None) -> None:
+        """
+        Each stream gets a SEND_STREAM in the connection's scheduler. Its `send_stream_data` coroutine writes the
+        stream's data into it, and the connection's single packetizer (see `start_packetizer`) fills every packet
+        with frames of several streams in the order the scheduler picks. Returns once the last frame of every stream
+        was packed.
+        """
+        send_streams = []
+        for index, stream_id in enumerate(self.out_streams):
+            # frames are sized by `fill_packet` to fill the packets exactly
+            send_stream = SEND_STREAM(stream_id,
+                                      priorities[index] if priorities is not None else DEFAULT_STREAM_PRIORITY,
+                                      weights[index] if weights is not None else DEFAULT_STREAM_WEIGHT,
+                                      on_data=self.send_ready.set,
+                                      max_stream_data=self.peer_initial_max_stream_data)
+            self.scheduler.add(send_stream)
+            self.send_streams[stream_id] = send_stream
+            send_streams.append(send_stream)
 
-    async def send_to_streams(self) -> None:
         # Use asyncio.gather to run the `send_stream_data` coroutine for each stream concurrently
-        await asyncio.gather(*(self.send_stream_data(stream_id) for stream_id in self.out_streams))
-
-    async def send_stream_data(self, stream_id: int) -> None:
-        """
-        1. get the data from each stream by stream_id
-        2. generate random frame size and calculate number of frames needed.
-        3. calculate frames per packet
-        4. calculate number of packets needed.
-        5. divide the data to frames and add the frames to the packet.
-        6. send the frames on the stream.
-        """
-        data_from_stream = self.out_streams[stream_id]
-        # generate random frame size
-        frame_size = int(random.uniform(1000, 2000))
-        # calculate the frame payload size (without the header)
-        frame_payload_size = frame_size - QUIC_PACKET.FRAME_LENGTH
-        # calculate the number of frames per packet
-        frames_per_packet = math.floor(QUIC_PACKET.MAX_DATA_SIZE / frame_size)
-        needed_frames_amount = math.ceil(len(data_from_stream) / frame_payload_size)
-        packet_payload_size = frames_per_packet * frame_payload_size
-        needed_packets_amount = math.ceil(needed_frames_amount / frames_per_packet)
-        current_frame = 0
-
-        for i in range(needed_packets_amount):
-            #
-            if i == 0:
-                packet = QUIC_PACKET(FLAGS.FIRST_PACKET)
-
-            elif i == needed_packets_amount - 1:
-                packet = QUIC_PACKET(FLAGS.LAST_PACKET)
+        packetizer = self.start_packetizer()
+        streams_sent = asyncio.gather(*(self.send_stream_data(send_stream,
+                                                              compress[index] if compress is not None
+                                                              else self.compression)
+                                        for index, send_stream in enumerate(send_streams)),
+                                      *(send_stream.fin_packed.wait() for send_stream in send_streams))
+        try:
+            await asyncio.wait((streams_sent, packetizer), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            streams_done = streams_sent.done()
+            if not streams_done:
+                # the producers stop, their cancellation is retrieved so it is not reported as unhandled
+                streams_sent.cancel()
+                streams_sent.add_done_callback(lambda future: future.cancelled() or future.exception())
+        if not streams_done:
+            # the packetizer stopped on an error, or the connection was closed, before the streams were sent
+            if not packetizer.cancelled() and packetizer.exception() is not None:
+                raise packetizer.exception()
+            raise Exception("The connection was closed before the streams were sent")
+        await streams_sent
+
+    async def send_stream_data(self, send_stream: SEND_STREAM, compress: bool = False) -> None:
+        """
+        Writes the data of one stream into its SEND_STREAM.
+        Bytes-like data is written at once as a single view, the frames are slices of it. An async iterator is read
+        lazily, and the coroutine waits while the stream has a full buffer of data that was not packed yet,
+        which is also how it suspends while the stream or the connection is out of flow control credit.
+        """
+        stream_data = self.out_streams[send_stream.stream_id]
+        digest = STREAM_DIGEST() if self.verify else None
+        if digest is not None:
+            send_stream.frame_flags |= FRAME_FLAGS.DIGEST
+        if compress:
+            await self.send_compressed_stream_data(send_stream, stream_data, digest)
+        elif not hasattr(stream_data, '__aiter__'):
+            send_stream.write(stream_data)
+            if digest is not None:
+                # the data is hashed in the thread pool while its frames are packed (hashlib releases the GIL)
+                await asyncio.get_running_loop().run_in_executor(compression_executor(), digest.update, stream_data)
+                send_stream.write(digest.digest())
+        else:
+            async for chunk in stream_data:
+                await send_stream.space_available.wait()
+                send_stream.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+            if digest is not None:
+                send_stream.write(digest.digest())
+        send_stream.finish()
+
+    async def send_compressed_stream_data(self, send_stream: SEND_STREAM, stream_data: STREAM_DATA,
+                                          digest=None) -> None:
+        """
+        1. try every codec both sides support on the start of the stream, in the compression thread pool
+        2. keep the codec that sends the stream fastest at the connection's current rate (see compression.select_codec),
+           or send the stream as it is when none pays off
+        3. compress the stream chunk by chunk in the thread pool, so the event loop keeps packing the other streams
+           while a chunk is compressed, and mark every frame of the stream with the codec
+        4. with a `digest`, hash the data before it is compressed and end the stream with its digest, compressed too
+        """
+        loop = asyncio.get_running_loop()
+        chunks = read_chunks(stream_data, COMPRESSION_CHUNK_SIZE)
+        chunk = await anext(chunks, None)
+        codec = CODEC.NONE
+        if chunk is not None:
+            codec = await select_codec(chunk[:COMPRESSION_SAMPLE_SIZE], self.codecs & self.peer_codecs,
+                                       self.send_rate())
+        compressor = create_compressor(codec) if codec != CODEC.NONE else None
+        if compressor is not None:
+            send_stream.frame_flags |= CODEC_FRAME_FLAGS[codec]
+        while chunk is not None:
+            await send_stream.space_available.wait()
+            if digest is not None:
+                digest.update(chunk)
+            if compressor is None:
+                send_stream.write(chunk)
             else:
-                packet = QUIC_PACKET(FLAGS.DATA_PACKET)
-
-            bytes_added_until_now = i * packet_payload_size
-            for frame_offset in range(frames_per_packet):
-                start_index = bytes_added_until_now + frame_offset * frame_payload_size
-                if current_frame == needed_frames_amount - 1:
-                    end_index = start_index + min((packet_payload_size - (frame_offset - 1) * frame_payload_size),
-                                                  frame_payload_size)
-                else:
-                    end_index = start_index + frame_payload_size
-                awaiting_data = data_from_stream[start_index:end_index]
-                current_frame += 1
+                compressed_chunk = await loop.run_in_executor(compression_executor(), compressor.compress, chunk)
+                send_stream.write(compressed_chunk)
+                self.metrics.compression_input_bytes += len(chunk)
+                self.metrics.compression_output_bytes += len(compressed_chunk)
+            chunk = await anext(chunks, None)
+        if digest is not None:
+            if compressor is None:
+                send_stream.write(digest.digest())
+            else:
+                send_stream.write(compressor.compress(digest.digest()))
+        if compressor is not None:
+            compressed_chunk = compressor.flush()
+            send_stream.write(compressed_chunk)
+            self.metrics.compression_output_bytes += len(compressed_chunk)
+
+    def send_rate(self) -> float:
+        """Bytes per second the connection may send now (a window per RTT), a guess before the first RTT sample."""
+        if not self.recovery.has_rtt_sample:
+            return ASSUMED_SEND_RATE
+        return self.congestion_controller.congestion_window / self.recovery.smoothed_rtt
+
+    def start_packetizer(self) -> asyncio.Task:
+        """
+        Runs `send_scheduled_packets` as a task of the connection, unless it is already running. It stops once every
+        stream was sent, and the next stream that gets data starts it again, so the streams of send_data batches and
+        of open_stream share one packetizer and every packet carries the frames of all of them.
+        """
+        if self.packetizer is None or self.packetizer.done():
+            self.packetizer = asyncio.get_running_loop().create_task(self.send_scheduled_packets())
+        return self.packetizer
 
-                packet.link_frame(stream_id, frame_offset, awaiting_data)
-            self.sock.sendto(packet.serialize_data(), (self.host_address, self.port))
-            await asyncio.sleep(0.001)
+    async def send_scheduled_packets(self) -> None:
+        """
+        1. send a path MTU probe if the search for a larger packet size is not done
+        2. fill a packet of the current size with the frames of lost packets and of every stream that has data
+           (see `fill_packet`)
+        3. send it when the congestion window and the pacer allow it, followed by a REPAIR packet when it completes
+           a group with forward error correction
+        4. wait for data if no stream has any (or no credit to send it), until the last frame of every stream and
+           every lost frame was sent
+        """
+        while not self.scheduler.is_empty() or self.retransmit_frames:
+            if self.retransmit_control:
+                await self.send_retransmissions()
+            if self.repair_payloads:
+                await self.send_repair_packets()
+            probe_size = self.path_mtu.next_probe_size(time.monotonic())
+            if probe_size is not None:
+                await self.send_mtu_probe(probe_size)
+            packet = self.create_packet(FLAGS.DATA_PACKET)
+            self.fill_packet(packet)
+            if not packet.frames:
+                packet.release_buffer()
+                self.send_ready.clear()
+                await self.send_ready.wait()
+                continue
+
+            # the congestion window and the pacer of the connection decide when the packet leaves
+            await self.send_when_allowed(packet)
+            # yield so the streams' producers can run
+            await asyncio.sleep(0)
+        await self.send_repair_packets(flush=True)
 
     async def receive_data(self) -> List[bytes] | None:
         """
-        1. receive data from the socket and divide it into packet and frames
-        2. if the packet is not SYN/ACK/SYN_ACK/FIN start measuring time
-        3. if the stream_id is not in the streams stats dictionary,add it
+        Receives the next batch of streams into memory and returns their data, ordered by stream ID.
+        Returns None when the other side ended the connection.
+        """
+        received_streams = await self.receive_streams(lambda stream_id, index: STREAM_REASSEMBLER())
+        if received_streams is None:
+            return None
+        return [stream.data() for stream in received_streams]
+
+    async def receive_files(self, file_name_pattern: str, first_index: int = 0) -> List[str] | None:
         """
-        frames_received_counter = 0
+        Receives the next batch of streams straight into files and returns their paths.
+        Each stream is written to `file_name_pattern.format(index=i)`, i being `first_index` plus its position in
+        the batch, by FILE_STREAM_WRITER: adjacent frames are gathered into large writes made by a thread pool while
+        the next packets arrive, so the streams are never held in memory and the disk does not hold up the network.
+        Returns None when the other side ended the connection, and the paths once every file is written in full.
+        """
+        writers = []
+
+        def create_writer(stream_id: int, index: int) -> FILE_STREAM_WRITER:
+            writer = FILE_STREAM_WRITER(file_name_pattern.format(index=first_index + index),
+                                        lambda: self.on_stream_stored(stream_id))
+            writers.append(writer)
+            return writer
+
+        try:
+            received_streams = await self.receive_streams(create_writer)
+        finally:
+            for writer in writers:
+                writer.close()
+        await asyncio.gather(*(writer.wait_closed() for writer in writers))
+        if received_streams is None:
+            return None
+        return [stream.data() for stream in received_streams]
+
+    async def receive_streams(self, create_stream: Callable[[int, int], 'STREAM_REASSEMBLER']) \
+            -> List['STREAM_REASSEMBLER'] | None:
+        """
+        1. receive packets from the transport and write the frames of each stream by offset into the reassembler
+           that `create_stream(stream_id, index in the batch)` returns for it
+        2. on the first frame of a stream start measuring its time, and stop when the stream is complete
+           (every frame is checked against the flow control limits, and new limits are advertised as the data
+           is consumed, see `send_window_updates`)
+        3. END_OF_DATA tells how many streams were sent, return once all of them are complete,
+           even if some of their packets arrive after it
+        """
+        await self.open_transport()
+        expected_streams = None
+        # stream IDs are never reused, so the batch starts right after the last stream that was returned
+        first_stream_id = self.finished_streams.ends[-1] if len(self.finished_streams) else 1
         while True:
-            received_data, address = self.sock.recvfrom(QUIC_PACKET.Max_size)
-            received_packet, received_frames = QUIC_PACKET.deserialize_data(received_data)
-
-            if received_packet.packet_flag not in (FLAGS.SYN, FLAGS.ACK,
-                                                   FLAGS.SYN_ACK, FLAGS.FIN):
-
-                frames_received_counter += len(received_frames)
-                # GOT THE FIRST PACKET OF THE SPECIFIC STREAM, START MEASURING TIME
-
-                if received_packet.packet_flag == FLAGS.FIRST_PACKET:
-                    if received_frames[0].stream_id not in self.streams_stats:
-                        self.streams_stats[received_frames[0].stream_id] = Stats(received_frames[0].stream_id, 0, 0, 0,
-                                                                                 time.time())
-                    if OVERALL_DATA not in self.connection_stats:
-                        self.connection_stats[OVERALL_DATA] = Stats(0, 0, 0, 0, time.time())
-
-                if len(received_frames) != 0:
-                    self.streams_stats[received_frames[0].stream_id].frames_amount += len(received_frames)
-                    self.connection_stats[OVERALL_DATA].frames_amount += len(received_frames)
-                # GOT THE LAST PACKET OF THE SPECIFIC STREAM, MEASURING END TIME
-                if received_packet.packet_flag == FLAGS.LAST_PACKET:
-                    self.streams_stats[received_frames[0].stream_id].time = time.time() - self.streams_stats[
-                        received_frames[0].stream_id].time
-
-                # GOT THE LAST PACKET OF THE PAYLOAD, MEASURING END TIME
-                if received_packet.packet_flag == FLAGS.END_OF_DATA:
-                    self.connection_stats[OVERALL_DATA].time = time.time() - self.connection_stats[OVERALL_DATA].time
-                    self.print_stats()
-                    break
+            # the packets were already acknowledged (and duplicates dropped) by packet_received
+            incoming = await self.incoming_packets.get()
+            if incoming is None:
+                # the connection was closed on this side (idle timeout), every next call returns too
+                self.incoming_packets.put_nowait(None)
+                if expected_streams is not None or any(stream_id < BIDIRECTIONAL_STREAM_ID_BASE
+                                                       for stream_id in self.in_streams):
+                    raise Exception("The connection was closed before the streams were received")
+                return None
+            received_packet, received_frames, address, received_size = incoming
 
-                # UPDATE STATS
-                self.streams_stats[received_frames[0].stream_id].packets_amount += 1
-                self.streams_stats[received_frames[0].stream_id].total_bytes_amount += len(received_data)
-                self.connection_stats[OVERALL_DATA].packets_amount += 1
-                self.connection_stats[OVERALL_DATA].total_bytes_amount += len(received_data)
+            if received_packet.packet_flag == FLAGS.FIN:
+                if not self.is_closed:
+                    self.terminate_connection()
+                # let the transport finish closing the socket before returning to the caller
+                await asyncio.sleep(0)
+                return None
 
-                # AFTER RECEIVING PACKET, SEND ACK
-                self.sock.sendto(QUIC_PACKET(FLAGS.ACK).serialize_data(), address)
-                for frame in received_frames:
-                    if frame.stream_id not in self.in_streams:
-                        self.in_streams[frame.stream_id] = frame.frame_data
-                    else:
-                        self.in_streams[frame.stream_id] += frame.frame_data
+            if received_packet.packet_flag == FLAGS.END_OF_DATA:
+                batch_first_stream_id, streams_amount = STREAM_COUNT_FORMAT.unpack_from(received_packet.packet_data)
+                # an END_OF_DATA of a batch that was already returned is a late retransmission
+                if batch_first_stream_id not in self.finished_streams:
+                    expected_streams = range(batch_first_stream_id, batch_first_stream_id + streams_amount)
+
+            elif received_packet.packet_flag in STREAM_PACKET_FLAGS:
+                self.on_stream_frames(received_frames, lambda frame: None if frame.stream_id in self.finished_streams
+                                      else create_stream(frame.stream_id, frame.stream_id - first_stream_id))
+
+            # GOT ALL THE STREAMS OF THE PAYLOAD, MEASURING END TIME
+            if expected_streams is not None and all(
+                    stream_id in self.in_streams and self.in_streams[stream_id].is_complete()
+                    for stream_id in expected_streams):
+                self.print_stats()
+                break
+
+        received_streams = [self.in_streams.pop(stream_id) for stream_id in expected_streams]
+        for stream_id in expected_streams:
+            self.stream_receive_windows.pop(stream_id, None)
+        self.finished_streams.add(expected_streams.start, expected_streams.stop)
+        return received_streams
+
+    def on_stream_frames(self, received_frames: List['QUIC_FRAME'],
+                         create_stream: Callable[['QUIC_FRAME'], Optional['STREAM_REASSEMBLER']]) -> None:
+        """
+        Writes the frames of a packet by offset into the reassemblers of their streams, `create_stream` returns the
+        reassembler of a stream on its first frame (None drops the frame, the stream was already returned).
+        Every frame is checked against the flow control limits, and new limits are advertised as the data is
+        consumed (see `send_window_updates`). The metrics of a stream measure its time from its first frame until
+        it is complete.
+        """
+        now_ns = time.perf_counter_ns()
+        previous_stream_id = None
+        for frame in received_frames:
+            # GOT THE FIRST FRAME OF THE SPECIFIC STREAM, ITS METRICS START MEASURING TIME
+            if frame.stream_id not in self.in_streams:
+                stream = create_stream(frame)
+                if stream is None:
+                    continue
+                if frame.frame_flags & FRAME_FLAGS.DIGEST:
+                    # the digest at the end of the stream is checked, and kept out of the caller's reassembler
+                    stream = VERIFYING_STREAM(stream)
+                codec = frame_codec(frame.frame_flags)
+                if codec != CODEC.NONE:
+                    # the stream's data is decompressed on its way to the reassembler the caller wanted
+                    if not codec & self.codecs:
+                        raise Exception(f"Stream {frame.stream_id} is compressed with {codec!r}, "
+                                        f"which was not negotiated")
+                    stream = DECOMPRESSING_STREAM(stream, codec)
+                self.in_streams[frame.stream_id] = stream
+                self.stream_receive_windows[frame.stream_id] = RECEIVE_WINDOW(
+                    self.stream_receive_window, MAX_STREAM_RECEIVE_WINDOW, self.autotune_windows)
+            stream = self.in_streams[frame.stream_id]
+            was_complete = stream.is_complete()
+            self.on_stream_data_received(frame)
+            stream.add_frame(frame)
+            self.on_stream_data_consumed(frame.stream_id, stream.contiguous_size())
+
+            stream_metrics = self.metrics.stream(frame.stream_id)
+            stream_metrics.on_frame(len(frame), now_ns)
+            # the frames of a stream are packed one after the other, so the packet is counted once per stream
+            if frame.stream_id != previous_stream_id:
+                stream_metrics.packets += 1
+                previous_stream_id = frame.stream_id
+            self.metrics.stream_bytes_received += len(frame)
+            # GOT THE LAST MISSING FRAME OF THE SPECIFIC STREAM, MEASURING END TIME
+            if not was_complete and stream.is_complete():
+                stream_metrics.end_ns = now_ns
+        self.metrics.frames_received += len(received_frames)
+        self.metrics.on_data(now_ns)
+        self.send_window_updates({frame.stream_id for frame in received_frames})
+
+    async def open_stream(self, priority: int = DEFAULT_STREAM_PRIORITY, weight: int = DEFAULT_STREAM_WEIGHT) \
+            -> Tuple['STREAM_READER', 'STREAM_WRITER']:
+        """
+        Opens a bidirectional stream and returns its reader and writer, like asyncio.open_connection. Data written
+        is sent right away, next to the frames of the other streams (`priority` and `weight` give the stream its
+        share, see stream_scheduler.STREAM_SCHEDULER), and the reader returns the other side's data as it arrives.
+        The other side gets the stream from `accept_stream` once its first frame arrives.
+        """
+        await self.open_transport()
+        stream_id = self.next_bidirectional_stream_id
+        self.next_bidirectional_stream_id += 2
+        return self.create_bidirectional_stream(stream_id, priority, weight)
 
-            if received_packet.packet_flag == FLAGS.FIN:
+    async def accept_stream(self) -> Optional[Tuple['STREAM_READER', 'STREAM_WRITER']]:
+        """
+        Returns the reader and writer of the next stream the other side opened, as soon as its first frame arrived,
+        whatever the other streams are waiting for. Returns None once the other side ended the connection.
+        """
+        await self.open_transport()
+        new_stream = await self.new_streams.get()
+        if new_stream is None:
+            # every other caller gets None too
+            self.new_streams.put_nowait(None)
+            if not self.is_closed:
                 self.terminate_connection()
-                return None
+        return new_stream
+
+    def create_bidirectional_stream(self, stream_id: int, priority: int = DEFAULT_STREAM_PRIORITY,
+                                    weight: int = DEFAULT_STREAM_WEIGHT) -> Tuple['STREAM_READER', 'STREAM_WRITER']:
+        """Registers both sides of a stream: the reader receives its frames, the scheduler sends what is written."""
+        reader = STREAM_READER(stream_id, self.on_stream_read)
+        self.stream_readers[stream_id] = reader
+        send_stream = SEND_STREAM(stream_id, priority, weight, on_data=self.send_ready.set,
+                                  max_stream_data=self.peer_initial_max_stream_data)
+        self.scheduler.add(send_stream)
+        self.send_streams[stream_id] = send_stream
+        return reader, STREAM_WRITER(self, send_stream)
+
+    def bidirectional_stream_reader(self, frame: 'QUIC_FRAME') -> Optional['STREAM_READER']:
+        """The reader of the stream on its first frame, a frame of a stream the other side opens creates the stream."""
+        if frame.stream_id in self.closed_streams:
+            return None
+        reader = self.stream_readers.get(frame.stream_id)
+        if reader is None:
+            reader, writer = self.create_bidirectional_stream(frame.stream_id)
+            self.new_streams.put_nowait((reader, writer))
+        return reader
+
+    def on_stream_read(self, reader: 'STREAM_READER') -> None:
+        """
+        Data of a bidirectional stream counts as consumed once the application read it, so a reader that falls
+        behind stops the other side instead of buffering without bound. A stream read to the end is closed.
+        """
+        if self.stream_readers.get(reader.stream_id) is not reader:
+            return
+        self.on_stream_data_consumed(reader.stream_id, reader.contiguous_size())
+        if reader.at_eof():
+            del self.stream_readers[reader.stream_id]
+            self.in_streams.pop(reader.stream_id, None)
+            self.stream_receive_windows.pop(reader.stream_id, None)
+            self.closed_streams.add(reader.stream_id, reader.stream_id + 1)
+        else:
+            self.send_window_updates({reader.stream_id})
+
+    def close_streams(self) -> None:
+        """The connection is closed: readers waiting for data that will not come are woken up, and accept_stream."""
+        for reader in self.stream_readers.values():
+            reader.on_connection_closed()
+        self.new_streams.put_nowait(None)
+
+    def on_stream_data_received(self, frame: 'QUIC_FRAME') -> None:
+        """Checks a frame against the advertised limits, the connection counts the highest offset of each stream."""
+        stream_window = self.stream_receive_windows[frame.stream_id]
+        previous_highest = stream_window.highest_received
+        stream_window.on_data_received(frame.offset + len(frame))
+        self.receive_window.on_data_received(self.receive_window.highest_received +
+                                             stream_window.highest_received - previous_highest)
+
+    def on_stream_stored(self, stream_id: int) -> None:
+        """A write of a stream received into a file is done, the data it wrote no longer needs flow control credit."""
+        stream = self.in_streams.get(stream_id)
+        if stream is None:
+            return
+        self.on_stream_data_consumed(stream_id, stream.contiguous_size())
+        self.send_window_updates({stream_id})
 
-        received_files = list(self.in_streams.values())
-        self.in_streams.clear()
-        return received_files
+    def on_stream_data_consumed(self, stream_id: int, consumed: int) -> None:
+        """
+        Data counts as consumed once it is stored in order (in memory, or written to its file), the frames after a
+        gap, the writes in flight and the queued packets are what flow control keeps bounded.
+        """
+        stream_window = self.stream_receive_windows.get(stream_id)
+        if stream_window is None:
+            # a bidirectional stream that was read to the end while its last frame was being received
+            return
+        newly_consumed = consumed - stream_window.consumed
+        if newly_consumed > 0:
+            stream_window.on_data_consumed(consumed)
+            self.receive_window.on_data_consumed(self.receive_window.consumed + newly_consumed)
+
+    def send_ack(self, ack_delay: float = 0.0) -> None:
+        """Sends an ACK carrying the newest ranges of packet numbers received from the other side."""
+        ack_packet = self.create_packet(FLAGS.ACK)
+        newest_ranges = list(self.received_packet_numbers)[-MAX_ACK_RANGES:]
+        ack_packet.link_ack_ranges(newest_ranges[::-1], ack_delay, self.fec_decoder.recovered_packets)
+        self.send_packet(ack_packet)
+
+    def on_window_update(self, received_packet: 'QUIC_PACKET') -> None:
+        """Raises the send credit of the connection or of its streams, and wakes the packetizer to use it."""
+        if received_packet.packet_flag == FLAGS.MAX_DATA:
+            self.send_credit.on_max_data(MAX_DATA_FORMAT.unpack_from(received_packet.packet_data)[0])
+        else:
+            for stream_id, max_stream_data in MAX_STREAM_DATA_FORMAT.iter_unpack(received_packet.packet_data):
+                send_stream = self.send_streams.get(stream_id)
+                # streams that were already sent in full need no more credit
+                if send_stream is not None:
+                    send_stream.on_max_stream_data(max_stream_data)
+        self.send_ready.set()
+
+    def send_window_updates(self, stream_ids) -> None:
+        """
+        Advertises new limits for the given streams and for the connection, once less than half of their window is
+        left (see flow_control.RECEIVE_WINDOW). A stream whose final size is within its limit needs no more credit.
+        Window updates are small and sent right away, outside the congestion window.
+        """
+        now = time.monotonic()
+        smoothed_rtt = self.recovery.smoothed_rtt if self.recovery.has_rtt_sample else None
+        stream_updates = []
+        for stream_id in stream_ids:
+            window = self.stream_receive_windows.get(stream_id)
+            stream = self.in_streams.get(stream_id)
+            if window is None or stream is None or not window.update_needed():
+                continue
+            if stream.final_size is not None and window.max_offset >= stream.final_size:
+                continue
+            stream_updates.append((stream_id, window.update(now, smoothed_rtt)))
+            # a stream alone may use most of the connection window, the connection window grows with it
+            self.receive_window.ensure_window(int(window.window * CONNECTION_WINDOW_RATIO))
+        if stream_updates:
+            self.send_max_stream_data(stream_updates)
+        if self.receive_window.update_needed():
+            self.send_max_data(self.receive_window.update(now, smoothed_rtt))
+
+    def send_max_data(self, max_data: int) -> None:
+        packet = self.create_packet(FLAGS.MAX_DATA)
+        packet.append_data(MAX_DATA_FORMAT.pack(max_data))
+        self.send_packet(packet)
+        self.metrics.window_updates_sent += 1
+
+    def send_max_stream_data(self, stream_updates: List[Tuple[int, int]]) -> None:
+        """Sends the (stream ID, new limit) pairs in as few MAX_STREAM_DATA packets as they fit in."""
+        per_packet = (self.path_mtu.max_datagram_size - QUIC_PACKET.HEADER_LENGTH) // MAX_STREAM_DATA_FORMAT.size
+        for start in range(0, len(stream_updates), per_packet):
+            packet = self.create_packet(FLAGS.MAX_STREAM_DATA)
+            packet.append_data(b''.join(MAX_STREAM_DATA_FORMAT.pack(stream_id, max_stream_data)
+                                        for stream_id, max_stream_data in stream_updates[start:start + per_packet]))
+            self.send_packet(packet)
+            self.metrics.window_updates_sent += 1
+
+    def resend_window_update(self, lost_packet: 'SENT_PACKET') -> None:
+        """Replaces a lost window update with the current limits of the connection or of the streams still open."""
+        if self.is_closed:
+            return
+        if lost_packet.packet_flag == FLAGS.MAX_DATA:
+            self.send_max_data(self.receive_window.max_offset)
+            return
+        stream_updates = [(stream_id, self.stream_receive_windows[stream_id].max_offset)
+                          for stream_id, _ in MAX_STREAM_DATA_FORMAT.iter_unpack(lost_packet.payload)
+                          if stream_id in self.stream_receive_windows]
+        if stream_updates:
+            self.send_max_stream_data(stream_updates)
+
+    def collect_metrics(self) -> CONNECTION_METRICS:
+        """Samples the gauges (window, queues, reassembly gaps) into the connection's metrics and returns them."""
+        metrics = self.metrics
+        metrics.connection_id = self.connection_id
+        metrics.packets_lost = self.recovery.lost_packets_amount
+        metrics.packets_retransmitted = self.recovery.retransmitted_packets_amount
+        metrics.congestion_window = self.congestion_controller.congestion_window
+        metrics.bytes_in_flight = self.recovery.bytes_in_flight
+        metrics.max_datagram_size = self.path_mtu.max_datagram_size
+        metrics.smoothed_rtt = self.recovery.smoothed_rtt
+        metrics.receive_queue_depth = self.incoming_packets.qsize() if self.incoming_packets is not None else 0
+        metrics.send_queue_depth = self.transport.get_write_buffer_size() if self.transport is not None else 0
+        metrics.retransmit_queue_depth = len(self.retransmit_frames) + len(self.retransmit_control)
+        metrics.send_credit = self.send_credit.available()
+        metrics.receive_window = self.receive_window.window
+        metrics.fec_group_size = self.fec_encoder.group_size if self.fec_encoder is not None else 0
+        metrics.reassembly_gap_bytes = 0
+        for stream_id, stream in self.in_streams.items():
+            gap_bytes = sum(end - start for start, end in stream.received.gaps())
+            metrics.stream(stream_id).gap_bytes = gap_bytes
+            metrics.reassembly_gap_bytes += gap_bytes
+        return metrics
+
+    def export_metrics(self, path: str, metrics_format: str = 'json', interval: float = 1.0) -> None:
+        """
+        Writes the connection's metrics to `path` every `interval` seconds while the connection is open, and once
+        more when it terminates: 'json' appends one JSON snapshot per line, 'prometheus' rewrites the file in the
+        Prometheus text format.
+        """
+        if metrics_format not in METRICS_FORMATS:
+            raise Exception(f"Unknown metrics format {metrics_format!r}, expected one of {METRICS_FORMATS}")
+        self.metrics_export = (path, metrics_format, interval)
+        if self.transport is not None:
+            self.start_metrics_export()
+
+    def start_metrics_export(self) -> None:
+        if self.metrics_export is None or self.metrics_task is not None:
+            return
+        path, metrics_format, interval = self.metrics_export
+        self.metrics_task = asyncio.get_running_loop().create_task(
+            export_metrics_periodically(self.collect_metrics, path, metrics_format, interval))
 
     def print_stats(self) -> None:
 
         """
-         Prints the overall connection statistics and per-stream statistics, including the total bytes, packets,
-         and average transmission rates per second for both the overall connection and individual streams.
+         Prints a summary of the connection's metrics: the overall goodput and packet rate, and the bytes, packets
+         and goodput of every stream. The rates are measured with perf_counter_ns over the time data was moving,
+         a stream that has not started (or got a single packet) reports a rate of 0.
          """
+        metrics = self.collect_metrics()
         print("********** Overall Connection Statistics **********\n")
-        # Gather overall statistics for all connections
-        total_bytes = self.connection_stats[
-            OVERALL_DATA].total_bytes_amount  # Total bytes transferred in the connection
-        total_packets = self.connection_stats[OVERALL_DATA].packets_amount  # Total number of packets transferred
-        total_time = self.connection_stats[OVERALL_DATA].time  # Total time for the connection in seconds
-
-        # Calculate the average bytes per second and packets per second for the overall connection
-        overall_avg_bytes_per_sec = total_bytes / total_time
-        overall_avg_packets_per_sec = total_packets / total_time
-
-        print(f"Overall average bytes per second: {overall_avg_bytes_per_sec:.2f} bytes/sec")
-        print(f"Overall average packets per second: {overall_avg_packets_per_sec:.2f} packets/sec\n")
-
-        # Iterate over each stream's statistics and print details
-        for stream_id, stats in self.streams_stats.items():
-            # Retrieve stream-specific statistics
-            stream_total_bytes = stats.total_bytes_amount  # Total bytes transferred in the stream
-            stream_total_packets = stats.packets_amount  # Total number of packets transferred in the stream
-            stream_time = stats.time  # Total time for the stream in seconds
-
-            # Calculate the average bytes per second and packets per second for the stream
-            avg_bytes_per_sec = stream_total_bytes / stream_time
-            avg_packets_per_sec = stream_total_packets / stream_time
-
-            print(f"Stream ID: {stream_id}")
-            print(f"  Total bytes: {stream_total_bytes} bytes")
-            print(f"  Total packets: {stream_total_packets} packets")
-            print(f"  Average bytes per second: {avg_bytes_per_sec:.2f} bytes/sec")
-            print(f"  Average packets per second: {avg_packets_per_sec:.2f} packets/sec")
+        data_time = seconds_between(metrics.data_start_ns, metrics.data_end_ns)
+        packets_amount = max(metrics.packets_sent, metrics.packets_received)
+        print(f"Overall average bytes per second: {metrics.goodput():.2f} bytes/sec")
+        print(f"Overall average packets per second: {rate(packets_amount, data_time):.2f} packets/sec")
+        if metrics.stream_bytes_sent:
+            print(f"Lost packets: {metrics.packets_lost}, retransmitted packets: {metrics.packets_retransmitted}, "
+                  f"RTT samples: {metrics.rtt.count}")
+        print()
+
+        # Iterate over each stream's metrics and print details
+        for stream_metrics in metrics.streams.values():
+            stream_time = stream_metrics.duration()
+            print(f"Stream ID: {stream_metrics.stream_id}")
+            print(f"  Total bytes: {stream_metrics.bytes} bytes")
+            print(f"  Total packets: {stream_metrics.packets} packets")
+            print(f"  Average bytes per second: {rate(stream_metrics.bytes, stream_time):.2f} bytes/sec")
+            print(f"  Average packets per second: {rate(stream_metrics.packets, stream_time):.2f} packets/sec")
             print()
 
         print("********** End of Statistics **********")
 
     # will be used when we get FIN packet.
-    def terminate_connection(self) -> None:
+    def terminate_connection(self, reason: str = "Got FIN packet") -> None:
         """
-        Terminates the connection when a FIN (Finish) packet is received.
+        Terminates the connection when a FIN (Finish) packet is received, or for the `reason` that is logged.
         This method performs cleanup by closing the socket and marking the connection as closed.
         """
 
-        print(f"Got FIN packet, terminating connection")
-        self.sock.close()
+        print(reason + ", terminating connection")
+        self.recovery.stop()
+        if self.packetizer is not None and not self.packetizer.done():
+            self.packetizer.cancel()
+        self.close_streams()
+        for timer in (self.handshake_timer, self.idle_timer, self.keepalive_timer):
+            if timer is not None:
+                timer.cancel()
+        # wakes the sends waiting for ACKs or for the congestion window
+        self.recovery_event.set()
+        if self.incoming_packets is not None:
+            # wakes receive_data
+            self.incoming_packets.put_nowait(None)
+        self.stop_metrics_export()
+        if self.server is not None:
+            # the socket belongs to the server, only forget this session
+            self.server.remove_session(self)
+        elif self.transport is not None:
+            # closing the transport also closes the socket it owns
+            self.transport.close()
+        else:
+            self.sock.close()
         self.is_closed = True
 
+    def stop_metrics_export(self) -> None:
+        """Stops the periodic export after writing the final metrics, and closes the qlog trace."""
+        if self.metrics_task is not None:
+            self.metrics_task.cancel()
+            self.metrics_task = None
+        if self.metrics_export is not None:
+            path, metrics_format, _ = self.metrics_export
+            write_metrics(self.collect_metrics(), path, metrics_format)
+            self.metrics_export = None
+        if self.trace is not None:
+            self.trace.close()
+
     # send FIN packet to the other side.
 
     def end_communication(self):
         """
         This method first checks if the connection is already closed. If not, it sends a FIN packet
         to signal that no more data will be sent and then calls `terminate_connection` to clean up the connection.
+        The FIN is not sent again if it is lost, `close` waits for it to be acknowledged.
+        """
+
+        if self.is_closed:
+            return
+
+        self.send_packet(self.create_packet(FLAGS.FIN))
+        self.terminate_connection("Sent FIN packet")
+
+    async def close(self) -> None:
+        """
+        Graceful shutdown:
+        1. wait until the data written to the streams was sent (streams of open_stream must be closed first) and
+           acknowledged, retransmitting what is lost
+        2. send the FIN and wait for its ACK, sending it again on every probe timeout, CLOSE_PTO_COUNT times at
+           most (the other side closes as soon as it gets the FIN, and its ACK may be lost too)
+        3. close the connection
+        Raises if the connection was closed (by the idle timeout, when the other side stopped answering) before
+        the data was acknowledged.
+        """
+        if self.is_closed:
+            return
+        await self.open_transport()
+        try:
+            if self.packetizer is not None and not self.packetizer.done():
+                await asyncio.wait((self.packetizer,))
+            await self.wait_for_acknowledgements()
+            await self.send_when_allowed(self.create_packet(FLAGS.FIN))
+            while self.recovery.has_packets_in_flight() and self.recovery.pto_count <= CLOSE_PTO_COUNT and \
+                    not self.is_closed:
+                await self.send_retransmissions()
+                self.recovery_event.clear()
+                await self.recovery_event.wait()
+            if self.recovery.has_packets_in_flight() and not self.is_closed:
+                print("The FIN was not acknowledged, closing the connection")
+        finally:
+            if not self.is_closed:
+                self.terminate_connection("Closed after the FIN")
+
+
+# issues the tickets of connections that listen on their own socket (listen_to), for the lifetime of the process
+listen_ticket_issuer = TICKET_ISSUER()
+
+
+class QUIC_PROTOCOL(asyncio.DatagramProtocol):
+    """
+    asyncio datagram protocol used by QUIC_CONNECTION.
+
+    Every datagram that arrives is parsed into a packet and its frames as soon as the event loop reads it,
+    and is handed to the connection together with the sender address and the datagram size.
+    The protocol also tracks the transport's flow control, so senders can wait while its buffer is full.
+    """
+
+    def __init__(self, connection: Optional[QUIC_CONNECTION]):
+        self.connection = connection
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address: Tuple[str, int]) -> None:
+        try:
+            received_packet, received_frames = QUIC_PACKET.deserialize_data(data)
+        except Exception:
+            # a malformed datagram (a stray packet, a port scan) is dropped, it is not a packet of the connection
+            return
+        self.connection.packet_received(received_packet, received_frames, address, len(data))
+
+    def error_received(self, exc: Exception) -> None:
+        # UDP errors (e.g. ICMP port unreachable after the peer closed) are not fatal for the connection,
+        # but a datagram larger than the path MTU the kernel knows means the packets have to get smaller
+        if getattr(exc, 'errno', None) == errno.EMSGSIZE and self.connection is not None:
+            self.connection.on_datagram_too_big()
+
+    def pause_writing(self) -> None:
+        self.writable.clear()
+
+    def resume_writing(self) -> None:
+        self.writable.set()
+
+
+class QUIC_SERVER:
+    """
+    Serves many clients from one listening socket.
+
+    The server keeps a connection table keyed by connection ID. Every SYN with an unknown connection ID
+    creates a new QUIC_CONNECTION session that shares the server's transport, gets a SYN_ACK and is handed
+    to `accept`. Every other datagram is routed to the queue of the session it belongs to, so each session
+    keeps its own reassembly state and statistics while all of them run on one event loop.
+    """
+
+    def __init__(self, congestion_control: str = 'newreno', stream_receive_window: int = INITIAL_MAX_STREAM_DATA,
+                 connection_receive_window: int = INITIAL_MAX_DATA, autotune_windows: bool = True,
+                 ticket_issuer: Optional[TICKET_ISSUER] = None, compression: bool = False,
+                 codecs: CODEC = AVAILABLE_CODECS, fec: bool = False,
+                 versions: Sequence[int] = SUPPORTED_VERSIONS, verify: bool = False,
+                 idle_timeout: Optional[float] = IDLE_TIMEOUT, keepalive_interval: Optional[float] = None):
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.sock.setsockopt(SOL_SOCKET, SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        disable_fragmentation(self.sock)
+        self.congestion_control = congestion_control
+        # the flow control windows every session starts with
+        self.stream_receive_window = stream_receive_window
+        self.connection_receive_window = connection_receive_window
+        self.autotune_windows = autotune_windows
+        # the codecs the sessions decompress, and whether the streams they send are compressed with them
+        self.compression = compression
+        self.codecs = codecs
+        # whether the sessions protect the streams they send with forward error correction
+        self.fec = fec
+        # the wire formats the sessions read and send in, see VERSION
+        self.versions = tuple(versions)
+        # whether the streams the sessions send end with a digest of their data
+        self.verify = verify
+        # the timers of every session, a session the client stopped answering is dropped after `idle_timeout`
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        # issues the resumption tickets of the sessions and checks the tickets of resumed ones, servers that share
+        # the issuer's secret (e.g. the workers of one port) accept each other's tickets
+        self.ticket_issuer = ticket_issuer if ticket_issuer is not None else TICKET_ISSUER()
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.protocol: Optional[QUIC_SERVER_PROTOCOL] = None
+        self.sessions: Dict[int, QUIC_CONNECTION] = {}
+        self.new_sessions: Optional[asyncio.Queue] = None
+        self.is_closed = False
+
+    async def listen_to(self, host: str, port: int) -> None:
+        """Binds the listening socket and starts demultiplexing incoming datagrams."""
+        print(f"Server listening for incoming connections on {host}:{port}")
+        self.sock.bind((host, port))
+        self.new_sessions = asyncio.Queue()
+        self.transport, self.protocol = await open_datagram_transport(self.sock, lambda: QUIC_SERVER_PROTOCOL(self))
+
+    async def accept(self) -> QUIC_CONNECTION:
+        """Waits for the next client to complete the handshake and returns its session."""
+        return await self.new_sessions.get()
+
+    def dispatch(self, data: bytes, address: Tuple[str, int]) -> None:
+        """
+        1. parse the datagram and look up the session by its connection ID
+        2. a SYN for an unknown connection ID opens a new session (resumed if it carries a valid ticket),
+           a repeated SYN is answered again
+        3. any other packet is put on the session's queue, packets of unknown connections are dropped
+           (0-RTT data that overtook its SYN is sent again by the client's loss recovery), and so are malformed
+           datagrams, so a stray packet does not stop the datagrams of the other sessions read in the same batch
         """
+        try:
+            received_packet, received_frames = QUIC_PACKET.deserialize_data(data)
+        except Exception:
+            return
+        session = self.sessions.get(received_packet.connection_id)
 
+        if received_packet.packet_flag == FLAGS.SYN:
+            if session is None:
+                session = self.create_session(received_packet.connection_id, address)
+                session.handshake_payload = session.accept_handshake(received_packet.packet_data, self.ticket_issuer)
+                session.handshake_complete.set()
+                self.new_sessions.put_nowait(session)
+            # the SYN_ACK is sent for repeated SYNs too, in case the first one was lost
+            accept_packet = QUIC_PACKET(FLAGS.SYN_ACK)
+            accept_packet.append_data(session.handshake_payload)
+            session.send_packet(accept_packet)
+            return
+
+        if session is not None:
+            session.packet_received(received_packet, received_frames, address, len(data))
+
+    def create_session(self, connection_id: int, address: Tuple[str, int]) -> QUIC_CONNECTION:
+        session = QUIC_CONNECTION(server=self, congestion_control=self.congestion_control,
+                                  stream_receive_window=self.stream_receive_window,
+                                  connection_receive_window=self.connection_receive_window,
+                                  autotune_windows=self.autotune_windows, compression=self.compression,
+                                  codecs=self.codecs, fec=self.fec, versions=self.versions,
+                                  verify=self.verify, idle_timeout=self.idle_timeout,
+                                  keepalive_interval=self.keepalive_interval)
+        session.connection_id = connection_id
+        session.peer_address = address
+        session.transport = self.transport
+        session.protocol = self.protocol
+        session.incoming_packets = asyncio.Queue()
+        session.start_timers()
+        self.sessions[connection_id] = session
+        return session
+
+    def remove_session(self, session: QUIC_CONNECTION) -> None:
+        self.sessions.pop(session.connection_id, None)
+
+    def close(self) -> None:
+        """Closes the listening socket, every session that is still open is dropped with it."""
         if self.is_closed:
             return
+        # the sessions' receivers, senders and stream readers stop waiting, every session leaves the table
+        for session in list(self.sessions.values()):
+            session.terminate_connection("Server closed")
+        self.sessions.clear()
+        if self.transport is not None:
+            self.transport.close()
+        else:
+            self.sock.close()
+        self.is_closed = True
+
+
+class QUIC_SERVER_PROTOCOL(QUIC_PROTOCOL):
+    """Datagram protocol of a QUIC_SERVER, hands every datagram to the server for demultiplexing."""
+
+    def __init__(self, server: QUIC_SERVER):
+        super().__init__(None)
+        self.server = server
+
+    def datagram_received(self, data: bytes, address: Tuple[str, int]) -> None:
+        self.server.dispatch(data, address)
+
+
+class RANGE_SET:
+    """
+    A set of integers stored as sorted, merged [start, end) ranges.
+    Used for the byte ranges received on a stream and for the packet numbers received on a connection.
+    """
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+
+    def add(self, start: int, end: int) -> None:
+        """Adds [start, end) to the set, merging it with every range it touches."""
+        if start >= end:
+            return
+        first = bisect_left(self.ends, start)
+        last = bisect_right(self.starts, end)
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+
+    def covers(self, start: int, end: int) -> bool:
+        """Returns True if every integer of [start, end) is in the set."""
+        index = bisect_right(self.starts, start) - 1
+        return index >= 0 and self.ends[index] >= end
+
+    def gaps(self, limit: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Returns the [start, end) ranges missing from 0 up to `limit` (or up to the last range)."""
+        missing = []
+        position = 0
+        for start, end in zip(self.starts, self.ends):
+            if start > position:
+                missing.append((position, start))
+            position = end
+        if limit is not None and position < limit:
+            missing.append((position, limit))
+        return missing
+
+    def __contains__(self, value: int) -> bool:
+        return self.covers(value, value + 1)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class SENT_PACKET:
+    """
+    What the sender remembers about an ack-eliciting packet until it is acknowledged or declared lost:
+    when it was sent, its size, and the frames or control payload to send again if it is lost.
+    """
+
+    def __init__(self, packet: 'QUIC_PACKET', size: int, time_sent: float):
+        self.packet_number = packet.packet_ID
+        self.packet_flag = packet.packet_flag
+        self.frames = packet.frames
+        # the padding of a path MTU probe is never sent again
+        self.payload = bytes(packet.packet_data) if packet.packet_flag not in (*STREAM_PACKET_FLAGS,
+                                                                               FLAGS.PMTU_PROBE) else b''
+        self.size = size
+        self.time_sent = time_sent
+        # set once the packet's content was sent again as a probe, so it is not retransmitted twice
+        self.retransmitted = False
+
+
+class LOSS_RECOVERY:
+    """
+    Sender-side loss recovery of a connection, following the RFC 9002 algorithms.
+
+    Every ack-eliciting packet is kept in `sent_packets` until an ACK range covers it. ACKs update the RTT
+    estimate, and a packet is declared lost when a packet sent `PACKET_THRESHOLD` packets later was acknowledged,
+    or when it is older than `TIME_THRESHOLD` RTTs. When no ACK arrives for a probe timeout (PTO), the oldest
+    packets in flight are sent again as probes. Lost packets are handed to the `on_packets_lost` callback,
+    and sent, acknowledged and lost packets are reported to the congestion controller.
+    """
+    PACKET_THRESHOLD = 3
+    TIME_THRESHOLD = 9 / 8
+    TIMER_GRANULARITY = 0.001  # seconds
+    INITIAL_RTT = 0.333  # seconds, used until the first RTT sample
+    MAX_ACK_DELAY = 0.025  # seconds
+    PTO_PROBE_PACKETS = 2
+
+    def __init__(self, on_packets_lost: Callable[..., None], congestion_controller: CONGESTION_CONTROLLER,
+                 on_rtt_sample: Optional[Callable[[float], None]] = None):
+        self.on_packets_lost = on_packets_lost
+        self.congestion_controller = congestion_controller
+        self.on_rtt_sample = on_rtt_sample
+        self.sent_packets: Dict[int, SENT_PACKET] = {}  # insertion order is packet number order
+        self.largest_acked_packet = -1
+        self.bytes_in_flight = 0
+
+        # RTT estimation
+        self.latest_rtt = 0.0
+        self.min_rtt = math.inf
+        self.smoothed_rtt = self.INITIAL_RTT
+        self.rttvar = self.INITIAL_RTT / 2
+        self.has_rtt_sample = False
+
+        self.pto_count = 0
+        self.loss_timer: Optional[asyncio.TimerHandle] = None
+
+        # counters for statistics
+        self.lost_packets_amount = 0
+        self.retransmitted_packets_amount = 0
+
+    def has_packets_in_flight(self) -> bool:
+        return len(self.sent_packets) != 0
+
+    def on_packet_sent(self, sent_packet: SENT_PACKET) -> None:
+        self.sent_packets[sent_packet.packet_number] = sent_packet
+        self.bytes_in_flight += sent_packet.size
+        self.congestion_controller.on_packet_sent(sent_packet.size, sent_packet.time_sent)
+        self.set_loss_timer()
+
+    def on_ack_received(self, ack_ranges: List[Tuple[int, int]], ack_delay: float) -> List[SENT_PACKET]:
+        """
+        1. remove every sent packet covered by the ACK ranges
+        2. take an RTT sample if the largest acknowledged packet was newly acknowledged
+        3. detect lost packets and re-arm the loss timer
+        """
+        ack_ranges = sorted(ack_ranges)
+        acked_packets = []
+        range_index = 0
+        for packet_number in list(self.sent_packets):
+            while range_index < len(ack_ranges) and ack_ranges[range_index][1] <= packet_number:
+                range_index += 1
+            if range_index == len(ack_ranges):
+                break
+            if ack_ranges[range_index][0] <= packet_number:
+                acked_packets.append(self.sent_packets.pop(packet_number))
+        if not acked_packets:
+            return acked_packets
+
+        for acked_packet in acked_packets:
+            self.bytes_in_flight -= acked_packet.size
+        now = time.monotonic()
+        largest_newly_acked = acked_packets[-1]
+        if largest_newly_acked.packet_number > self.largest_acked_packet:
+            self.largest_acked_packet = largest_newly_acked.packet_number
+            self.update_rtt(now - largest_newly_acked.time_sent, ack_delay)
+        self.congestion_controller.on_packets_acked(acked_packets, now, self.smoothed_rtt)
+
+        self.pto_count = 0
+        self.detect_and_report_lost_packets()
+        self.set_loss_timer()
+        return acked_packets
+
+    def update_rtt(self, latest_rtt: float, ack_delay: float) -> None:
+        if self.on_rtt_sample is not None:
+            self.on_rtt_sample(latest_rtt)
+        self.latest_rtt = latest_rtt
+        self.min_rtt = min(self.min_rtt, latest_rtt)
+        if not self.has_rtt_sample:
+            self.smoothed_rtt = latest_rtt
+            self.rttvar = latest_rtt / 2
+            self.has_rtt_sample = True
+            return
+        # the ACK delay is only subtracted if the result is not below the minimum RTT
+        ack_delay = min(ack_delay, self.MAX_ACK_DELAY)
+        adjusted_rtt = latest_rtt - ack_delay if latest_rtt - ack_delay >= self.min_rtt else latest_rtt
+        self.rttvar = 3 / 4 * self.rttvar + 1 / 4 * abs(self.smoothed_rtt - adjusted_rtt)
+        self.smoothed_rtt = 7 / 8 * self.smoothed_rtt + 1 / 8 * adjusted_rtt
+
+    def loss_delay(self) -> float:
+        return max(self.TIME_THRESHOLD * max(self.latest_rtt, self.smoothed_rtt), self.TIMER_GRANULARITY)
+
+    def probe_timeout(self) -> float:
+        pto = self.smoothed_rtt + max(4 * self.rttvar, self.TIMER_GRANULARITY) + self.MAX_ACK_DELAY
+        return pto * (2 ** self.pto_count)
+
+    def detect_and_report_lost_packets(self) -> None:
+        """Declares lost every unacknowledged packet that is too far behind the largest acknowledged one."""
+        lost_send_time = time.monotonic() - self.loss_delay()
+        lost_packets = []
+        for packet_number, sent_packet in self.sent_packets.items():
+            if packet_number > self.largest_acked_packet:
+                break
+            if (sent_packet.time_sent <= lost_send_time or
+                    self.largest_acked_packet >= packet_number + self.PACKET_THRESHOLD):
+                lost_packets.append(sent_packet)
+        self.report_lost_packets(lost_packets)
+
+    def report_lost_packets(self, lost_packets: List[SENT_PACKET]) -> None:
+        for lost_packet in lost_packets:
+            del self.sent_packets[lost_packet.packet_number]
+            self.bytes_in_flight -= lost_packet.size
+        self.lost_packets_amount += len(lost_packets)
+        # a lost path MTU probe says nothing about congestion
+        self.congestion_controller.on_packets_lost([lost_packet for lost_packet in lost_packets
+                                                    if lost_packet.packet_flag != FLAGS.PMTU_PROBE], time.monotonic())
+        # packets whose content was already sent again as a probe are not retransmitted a second time
+        to_retransmit = [lost_packet for lost_packet in lost_packets if not lost_packet.retransmitted]
+        self.retransmitted_packets_amount += len(to_retransmit)
+        if to_retransmit:
+            self.on_packets_lost(to_retransmit)
+
+    def set_loss_timer(self) -> None:
+        """
+        Arms the timer for the earliest time-threshold loss, or for the probe timeout if no packet
+        can be declared lost by time yet.
+        """
+        if self.loss_timer is not None:
+            self.loss_timer.cancel()
+            self.loss_timer = None
+        if not self.sent_packets:
+            return
+
+        now = time.monotonic()
+        oldest_packet = next(iter(self.sent_packets.values()))
+        if oldest_packet.packet_number < self.largest_acked_packet:
+            deadline = oldest_packet.time_sent + self.loss_delay()
+        else:
+            newest_packet = next(reversed(self.sent_packets.values()))
+            deadline = newest_packet.time_sent + self.probe_timeout()
+        self.loss_timer = asyncio.get_running_loop().call_later(max(deadline - now, 0), self.on_loss_timeout)
+
+    def on_loss_timeout(self) -> None:
+        self.loss_timer = None
+        oldest_packet = next(iter(self.sent_packets.values()), None)
+        if oldest_packet is None:
+            return
+        if oldest_packet.packet_number < self.largest_acked_packet:
+            self.detect_and_report_lost_packets()
+        else:
+            # PROBE TIMEOUT: send the content of the oldest packets in flight again, the packets stay in flight.
+            # Path MTU probes still unacknowledged are lost, they are not sent again
+            self.pto_count += 1
+            self.report_lost_packets([sent_packet for sent_packet in self.sent_packets.values()
+                                      if sent_packet.packet_flag == FLAGS.PMTU_PROBE])
+            probe_packets = [sent_packet for sent_packet in self.sent_packets.values()
+                             if not sent_packet.retransmitted][:self.PTO_PROBE_PACKETS]
+            for probe_packet in probe_packets:
+                probe_packet.retransmitted = True
+            self.retransmitted_packets_amount += len(probe_packets)
+            self.on_packets_lost(probe_packets, is_probe=True)
+        self.set_loss_timer()
+
+    def stop(self) -> None:
+        if self.loss_timer is not None:
+            self.loss_timer.cancel()
+            self.loss_timer = None
+
+
+class STREAM_REASSEMBLER:
+    """
+    Rebuilds one stream from frames that may arrive in any order.
+
+    Every frame is written at its byte offset into a single bytearray, which is preallocated once the final size
+    of the stream is known (from the frame marked FIN). The received byte ranges are kept as sorted, merged
+    intervals, so gaps can be reported and completion checked no matter how the datagrams were reordered,
+    and the whole stream is rebuilt in O(n) with no concatenation.
+    Subclasses store the data elsewhere by overriding `allocate` and `store`.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.final_size: Optional[int] = None
+        # the byte ranges received so far
+        self.received = RANGE_SET()
+
+    def add_frame(self, frame: 'QUIC_FRAME') -> None:
+        """Writes the frame's data at its offset and records the range it covers."""
+        start = frame.offset
+        end = start + len(frame.frame_data)
+        if frame.frame_flags & FRAME_FLAGS.FIN and self.final_size is None:
+            self.final_size = end
+            self.allocate(end)
+        if self.final_size is not None and end > self.final_size:
+            raise Exception(f"Frame ends at {end}, beyond the final size {self.final_size} of the stream")
+
+        self.store(start, frame.frame_data)
+        self.received.add(start, end)
+
+    def allocate(self, final_size: int) -> None:
+        """Called once, when the final size of the stream becomes known."""
+        if len(self.buffer) < final_size:
+            self.buffer.extend(bytes(final_size - len(self.buffer)))
+
+    def store(self, offset: int, data: bytes) -> None:
+        end = offset + len(data)
+        if len(self.buffer) < end:
+            # amortized growth until the final size is known
+            self.buffer.extend(bytes(end - len(self.buffer)))
+        self.buffer[offset:end] = data
+
+    def gaps(self) -> List[Tuple[int, int]]:
+        """Returns the [start, end) ranges that are still missing, up to the final size if it is known."""
+        return self.received.gaps(self.final_size)
+
+    def contiguous_size(self) -> int:
+        """Returns how many bytes from the start of the stream were received without a gap."""
+        if not self.received.starts or self.received.starts[0] != 0:
+            return 0
+        return self.received.ends[0]
+
+    def is_complete(self) -> bool:
+        if self.final_size is None:
+            return False
+        return self.final_size == 0 or self.received.covers(0, self.final_size)
+
+    def data(self) -> bytearray:
+        """Returns the reassembled stream, only valid once the stream is complete."""
+        return self.buffer
+
+    def close(self) -> None:
+        """Releases what the stream holds once it was returned, nothing for a stream in memory."""
+
+
+class FILE_STREAM_WRITER(STREAM_REASSEMBLER):
+    """
+    Reassembles a stream straight into a file, without writing to disk on the event loop.
+
+    Frames that continue one another are gathered into a single write (one pwritev of up to DISK_WRITE_SIZE bytes,
+    sent at the latest once the transport's batch of datagrams was handled), and the writes run in the bounded
+    thread pool of disk_writer while packets keep arriving, so the disk works while the network does. The file is
+    preallocated in the pool once the final size is known. Only the received ranges and the writes in flight are
+    kept in memory: the data counts as consumed once it is on disk (`contiguous_size`), and `on_written` is called
+    after every write, so flow control slows the sender down to what the disk keeps up with.
+    """
+
+    def __init__(self, file_path: str, on_written: Optional[Callable[[], None]] = None):
+        super().__init__()
+        self.file_path = file_path
+        self.on_written = on_written
+        self.fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        # the frames gathered for the next write, from `run_offset` on
+        self.run_offset = 0
+        self.run_buffers: List[memoryview] = []
+        self.run_size = 0
+        self.written = RANGE_SET()
+        self.writes: set = set()  # writes queued in the pool or running
+        self.closing = False
+        self.error: Optional[BaseException] = None
+        self.write_done = asyncio.Event()
+
+    def allocate(self, final_size: int) -> None:
+        if final_size != 0:
+            self.submit(preallocate, self.fd, final_size)
+
+    def store(self, offset: int, data: bytes) -> None:
+        if self.run_buffers and offset != self.run_offset + self.run_size:
+            self.flush()
+        if not self.run_buffers:
+            self.run_offset = offset
+            # the frames that arrive in the same batch of datagrams join the write
+            asyncio.get_running_loop().call_soon(self.flush)
+        self.run_buffers.append(memoryview(data))
+        self.run_size += len(data)
+        if self.run_size >= DISK_WRITE_SIZE or len(self.run_buffers) >= MAX_WRITE_BUFFERS:
+            self.flush()
+
+    def flush(self) -> None:
+        """Queues the gathered frames as one write."""
+        if not self.run_buffers:
+            return
+        offset, size = self.run_offset, self.run_size
+        write = self.submit(write_at, self.fd, self.run_buffers, offset)
+        write.add_done_callback(lambda _: self.on_write_done(offset, offset + size))
+        self.run_buffers = []
+        self.run_size = 0
+
+    def submit(self, function, *args) -> asyncio.Future:
+        write = asyncio.get_running_loop().run_in_executor(disk_write_executor(), function, *args)
+        self.writes.add(write)
+        write.add_done_callback(self.on_done)
+        return write
+
+    def on_done(self, write: asyncio.Future) -> None:
+        self.writes.discard(write)
+        if not write.cancelled() and write.exception() is not None and self.error is None:
+            self.error = write.exception()
+        self.write_done.set()
+        if self.closing and not self.writes:
+            self.close_file()
+
+    def on_write_done(self, start: int, end: int) -> None:
+        self.written.add(start, end)
+        if self.on_written is not None:
+            self.on_written()
+
+    def contiguous_size(self) -> int:
+        """Returns how many bytes from the start of the stream are written to the file without a gap."""
+        if not self.written.starts or self.written.starts[0] != 0:
+            return 0
+        return self.written.ends[0]
+
+    def data(self) -> str:
+        return self.file_path
+
+    def close(self) -> None:
+        """Queues what is still gathered, the file is closed once every write is done (see `wait_closed`)."""
+        if self.closing:
+            return
+        self.flush()
+        self.closing = True
+        if not self.writes:
+            self.close_file()
+
+    async def wait_closed(self) -> None:
+        """Waits until the stream is on disk and the file closed, and raises the error of a failed write."""
+        while self.writes:
+            self.write_done.clear()
+            await self.write_done.wait()
+        if self.error is not None:
+            raise self.error
+
+    def close_file(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class IN_ORDER_STREAM(STREAM_REASSEMBLER, abc.ABC):
+    """
+    Base of the reassemblers that hand a stream on in order instead of storing it by offset.
+
+    The part received without a gap goes to `on_data_in_order` as it grows, each byte once (retransmissions that
+    overlap it are cut), so only the frames after a gap are kept, copied in a heap by offset, until the gap is
+    filled. `on_stream_end` is called once every byte up to the final size was handed on.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.in_order_offset = 0  # bytes handed on in order
+        self.pending: List[Tuple[int, bytes]] = []
+        self.ended = False
+
+    def allocate(self, final_size: int) -> None:
+        # nothing is stored by offset
+        pass
+
+    def store(self, offset: int, data: bytes) -> None:
+        if offset > self.in_order_offset:
+            heapq.heappush(self.pending, (offset, bytes(data)))
+            return
+        self.hand_on(offset, data)
+        while self.pending and self.pending[0][0] <= self.in_order_offset:
+            self.hand_on(*heapq.heappop(self.pending))
+        if self.final_size is not None and self.in_order_offset >= self.final_size and not self.ended:
+            self.ended = True
+            self.on_stream_end()
+
+    def hand_on(self, offset: int, data: bytes) -> None:
+        end = offset + len(data)
+        if end <= self.in_order_offset:
+            return
+        data = data[self.in_order_offset - offset:]
+        self.in_order_offset = end
+        self.on_data_in_order(data)
+
+    @abc.abstractmethod
+    def on_data_in_order(self, data: bytes) -> None:
+        """Handles the next part of the stream in order, `in_order_offset` already counts it."""
+
+    def on_stream_end(self) -> None:
+        """The whole stream was handed on."""
+
+
+class DECOMPRESSING_STREAM(IN_ORDER_STREAM):
+    """
+    Receives a compressed stream into another reassembler (`sink`, in memory or a file).
+
+    The frames are placed by their offsets in the compressed data, and the compressed stream is decompressed in
+    order and its output written on to the sink. Once every compressed byte arrived the decompressor is flushed
+    and the sink learns the final size of the decompressed stream. The compressed bytes count as consumed once
+    their output is stored by the sink (`contiguous_size`), so flow control waits for the disk of a file sink.
+    """
+
+    def __init__(self, sink: STREAM_REASSEMBLER, codec: CODEC):
+        super().__init__()
+        self.sink = sink
+        self.decompressor = DECOMPRESSOR(codec)
+        self.output_offset = 0  # decompressed bytes written to the sink
+        # (compressed offset, output offset) after every decompressed part whose output the sink may not have stored
+        self.checkpoints: deque = deque()
+        self.stored_offset = 0  # compressed bytes whose output the sink stored
+
+    def on_data_in_order(self, data: bytes) -> None:
+        self.write_output(self.decompressor.decompress(data), False)
+        self.checkpoints.append((self.in_order_offset, self.output_offset))
+
+    def on_stream_end(self) -> None:
+        self.write_output(self.decompressor.flush(), True)
+
+    def write_output(self, output: bytes, is_last: bool) -> None:
+        self.sink.add_frame(QUIC_FRAME(0, self.output_offset, output,
+                                       FRAME_FLAGS.FIN if is_last else FRAME_FLAGS.NONE))
+        self.output_offset += len(output)
+
+    def contiguous_size(self) -> int:
+        # the compressed bytes up to the last part whose output the sink stored in order
+        stored_output = self.sink.contiguous_size()
+        while self.checkpoints and self.checkpoints[0][1] <= stored_output:
+            self.stored_offset = self.checkpoints.popleft()[0]
+        return self.stored_offset
+
+    def is_complete(self) -> bool:
+        return super().is_complete() and self.sink.is_complete()
+
+    def data(self):
+        return self.sink.data()
+
+    def close(self) -> None:
+        self.sink.close()
+
+
+class VERIFYING_STREAM(IN_ORDER_STREAM):
+    """
+    Checks a stream sent with `verify` on its way to another reassembler (`sink`): the stream ends with the
+    STREAM_DIGEST of its data. The stream is hashed in order and written on to the sink, except the last
+    STREAM_DIGEST_SIZE bytes received in order, which are held back until the end of the stream shows they are the
+    digest. A stream whose data does not match its digest raises an exception, in constant memory whatever its size.
+    """
+
+    def __init__(self, sink: STREAM_REASSEMBLER):
+        super().__init__()
+        self.sink = sink
+        self.digest = STREAM_DIGEST()
+        self.output_offset = 0  # bytes written to the sink
+        self.held_back = b''
+
+    def allocate(self, final_size: int) -> None:
+        # the final size counts the digest, the sink learns its own when the stream is verified
+        if final_size < STREAM_DIGEST_SIZE:
+            raise Exception(f"Stream of {final_size} bytes is too short to end with its digest")
+
+    def on_data_in_order(self, data: bytes) -> None:
+        """Hashes and writes the data, except the last bytes of the stream so far."""
+        if len(data) >= STREAM_DIGEST_SIZE:
+            self.write_output(self.held_back)
+            self.write_output(data[:-STREAM_DIGEST_SIZE])
+            self.held_back = bytes(data[-STREAM_DIGEST_SIZE:])
+        else:
+            held_back = self.held_back + bytes(data)
+            self.write_output(held_back[:-STREAM_DIGEST_SIZE])
+            self.held_back = held_back[-STREAM_DIGEST_SIZE:]
+
+    def on_stream_end(self) -> None:
+        if self.held_back != self.digest.digest():
+            raise Exception("Stream data does not match its digest")
+        self.sink.add_frame(QUIC_FRAME(0, self.output_offset, b'', FRAME_FLAGS.FIN))
+
+    def write_output(self, output: bytes) -> None:
+        if len(output) == 0:
+            return
+        self.digest.update(output)
+        self.sink.add_frame(QUIC_FRAME(0, self.output_offset, output))
+        self.output_offset += len(output)
+
+    def contiguous_size(self) -> int:
+        # what the sink stored in order, and the digest bytes held back
+        return self.sink.contiguous_size() + self.in_order_offset - self.output_offset
+
+    def is_complete(self) -> bool:
+        return super().is_complete() and self.sink.is_complete()
+
+    def data(self):
+        return self.sink.data()
 
-        self.sock.sendto(QUIC_PACKET(FLAGS.FIN).serialize_data(), (self.host_address, self.port))
-        self.terminate_connection()
+    def close(self) -> None:
+        self.sink.close()
 
 
-class Stats:
-    def __init__(self, stream_id: int, packets_amount: int, frames_amount: int, bytes_amount: int, _time: float):
+class STREAM_READER(IN_ORDER_STREAM):
+    """
+    The receive side of a bidirectional stream (see QUIC_CONNECTION.open_stream), read like an asyncio.StreamReader.
+
+    The data received in order is queued for `read`, so it is returned as soon as it arrives, whatever the other
+    streams of the connection are waiting for. `on_read` tells the connection how much was read, which is what flow
+    control counts as consumed.
+    """
+
+    def __init__(self, stream_id: int, on_read: Callable[['STREAM_READER'], None]):
+        super().__init__()
         self.stream_id = stream_id
-        self.packets_amount = packets_amount
-        self.frames_amount = frames_amount
-        self.total_bytes_amount = bytes_amount
-        self.time = _time
+        self.on_read = on_read
+        self.chunks: deque = deque()  # data received in order and not read yet
+        self.consumed = 0  # bytes read
+        self.data_ready = asyncio.Event()
+        self.connection_closed = False
+
+    def on_data_in_order(self, data: bytes) -> None:
+        self.chunks.append(data)
+        self.data_ready.set()
+
+    def on_stream_end(self) -> None:
+        self.data_ready.set()
+        if self.at_eof():
+            # the end of a stream whose data was already read
+            self.on_read(self)
+
+    def contiguous_size(self) -> int:
+        return self.consumed
+
+    def at_eof(self) -> bool:
+        """True once the whole stream was read."""
+        return self.final_size is not None and self.consumed >= self.final_size
+
+    async def read(self, n: int = -1) -> bytes:
+        """
+        Returns up to `n` bytes as soon as any were received in order, and b'' at the end of the stream.
+        With `n` -1 it reads until the end of the stream and returns all of it.
+        """
+        if n < 0:
+            parts = []
+            while True:
+                parts.append(self.take(self.in_order_offset - self.consumed))
+                if self.at_eof():
+                    return b''.join(parts)
+                await self.wait_for_data()
+        while self.consumed == self.in_order_offset and not self.at_eof():
+            await self.wait_for_data()
+        return self.take(n)
+
+    async def readexactly(self, n: int) -> bytes:
+        """Returns exactly `n` bytes, raises asyncio.IncompleteReadError if the stream ends before."""
+        parts = []
+        remaining = n
+        while remaining > 0:
+            data = await self.read(remaining)
+            if not data:
+                raise asyncio.IncompleteReadError(b''.join(parts), n)
+            parts.append(data)
+            remaining -= len(data)
+        return b''.join(parts)
+
+    async def wait_for_data(self) -> None:
+        if self.connection_closed:
+            raise ConnectionResetError(f"The connection was closed before stream {self.stream_id} ended")
+        self.data_ready.clear()
+        await self.data_ready.wait()
+
+    def take(self, n: int) -> bytes:
+        """Takes up to `n` bytes of the data received in order."""
+        parts = []
+        size = 0
+        while self.chunks and size < n:
+            chunk = self.chunks[0]
+            part = chunk[:n - size]
+            if len(part) == len(chunk):
+                self.chunks.popleft()
+            else:
+                self.chunks[0] = chunk[len(part):]
+            parts.append(part)
+            size += len(part)
+        self.consumed += size
+        if size or self.at_eof():
+            self.on_read(self)
+        return b''.join(parts)
+
+    def on_connection_closed(self) -> None:
+        self.connection_closed = True
+        self.data_ready.set()
+
+    def data(self) -> bytes:
+        """The data received in order and not read yet."""
+        return b''.join(self.chunks)
+
+
+class STREAM_WRITER:
+    """
+    The send side of a bidirectional stream, written like an asyncio.StreamWriter: `write` queues the data on the
+    stream's SEND_STREAM, from where the connection's packetizer packs it next to the frames of the other streams,
+    `drain` waits while the stream has a full send buffer (or no flow control credit), and `close` ends the stream.
+    """
+
+    def __init__(self, connection: QUIC_CONNECTION, send_stream: SEND_STREAM):
+        self.connection = connection
+        self.send_stream = send_stream
+        self.stream_id = send_stream.stream_id
+
+    def write(self, data) -> None:
+        if self.send_stream.finished:
+            raise Exception(f"Stream {self.stream_id} was closed for writing")
+        # the data is kept until it is packed, a mutable buffer is copied
+        self.send_stream.write(data if isinstance(data, bytes) else bytes(data))
+        self.connection.start_packetizer()
+
+    async def drain(self) -> None:
+        await self.send_stream.space_available.wait()
+
+    def close(self) -> None:
+        """Ends the stream, its last frame carries the FIN once the data written before was packed."""
+        if self.send_stream.finished:
+            return
+        self.send_stream.finish()
+        self.connection.start_packetizer()
+
+    def is_closing(self) -> bool:
+        return self.send_stream.finished
+
+    async def wait_closed(self) -> None:
+        """Waits until the last frame of the stream was sent."""
+        await self.send_stream.fin_packed.wait()
+
+
+def frame_codec(frame_flags: int) -> CODEC:
+    """The compression codec a frame's flags name, CODEC.NONE for a stream sent as it is."""
+    for codec, codec_flag in CODEC_FRAME_FLAGS.items():
+        if frame_flags & codec_flag:
+            return codec
+    return CODEC.NONE
 
 
 class QUIC_PACKET:
-    packet_id_counter = 0
+    # the largest packet size path MTU discovery may probe (jumbo frames), every send buffer has this size
     Max_size = 9000
-    HEADER_LENGTH = struct.calcsize('!BIQ')
-    FRAME_LENGTH = struct.calcsize('!IIQ')
-    MAX_DATA_SIZE = Max_size - HEADER_LENGTH
-
-    def __init__(self, flag):
+    # the header and frame header formats are compiled once, and packed/unpacked in place
+    PACKET_HEADER = struct.Struct('!BQIQ')  # flag, connection ID, packet ID, data size
+    FRAME_HEADER = struct.Struct('!IBQQ')  # stream ID, frame flags, offset, data size
+    # the largest header: the data of a packet being built starts after it in the send buffer, and the header of
+    # its version is packed right before the data when it is sent
+    HEADER_LENGTH = PACKET_HEADER.size
+    FRAME_LENGTH = FRAME_HEADER.size
+    # Version VARINT_HEADERS: the first byte and the connection ID, followed by the packet number as a varint. A frame
+    # is its stream ID, flags byte, offset and (unless it is the last frame of the packet) length, the integers varints
+    COMPACT_HEADER = struct.Struct('!BQ')
+    COMPACT_HEADER_LENGTH = COMPACT_HEADER.size + 4  # packet numbers below 2^30 take 4 bytes at most
+    MAX_FRAME_LENGTH_SIZE = 2  # frames are shorter than 2^14 bytes, their length takes 2 bytes at most
+    # send buffers of packets that were already sent, reused by the next packets
+    # (deque append/pop are atomic, so connections running in different threads can share it)
+    buffer_pool: deque = deque()
+    BUFFER_POOL_LIMIT = 1024
+
+    __slots__ = ('packet_ID', 'packet_flag', 'connection_id', 'buffer', 'data_length', 'frames', 'max_size',
+                 'version', 'header_length', 'data_offset', 'last_frame_start', 'last_frame_length_position',
+                 'padded')
+
+    def __init__(self, flag, packet_id: int = 0, buffer=None, data_length: int = 0,
+                 max_size: int = Max_size, version: int = VERSION.FIXED_HEADERS):
 
         """
             Initializes a QUIC_PACKET instance.
 
             Args:
                 flag (int): A flag indicating the type or purpose of the packet. This flag is assigned to `self.packet_flag`.
+                packet_id (int): The ID of a received packet. A packet being built gets the next packet number of
+                    its connection when it is sent (see QUIC_CONNECTION.send_packet).
+                buffer: The buffer holding the serialized packet. A packet being built gets a reusable send buffer
+                    of `Max_size` bytes, a received packet is a view of the datagram it was parsed from.
+                data_length (int): How many bytes of data follow the header in the buffer.
+                max_size (int): The largest size of the serialized packet, the path MTU the connection discovered.
+                version (int): The wire format of the packet, see VERSION.
 
             Attributes:
-                packet_ID (int): A unique identifier for the packet, incremented for each new instance.
+                packet_ID (int): The packet number, unique among the packets a connection sends.
                 packet_flag (int): The flag indicating the type of packet (e.g., SYN, ACK, FIN).
-                packet_data (bytearray): A mutable sequence of bytes used to store the packet's data.
+                connection_id (int): The ID of the connection the packet belongs to.
+                packet_data (memoryview): The packet's data (everything after the header), a view of the buffer.
             Returns:
                 None
             """
 
-        # Increment the global packet ID counter to ensure unique IDs for each packet
-        QUIC_PACKET.packet_id_counter += 1
-        self.packet_ID = QUIC_PACKET.packet_id_counter
+        self.packet_ID = packet_id
         self.packet_flag = flag
-
-        # Initialize packet_data as an empty bytearray for storing data
-        self.packet_data = bytearray()  # using bytearray because it is mutable and can be modified
+        # identifies the connection the packet belongs to, so one server socket can serve many clients
+        self.connection_id = 0
+
+        if buffer is None:
+            try:
+                buffer = QUIC_PACKET.buffer_pool.pop()
+            except IndexError:
+                buffer = bytearray(QUIC_PACKET.Max_size)
+        self.buffer = buffer
+        self.data_length = data_length
+        # the frames linked to the packet, kept by the sender so they can be retransmitted
+        self.frames: List[QUIC_FRAME] = []
+        self.max_size = max_size
+        self.version = version
+        # the size of the header on the wire (at most), and where the data starts in the buffer
+        self.header_length = QUIC_PACKET.HEADER_LENGTH if version == VERSION.FIXED_HEADERS \
+            else QUIC_PACKET.COMPACT_HEADER_LENGTH
+        self.data_offset = QUIC_PACKET.HEADER_LENGTH
+        # version VARINT_HEADERS: where the last frame linked starts and where its length is, the length is dropped
+        # when the packet is sent
+        self.last_frame_start = 0
+        self.last_frame_length_position: Optional[int] = None
+        self.padded = False  # the packet is padded to max_size, whatever size its header takes
+
+    @property
+    def packet_data(self) -> memoryview:
+        return memoryview(self.buffer)[self.data_offset:self.data_offset + self.data_length]
+
+    @property
+    def packet_type(self) -> int:
+        """The first byte of the packet: its version and its flag."""
+        return (self.version - 1) << VERSION_SHIFT | self.packet_flag
 
     @classmethod
     def deserialize_data(cls, data: bytes) -> Tuple['QUIC_PACKET', List['QUIC_FRAME']]:
@@ -324,69 +2535,218 @@ class QUIC_PACKET:
 
         This method takes a byte sequence, extracts the packet header, and deserializes it into
         a QUIC_PACKET instance. It also processes the remaining data to extract QUIC_FRAME objects.
+        Nothing is copied: the packet and the data of every frame are views of the received datagram.
 
         """
-        packet_header = struct.unpack('!BIQ', data[:cls.HEADER_LENGTH])
-        flag, packet_id, data_size = packet_header
-        packet = QUIC_PACKET(flag)
-        packet.packet_ID = packet_id
-        packet.packet_data = bytearray(data[cls.HEADER_LENGTH: cls.HEADER_LENGTH + data_size])
+        view = memoryview(data)
+        version = (view[0] >> VERSION_SHIFT) + 1
+        if version == VERSION.VARINT_HEADERS:
+            return cls.deserialize_compact_data(view)
+        if version != VERSION.FIXED_HEADERS:
+            raise Exception(f"Packet of unknown version {version}")
+        flag, connection_id, packet_id, data_size = cls.PACKET_HEADER.unpack_from(view)
+        packet = QUIC_PACKET(flag, packet_id, view, data_size)
+        packet.connection_id = connection_id
 
         packet_frames = []
-        frame_position_offset = 0
-        while frame_position_offset < len(packet.packet_data):
-            frame_header = struct.unpack('!IIQ',
-                                         packet.packet_data[
-                                         frame_position_offset:frame_position_offset + cls.FRAME_LENGTH])
-            stream_id, position_in_stream, frame_size = frame_header
-            frame_position_offset += cls.FRAME_LENGTH  # skip to the next frame by frame length
-            frame_data = packet.packet_data[frame_position_offset:frame_position_offset + frame_size]
-            frame_to_add = QUIC_FRAME(stream_id, position_in_stream, frame_data)
-            packet_frames.append(frame_to_add)
+        if flag not in STREAM_PACKET_FLAGS:
+            # control packets carry their own payload instead of frames
+            return packet, packet_frames
+
+        unpack_frame_header = cls.FRAME_HEADER.unpack_from
+        frame_position_offset = cls.HEADER_LENGTH
+        data_end = cls.HEADER_LENGTH + data_size
+        while frame_position_offset < data_end:
+            stream_id, frame_flags, offset, frame_size = unpack_frame_header(view, frame_position_offset)
+            frame_position_offset += cls.FRAME_LENGTH  # skip to the frame data
+            frame_data = view[frame_position_offset:frame_position_offset + frame_size]
+            packet_frames.append(QUIC_FRAME(stream_id, offset, frame_data, frame_flags))
             frame_position_offset += frame_size
 
         return packet, packet_frames
 
-    def serialize_data(self) -> bytes:
+    @classmethod
+    def deserialize_compact_data(cls, view: memoryview) -> Tuple['QUIC_PACKET', List['QUIC_FRAME']]:
+        """Deserializes a packet of version VARINT_HEADERS, its data is the rest of the datagram after the header."""
+        packet_type, connection_id = cls.COMPACT_HEADER.unpack_from(view)
+        packet_id, data_offset = unpack_varint_from(view, cls.COMPACT_HEADER.size)
+        flag = packet_type & FLAG_MASK
+        data_end = len(view)
+        packet = QUIC_PACKET(flag, packet_id, view, data_end - data_offset, version=VERSION.VARINT_HEADERS)
+        packet.connection_id = connection_id
+        packet.data_offset = data_offset
+
+        packet_frames = []
+        if flag not in STREAM_PACKET_FLAGS:
+            return packet, packet_frames
+
+        position = data_offset
+        while position < data_end:
+            stream_id, position = unpack_varint_from(view, position)
+            frame_flags = view[position]
+            offset, position = unpack_varint_from(view, position + 1)
+            if frame_flags & FRAME_FLAGS.LENGTH:
+                frame_size, position = unpack_varint_from(view, position)
+                frame_flags ^= FRAME_FLAGS.LENGTH
+            else:
+                frame_size = data_end - position
+            packet_frames.append(QUIC_FRAME(stream_id, offset, view[position:position + frame_size], frame_flags))
+            position += frame_size
+
+        return packet, packet_frames
+
+    def serialize_data(self) -> memoryview:
         """
-          Serializes the QUIC_PACKET instance into a byte sequence for transmission or storage.
+          Serializes the QUIC_PACKET instance for transmission.
 
-          This method converts the packet's header and data into a byte sequence that can be easily sent over a network
-          or stored in a file. The header includes the packet flag, packet ID, and the size of the data. The data itself
-          is appended after the header.
+          The frames are already in the packet's buffer right after the header, so this method only packs the
+          header in front of them (the packet flag, connection ID, packet ID, and the size of the data) and returns
+          a view of the whole packet, nothing is copied.
+          A packet of version VARINT_HEADERS drops the length of its last frame first, and its shorter header is
+          packed right before the data, so the view starts where the header does.
           """
-        packet_header = struct.pack('!BIQ', self.packet_flag, self.packet_ID, len(self.packet_data))
-        return packet_header + self.packet_data
-
-    def link_frame(self, stream_id: int, position_in_stream: int, data: bytes):
+        if self.version == VERSION.FIXED_HEADERS:
+            QUIC_PACKET.PACKET_HEADER.pack_into(self.buffer, 0, self.packet_flag, self.connection_id, self.packet_ID,
+                                                self.data_length)
+            return memoryview(self.buffer)[:QUIC_PACKET.HEADER_LENGTH + self.data_length]
+
+        if self.last_frame_length_position is not None:
+            self.drop_last_frame_length()
+        header_start = self.data_offset - QUIC_PACKET.COMPACT_HEADER.size - varint_size(self.packet_ID)
+        if self.padded:
+            # the header is shorter than the room append_padding left for it, the padding takes the rest
+            padding_length = self.max_size - (self.data_offset - header_start) - self.data_length
+            position = self.data_offset + self.data_length
+            self.buffer[position:position + padding_length] = bytes(padding_length)
+            self.data_length += padding_length
+            self.padded = False
+        QUIC_PACKET.COMPACT_HEADER.pack_into(self.buffer, header_start, self.packet_type, self.connection_id)
+        pack_varint_into(self.buffer, header_start + QUIC_PACKET.COMPACT_HEADER.size, self.packet_ID)
+        return memoryview(self.buffer)[header_start:self.data_offset + self.data_length]
+
+    def drop_last_frame_length(self) -> None:
+        """The last frame takes the rest of the packet: its length is removed and its data moves into its place."""
+        length_position = self.last_frame_length_position
+        length_size = 1 << (self.buffer[length_position] >> 6)
+        data_end = self.data_offset + self.data_length
+        self.buffer[length_position:data_end - length_size] = self.buffer[length_position + length_size:data_end]
+        # the flags byte follows the stream ID at the start of the frame header
+        flags_position = self.last_frame_start + (1 << (self.buffer[self.last_frame_start] >> 6))
+        self.buffer[flags_position] &= ~FRAME_FLAGS.LENGTH
+        self.data_length -= length_size
+        self.last_frame_length_position = None
+
+    def release_buffer(self) -> None:
+        """Returns the send buffer to the pool, once the transport does not need the serialized packet anymore."""
+        if isinstance(self.buffer, bytearray) and len(QUIC_PACKET.buffer_pool) < QUIC_PACKET.BUFFER_POOL_LIMIT:
+            QUIC_PACKET.buffer_pool.append(self.buffer)
+        self.buffer = None
+
+    def append_data(self, data: bytes) -> None:
+        """Copies raw data (the payload of a control packet) after the data already in the packet."""
+        position = self.data_offset + self.data_length
+        if self.data_length + len(data) > self.max_size - self.header_length:
+            raise Exception("Data size is too large")
+        self.buffer[position:position + len(data)] = data
+        self.data_length += len(data)
+
+    def append_padding(self) -> None:
+        """Fills the rest of the packet with zero bytes, so the serialized packet is `max_size` bytes long."""
+        padding_length = self.max_size - self.header_length - self.data_length
+        position = self.data_offset + self.data_length
+        self.buffer[position:position + padding_length] = bytes(padding_length)
+        self.data_length += padding_length
+        self.padded = True
+
+    def link_frame(self, stream_id: int, offset: int, data: bytes, is_last_frame: bool = False,
+                   frame_flags: int = FRAME_FLAGS.NONE):
         """
            Appends a QUIC_FRAME to the packet's data.
 
-           This method creates a frame with the given stream ID, position within the stream, and data, and then appends
-           this frame to the packet's data. The method checks if the total packet data size exceeds the maximum allowed
-           size and raises an exception if it does.
+           This method writes a frame with the given stream ID, byte offset within the stream, and data right into
+           the packet's buffer. The last frame of a stream is marked with FRAME_FLAGS.FIN, and `frame_flags` adds
+           the flags every frame of its stream carries (the compression codec).
+           The method checks if the total packet data size exceeds the maximum allowed size and raises an exception
+           if it does.
 
            """
 
-        frame_to_link = struct.pack('!IIQ', stream_id, position_in_stream, len(data)) + data
-        if len(self.packet_data) + len(frame_to_link) > QUIC_PACKET.MAX_DATA_SIZE:
+        frame_flags |= FRAME_FLAGS.FIN if is_last_frame else FRAME_FLAGS.NONE
+        header_length = self.frame_header_size(stream_id, offset, varint_size(len(data)))
+        frame_length = header_length + len(data)
+        if self.data_length + frame_length > self.max_size - self.header_length:
             raise Exception("Frame size is too large")
-        self.packet_data += frame_to_link
+        position = self.data_offset + self.data_length
+        if self.version == VERSION.FIXED_HEADERS:
+            QUIC_PACKET.FRAME_HEADER.pack_into(self.buffer, position, stream_id, frame_flags, offset, len(data))
+        else:
+            # every frame is linked with its length, serialize_data drops the length of the last one
+            self.last_frame_start = position
+            flags_position = pack_varint_into(self.buffer, position, stream_id)
+            self.buffer[flags_position] = frame_flags | FRAME_FLAGS.LENGTH
+            self.last_frame_length_position = pack_varint_into(self.buffer, flags_position + 1, offset)
+            pack_varint_into(self.buffer, self.last_frame_length_position, len(data))
+        self.buffer[position + header_length:position + frame_length] = data
+        self.data_length += frame_length
+        self.frames.append(QUIC_FRAME(stream_id, offset, data, frame_flags))
+
+    def frame_header_size(self, stream_id: int, offset: int, length_size: int = MAX_FRAME_LENGTH_SIZE) -> int:
+        """Bytes the header of a frame takes in the packet, with a length of `length_size` bytes."""
+        if self.version == VERSION.FIXED_HEADERS:
+            return QUIC_PACKET.FRAME_LENGTH
+        return varint_size(stream_id) + 1 + varint_size(offset) + length_size
+
+    def free_space(self) -> int:
+        """Returns how many more bytes of frames (headers included) fit in the packet."""
+        return self.max_size - self.header_length - self.data_length
+
+    def link_ack_ranges(self, ack_ranges: List[Tuple[int, int]], ack_delay: float, recovered_packets: int = 0) -> None:
+        """
+        Writes the payload of an ACK packet: the ACK delay, the count of packets rebuilt by forward error correction
+        and the acknowledged [start, end) packet number ranges, which are sent as first and last packet number of
+        each range.
+        """
+        ranges_amount = min(len(ack_ranges), (self.free_space() - ACK_HEADER_FORMAT.size) //
+                            ACK_RANGE_FORMAT.size)
+        position = self.data_offset + self.data_length
+        ACK_HEADER_FORMAT.pack_into(self.buffer, position, int(ack_delay * 1_000_000), ranges_amount,
+                                    recovered_packets)
+        position += ACK_HEADER_FORMAT.size
+        for start, end in ack_ranges[:ranges_amount]:
+            ACK_RANGE_FORMAT.pack_into(self.buffer, position, start, end - 1)
+            position += ACK_RANGE_FORMAT.size
+        self.data_length = position - self.data_offset
+
+    def read_ack_ranges(self) -> Tuple[float, List[Tuple[int, int]], int]:
+        """
+        Reads the ACK delay in seconds, the acknowledged [start, end) ranges and the count of packets rebuilt by
+        forward error correction from an ACK packet.
+        """
+        packet_data = self.packet_data
+        ack_delay, ranges_amount, recovered_packets = ACK_HEADER_FORMAT.unpack_from(packet_data)
+        ack_ranges = [(first, last + 1) for first, last in
+                      ACK_RANGE_FORMAT.iter_unpack(packet_data[ACK_HEADER_FORMAT.size:
+                                                               ACK_HEADER_FORMAT.size +
+                                                               ranges_amount * ACK_RANGE_FORMAT.size])]
+        return ack_delay / 1_000_000, ack_ranges, recovered_packets
 
 
 class QUIC_FRAME:
     """
     Represents a frame in a QUIC packet.
 
-    A QUIC frame consists of a stream ID, a position within the stream, and the actual data of the frame. 
-    This class provides the attributes to store these components and a method to get the length of the frame's data.
+    A QUIC frame consists of a stream ID, flags, the byte offset of its data within the stream, and the actual data
+    of the frame. This class provides the attributes to store these components and a method to get the length of
+    the frame's data. A received frame's data is a view of the datagram it arrived in.
 
     """
+    __slots__ = ('stream_id', 'offset', 'frame_data', 'frame_flags')
 
-    def __init__(self, stream_id: int, position_in_stream: int, data: bytes):
+    def __init__(self, stream_id: int, offset: int, data: bytes, frame_flags: int = FRAME_FLAGS.NONE):
         self.stream_id = stream_id
-        self.position_in_stream = position_in_stream
+        self.offset = offset
         self.frame_data = data
+        self.frame_flags = frame_flags
 
     def __len__(self):
         return len(self.frame_data)
@@ -1,13 +1,29 @@
 from QUIC import QUIC_CONNECTION
+from generate_data_file import generate_data_file
 import threading
 import asyncio
+import hashlib
+import os
+import tempfile
 
 # Server address and port
 SERVER = ('127.0.0.1', 9191)
 # Source file to be transferred
 SOURCE_FILE = "random_data_file.txt"
+# Size of the source file generated when it does not exist
+SOURCE_SIZE_MB = 2
 # Number of streams to be used for the transfer
 STREAM_COUNT = 3
+# Bytes read at a time to hash a file, so files of any size are checked in constant memory
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file_path: str) -> bytes:
+    with open(file_path, 'rb') as file:
+        digest = hashlib.sha256()
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.digest()
 
 
 class FileTransferManager:
@@ -16,25 +32,26 @@ class FileTransferManager:
         # Create a new QUIC connection and listen for incoming connections
         connection = QUIC_CONNECTION()
         connection.listen_to(*SERVER)
-        received_data = None
-
-        # Continuously receive data until no more data is incoming
-        while True:
-            incoming = await connection.receive_data()
-            if incoming is None:
-                break
-            received_data = incoming
-
-        # Check if the received data matches the expected number of streams
-        if not received_data or len(received_data) != STREAM_COUNT:
-            print(f"Error: Expected {STREAM_COUNT} streams, got {len(received_data) if received_data else 0}")
-            return
-
-        # Compare the received data with the original source file
-        with open(SOURCE_FILE, 'rb') as original:
-            original_content = original.read()
-            for stream_data in received_data:
-                if stream_data != original_content:
+        received_files = None
+
+        with tempfile.TemporaryDirectory() as received_directory:
+            # Continuously receive data until no more data is incoming, every stream straight into a file
+            # (the sender's digests are checked as the streams arrive)
+            while True:
+                incoming = await connection.receive_files(os.path.join(received_directory, "stream_{index}.txt"))
+                if incoming is None:
+                    break
+                received_files = incoming
+
+            # Check if the received data matches the expected number of streams
+            if not received_files or len(received_files) != STREAM_COUNT:
+                print(f"Error: Expected {STREAM_COUNT} streams, got {len(received_files) if received_files else 0}")
+                return
+
+            # Compare the received files with the original source file, by their hashes
+            original_digest = file_digest(SOURCE_FILE)
+            for received_file in received_files:
+                if file_digest(received_file) != original_digest:
                     print("Error: Data mismatch detected")
                     return
 
@@ -45,16 +62,13 @@ class FileTransferManager:
     async def transmit_data():
         # Wait for a short period to ensure the receiver is ready
         await asyncio.sleep(1)
-        # Read the content of the source file
-        with open(SOURCE_FILE, "rb") as source:
-            content = source.read()
-            # Create a new QUIC connection and connect to the server
-            connection = QUIC_CONNECTION()
-            connection.connect_to(*SERVER)
-            # Send the data over the specified number of streams
-            await connection.send_data([content] * STREAM_COUNT)
-            # End the communication by sending a FIN packet
-            connection.end_communication()
+        # Create a new QUIC connection that ends every stream with a digest of its data, and connect to the server
+        connection = QUIC_CONNECTION(verify=True)
+        connection.connect_to(*SERVER)
+        # Send the source file over the specified number of streams, memory-mapped instead of read into memory
+        await connection.send_files([SOURCE_FILE] * STREAM_COUNT)
+        # End the communication: the FIN is sent once the data was acknowledged, and sent again until it is too
+        await connection.close()
 
 
 def execute_async(coroutine):
@@ -74,6 +88,9 @@ def execute_async(coroutine):
 
 
 def simulate_transfer():
+    if not os.path.exists(SOURCE_FILE):
+        generate_data_file(SOURCE_FILE, SOURCE_SIZE_MB)
+
     def initiate_receiver():
         # Execute the handle_incoming_data coroutine
         execute_async(FileTransferManager.handle_incoming_data())
@@ -0,0 +1,435 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import platform
+import queue
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from QUIC import QUIC_CONNECTION, RECEIVE_BUFFER_SIZE
+
+LOCAL_HOST = '127.0.0.1'
+CASE_TIMEOUT = 120  # seconds, a case that does not finish by then is recorded as failed
+TEXT_ALPHABET = b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'  # the letters of generate_data_file.py
+FIN_WAIT_TIMEOUT = 2  # seconds the receiver keeps acknowledging after the data arrived, waiting for the FIN
+MAX_QUEUE_DELAY = 0.2  # seconds of queued datagrams a bandwidth-limited link holds before dropping (drop tail)
+
+
+class IMPAIRMENTS:
+    """
+    How the emulated network treats every datagram, in both directions.
+    Rates are probabilities per datagram, delays are seconds, the bandwidth is in bits per second (0 is unlimited).
+    """
+
+    def __init__(self, loss: float = 0.0, reorder: float = 0.0, duplicate: float = 0.0, delay: float = 0.0,
+                 jitter: float = 0.0, reorder_delay: float = 0.005, bandwidth: float = 0.0):
+        self.loss = loss
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder_delay = reorder_delay
+        self.bandwidth = bandwidth
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class RELAY_PROTOCOL(asyncio.DatagramProtocol):
+    def __init__(self, relay: 'LOSSY_RELAY', direction: str):
+        self.relay = relay
+        self.direction = direction
+
+    def datagram_received(self, data: bytes, address: Tuple[str, int]) -> None:
+        self.relay.datagram_received(self.direction, data, address)
+
+
+class LOSSY_RELAY:
+    """
+    In-process UDP relay that emulates a network between a client and a server.
+
+    The client sends to the relay's address instead of the server's. Every datagram, in both directions, may be
+    dropped, duplicated, delayed (with jitter), reordered (held back for `reorder_delay`) and serialized at the
+    link's bandwidth, behind a drop-tail queue of at most MAX_QUEUE_DELAY seconds. The decisions come from a seeded
+    random generator, so a run sees the same impairment pattern for the same sequence of datagrams.
+    The handshake is impaired like the data: a lost SYN or SYN_ACK is recovered by the client sending its SYN again,
+    which the server answers again. The relay runs its own event loop in a background thread.
+    """
+
+    def __init__(self, server_address: Tuple[str, int], impairments: IMPAIRMENTS, seed: int = 0):
+        self.server_address = server_address
+        self.impairments = impairments
+        self.random = random.Random(seed)
+        self.client_address: Optional[Tuple[str, int]] = None
+        self.address: Optional[Tuple[str, int]] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self.front_transport = None  # faces the client
+        self.back_transport = None  # faces the server
+        # when each direction's link finishes sending what it already accepted
+        self.link_free_time: Dict[str, float] = {'up': 0.0, 'down': 0.0}
+        self.counters = {'forwarded': 0, 'dropped': 0, 'duplicated': 0, 'reordered': 0, 'queue_dropped': 0}
+
+    def start(self) -> Tuple[str, int]:
+        """Starts the relay thread and returns the address clients should send to."""
+        started = threading.Event()
+
+        def run() -> None:
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self.open_endpoints())
+            started.set()
+            self.loop.run_forever()
+            self.front_transport.close()
+            self.back_transport.close()
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self.address
+
+    async def open_endpoints(self) -> None:
+        self.front_transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: RELAY_PROTOCOL(self, 'up'), sock=relay_socket())
+        self.back_transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: RELAY_PROTOCOL(self, 'down'), sock=relay_socket())
+        self.address = self.front_transport.get_extra_info('sockname')
+
+    def datagram_received(self, direction: str, data: bytes, address: Tuple[str, int]) -> None:
+        if direction == 'up':
+            self.client_address = address
+            self.forward(direction, data, self.back_transport, self.server_address)
+        elif self.client_address is not None:
+            self.forward(direction, data, self.front_transport, self.client_address)
+
+    def forward(self, direction: str, data: bytes, transport, address: Tuple[str, int]) -> None:
+        """
+        1. drop the datagram with the loss probability
+        2. serialize it on the link at the bandwidth, drop it if the link queue is full
+        3. deliver it (and maybe a duplicate) after the propagation delay, jitter and reordering delay
+        """
+        impairments = self.impairments
+        if self.random.random() < impairments.loss:
+            self.counters['dropped'] += 1
+            return
+
+        now = self.loop.time()
+        queue_delay = 0.0
+        if impairments.bandwidth > 0:
+            departure = max(now, self.link_free_time[direction]) + len(data) * 8 / impairments.bandwidth
+            if departure - now > MAX_QUEUE_DELAY:
+                self.counters['queue_dropped'] += 1
+                return
+            self.link_free_time[direction] = departure
+            queue_delay = departure - now
+
+        copies = 1
+        if self.random.random() < impairments.duplicate:
+            copies = 2
+            self.counters['duplicated'] += 1
+        for _ in range(copies):
+            delay = queue_delay + impairments.delay + impairments.jitter * self.random.random()
+            if self.random.random() < impairments.reorder:
+                delay += impairments.reorder_delay
+                self.counters['reordered'] += 1
+            self.counters['forwarded'] += 1
+            if delay <= 0:
+                transport.sendto(data, address)
+            else:
+                self.loop.call_later(delay, transport.sendto, data, address)
+
+    def stop(self) -> None:
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+
+def relay_socket() -> socket.socket:
+    """A relay socket with the same receive buffer as the connections, so the relay itself drops nothing."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+    sock.bind((LOCAL_HOST, 0))
+    return sock
+
+
+def find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((LOCAL_HOST, 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Linear-interpolated percentile of the values, None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_case(case: dict) -> dict:
+    """
+    Runs one transfer through a LOSSY_RELAY, the sender and the receiver in the same process (so they share the
+    clock), and measures it:
+    1. the receiver listens on a free port, the relay forwards to it, the sender connects to the relay
+    2. `streams` streams of `file_size` seeded random bytes (or random letters, like generate_data_file.py makes,
+       with `data` 'letters') are sent, with `compression` and `fec` if they are set, and the receiver verifies
+       their hashes
+    3. throughput is measured from the start of send_data until the receiver has every stream
+    """
+    file_size, streams = case['file_size'], case['streams']
+    data_random = random.Random(case['seed'])
+    stream_data = [data_random.randbytes(file_size) for _ in range(streams)]
+    if case.get('data') == 'letters':
+        stream_data = [data.translate(bytes(TEXT_ALPHABET[byte % len(TEXT_ALPHABET)] for byte in range(256)))
+                       for data in stream_data]
+    expected_digests = [hashlib.sha256(data).hexdigest() for data in stream_data]
+
+    server_port = find_free_port()
+    relay = LOSSY_RELAY((LOCAL_HOST, server_port), IMPAIRMENTS(**case['impairments']), case['seed'])
+    relay_address = relay.start()
+
+    receiver_result = {}
+    receiver_listening = threading.Event()
+
+    def receive() -> None:
+        receiver = QUIC_CONNECTION(max_datagram_size=case['max_datagram_size'])
+
+        async def receive_streams() -> None:
+            received = await receiver.receive_data()
+            receiver_result['done_ns'] = time.perf_counter_ns()
+            receiver_result['verified'] = received is not None and \
+                [hashlib.sha256(data).hexdigest() for data in received] == expected_digests
+            receiver_result['fec_recovered_packets'] = receiver.metrics.fec_recovered_packets
+            receiver_result['stream_times'] = [stream_metrics.duration()
+                                               for stream_metrics in receiver.metrics.streams.values()]
+            # keep acknowledging until the sender's FIN, the sender waits for the last ACKs before sending it
+            try:
+                await asyncio.wait_for(receiver.receive_data(), FIN_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                receiver.terminate_connection("No FIN from the sender")
+
+        receiver_listening.set()
+        receiver.listen_to(LOCAL_HOST, server_port)
+        asyncio.run(receive_streams())
+
+    receiver_thread = threading.Thread(target=receive)
+    receiver_thread.start()
+    receiver_listening.wait()
+    # listen_to binds right after the event is set
+    time.sleep(0.1)
+
+    sender = QUIC_CONNECTION(congestion_control=case['congestion_control'],
+                             max_datagram_size=case['max_datagram_size'], compression=case.get('compression', False),
+                             fec=case.get('fec', False))
+    rtt_samples = []
+    sender.recovery.on_rtt_sample = rtt_samples.append
+    sender.connect_to(*relay_address)
+
+    async def send() -> None:
+        await sender.send_data(stream_data)
+        sender.end_communication()
+
+    cpu_start = cpu_seconds()
+    start_ns = time.perf_counter_ns()
+    asyncio.run(send())
+    receiver_thread.join()
+    cpu_used = cpu_seconds() - cpu_start
+    relay.stop()
+
+    duration = (receiver_result['done_ns'] - start_ns) / 1_000_000_000
+    total_bytes = file_size * streams
+    metrics = sender.collect_metrics()
+    stream_times = receiver_result['stream_times']
+    return {
+        'verified': receiver_result['verified'],
+        'duration': duration,
+        'throughput': total_bytes / duration if duration > 0 else 0.0,
+        'stream_time_p50': percentile(stream_times, 0.5),
+        'stream_time_p90': percentile(stream_times, 0.9),
+        'stream_time_p99': percentile(stream_times, 0.99),
+        'rtt_p50': percentile(rtt_samples, 0.5),
+        'rtt_p90': percentile(rtt_samples, 0.9),
+        'rtt_p99': percentile(rtt_samples, 0.99),
+        'packets_sent': metrics.packets_sent,
+        'packets_lost': sender.recovery.lost_packets_amount,
+        'packets_retransmitted': sender.recovery.retransmitted_packets_amount,
+        'max_datagram_size_reached': sender.path_mtu.max_datagram_size,
+        'cpu_seconds': cpu_used,
+        'cpu_seconds_per_mb': cpu_used / (total_bytes / 1_000_000),
+        'compressed_ratio': metrics.compression_output_bytes / metrics.compression_input_bytes
+        if metrics.compression_input_bytes else None,
+        'fec_repair_packets_sent': metrics.fec_repair_packets_sent,
+        'fec_recovered_packets': receiver_result['fec_recovered_packets'],
+        'relay': relay.counters,
+    }
+
+
+def case_worker(case: dict, results: multiprocessing.Queue) -> None:
+    """Runs a case in a fresh process, so its peak memory (ru_maxrss) belongs to that case alone."""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_case(case)
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except Exception as exc:
+        result = {'error': repr(exc)}
+    results.put(result)
+
+
+def run_case_isolated(case: dict, timeout: float = CASE_TIMEOUT) -> dict:
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=case_worker, args=(case, results))
+    process.start()
+    try:
+        result = results.get(timeout=timeout)
+    except queue.Empty:
+        process.kill()
+        result = {'error': 'timeout'}
+    process.join()
+    return result
+
+
+def case_key(case: dict) -> str:
+    impairments = ','.join(f'{name}={value}' for name, value in sorted(case['impairments'].items()))
+    key = (f"size={case['file_size']} streams={case['streams']} packet={case['max_datagram_size']} "
+           f"cc={case['congestion_control']} {impairments}")
+    # the options added later only appear when they are set, so older results files still compare
+    if case.get('data', 'random') != 'random':
+        key += f" data={case['data']}"
+    if case.get('compression'):
+        key += " compression"
+    if case.get('fec'):
+        key += " fec"
+    return key
+
+
+def summarize(results: List[dict]) -> List[dict]:
+    """Median of every measurement over the repeats of each case."""
+    summary = []
+    for key, runs in itertools.groupby(sorted(results, key=lambda result: result['key']),
+                                       key=lambda result: result['key']):
+        runs = list(runs)
+        successful = [run for run in runs if 'error' not in run and run['verified']]
+        entry = {'key': key, 'runs': len(runs), 'successful': len(successful)}
+        for name in ('throughput', 'duration', 'stream_time_p50', 'stream_time_p99', 'rtt_p50', 'rtt_p99',
+                     'cpu_seconds_per_mb', 'peak_rss_kb', 'packets_lost'):
+            values = [run[name] for run in successful if run.get(name) is not None]
+            entry[name] = statistics.median(values) if values else None
+        summary.append(entry)
+    return summary
+
+
+def compare(summary: List[dict], baseline_path: str) -> None:
+    """Prints the throughput and CPU change of every case against a previous results file."""
+    with open(baseline_path) as baseline_file:
+        baseline = {entry['key']: entry for entry in json.load(baseline_file)['summary']}
+    print("\ncase | throughput change | cpu/MB change")
+    for entry in summary:
+        previous = baseline.get(entry['key'])
+        if previous is None or not previous['throughput'] or not entry['throughput']:
+            continue
+        throughput_change = (entry['throughput'] / previous['throughput'] - 1) * 100
+        cpu_change = (entry['cpu_seconds_per_mb'] / previous['cpu_seconds_per_mb'] - 1) * 100
+        print(f"{entry['key']} | {throughput_change:+.1f}% | {cpu_change:+.1f}%")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_sizes(text: str) -> List[int]:
+    """Parses a comma separated list of sizes, with optional K/M suffixes (powers of 1024)."""
+    units = {'K': 1024, 'M': 1024 * 1024}
+    sizes = []
+    for item in text.split(','):
+        item = item.strip().upper()
+        multiplier = units.get(item[-1:], 1)
+        sizes.append(int(float(item.rstrip('KM')) * multiplier))
+    return sizes
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark QUIC_CONNECTION transfers through a lossy relay")
+    parser.add_argument('--sizes', default='1M,4M', help="file sizes per stream, e.g. 256K,1M,8M")
+    parser.add_argument('--streams', default='1,3,8', help="stream counts")
+    parser.add_argument('--packet-sizes', default='1200,1472,9000', help="largest packet sizes (path MTU caps)")
+    parser.add_argument('--congestion-control', default='newreno')
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--reorder', type=float, default=0.0)
+    parser.add_argument('--duplicate', type=float, default=0.0)
+    parser.add_argument('--delay-ms', type=float, default=0.0, help="one-way delay")
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0.0, help="0 is unlimited")
+    parser.add_argument('--data', choices=['random', 'letters'], default='random',
+                        help="stream contents: random bytes, or random letters that compress")
+    parser.add_argument('--compression', action='store_true', help="send with adaptive compression")
+    parser.add_argument('--fec', action='store_true', help="send with forward error correction")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="previous results file to compare against")
+    args = parser.parse_args(argv)
+
+    impairments = IMPAIRMENTS(loss=args.loss, reorder=args.reorder, duplicate=args.duplicate,
+                              delay=args.delay_ms / 1000, jitter=args.jitter_ms / 1000,
+                              bandwidth=args.bandwidth_mbps * 1_000_000).as_dict()
+    results = []
+    for file_size, streams, max_datagram_size in itertools.product(
+            parse_sizes(args.sizes), [int(count) for count in args.streams.split(',')],
+            [int(size) for size in args.packet_sizes.split(',')]):
+        case = {'file_size': file_size, 'streams': streams, 'max_datagram_size': max_datagram_size,
+                'congestion_control': args.congestion_control, 'impairments': impairments,
+                'data': args.data, 'compression': args.compression, 'fec': args.fec}
+        for repeat in range(args.repeat):
+            case['seed'] = args.seed + repeat
+            result = {'key': case_key(case), 'repeat': repeat, **case, **run_case_isolated(case)}
+            results.append(result)
+            if 'error' in result:
+                print(f"{result['key']} #{repeat}: FAILED {result['error']}")
+            else:
+                print(f"{result['key']} #{repeat}: {result['throughput'] / 1_000_000:.2f} MB/s, "
+                      f"verified={result['verified']}, lost={result['packets_lost']}, "
+                      f"cpu/MB={result['cpu_seconds_per_mb']:.3f}s, peak RSS={result['peak_rss_kb']} KB")
+
+    summary = summarize(results)
+    report = {
+        'metadata': {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'git_revision': git_revision(),
+                     'python': sys.version, 'platform': platform.platform(), 'arguments': vars(args)},
+        'summary': summary,
+        'results': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(summary, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import asyncio
+import math
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntFlag
+from typing import AsyncIterator, Optional, Tuple
+
+try:
+    import lzma
+except ImportError:  # Python built without liblzma
+    lzma = None
+
+ZLIB_LEVEL = 1  # the fastest level keeps most of the gain on text
+LZMA_PRESET = 1
+COMPRESSION_CHUNK_SIZE = 256 * 1024  # bytes handed to the thread pool at a time
+COMPRESSION_SAMPLE_SIZE = 64 * 1024  # the start of a stream every codec is tried on
+MAX_COMPRESSED_RATIO = 0.9  # a codec has to save at least 10% of the bytes to be used
+ASSUMED_SEND_RATE = 100_000_000 / 8  # bytes per second assumed before the connection has an RTT sample
+
+
+class CODEC(IntFlag):
+    """Compression codecs, as a bit mask: the transport parameters carry the codecs a side can decompress."""
+    NONE = 0
+    ZLIB = 1
+    LZMA = 2
+
+
+AVAILABLE_CODECS = CODEC.ZLIB | (CODEC.LZMA if lzma is not None else CODEC.NONE)
+
+compression_pool: Optional[ThreadPoolExecutor] = None
+
+
+def compression_executor() -> ThreadPoolExecutor:
+    """The thread pool every connection of the process compresses in, zlib and lzma release the GIL while they work."""
+    global compression_pool
+    if compression_pool is None:
+        compression_pool = ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix='compression')
+    return compression_pool
+
+
+def forget_compression_pool() -> None:
+    """Runs in a forked child, which has none of the parent's compression threads: the next stream starts a pool."""
+    global compression_pool
+    compression_pool = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=forget_compression_pool)
+
+
+def create_compressor(codec: CODEC):
+    """Returns a streaming compressor with `compress(data)` and `flush()`."""
+    if codec == CODEC.ZLIB:
+        return zlib.compressobj(ZLIB_LEVEL)
+    if codec == CODEC.LZMA:
+        return lzma.LZMACompressor(preset=LZMA_PRESET)
+    raise Exception(f"Unknown compression codec {codec!r}")
+
+
+class DECOMPRESSOR:
+    """Streaming decompressor of a codec, lzma has no flush so it only has `decompress`."""
+
+    def __init__(self, codec: CODEC):
+        if codec == CODEC.ZLIB:
+            self.decompressor = zlib.decompressobj()
+        elif codec == CODEC.LZMA and lzma is not None:
+            self.decompressor = lzma.LZMADecompressor()
+        else:
+            raise Exception(f"Compression codec {codec!r} is not supported")
+
+    def decompress(self, data) -> bytes:
+        return self.decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        return self.decompressor.flush() if hasattr(self.decompressor, 'flush') else b''
+
+
+def measure_compression(codec: CODEC, sample) -> Tuple[float, float]:
+    """Runs in the thread pool: compresses the sample, returns (compressed size / size, CPU seconds it took)."""
+    start = time.thread_time()
+    compressor = create_compressor(codec)
+    compressed_size = len(compressor.compress(sample)) + len(compressor.flush())
+    return compressed_size / len(sample), time.thread_time() - start
+
+
+async def select_codec(sample, codecs: CODEC, send_rate: float) -> CODEC:
+    """
+    Tries every codec on the sample in the thread pool and returns the one that sends the stream fastest.
+    Compression runs alongside sending, so a compressed stream moves at min(compression speed, send_rate / ratio)
+    bytes of its data per second. CODEC.NONE if no codec saves enough bytes or beats sending the data as it is.
+    """
+    candidates = [codec for codec in (CODEC.ZLIB, CODEC.LZMA) if codec & codecs]
+    if not candidates or len(sample) == 0:
+        return CODEC.NONE
+    loop = asyncio.get_running_loop()
+    measurements = await asyncio.gather(*(loop.run_in_executor(compression_executor(), measure_compression,
+                                                               codec, sample) for codec in candidates))
+    best_codec, best_rate = CODEC.NONE, send_rate
+    for codec, (ratio, cpu_seconds) in zip(candidates, measurements):
+        if ratio > MAX_COMPRESSED_RATIO:
+            continue
+        speed = len(sample) / cpu_seconds if cpu_seconds > 0 else math.inf
+        stream_rate = min(speed, send_rate / ratio) if ratio > 0 else speed
+        if stream_rate > best_rate:
+            best_codec, best_rate = codec, stream_rate
+    return best_codec
+
+
+async def read_chunks(stream_data, chunk_size: int = COMPRESSION_CHUNK_SIZE) -> AsyncIterator[memoryview]:
+    """Yields a bytes-like object as views of `chunk_size` bytes, and an async iterator's chunks as they come."""
+    if hasattr(stream_data, '__aiter__'):
+        async for chunk in stream_data:
+            yield memoryview(chunk)
+        return
+    view = memoryview(stream_data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
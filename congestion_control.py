@@ -0,0 +1,182 @@
+import abc
+import math
+from typing import Dict, Iterable, Optional, Type
+
+PACING_GAIN = 1.25  # the pacer sends a little faster than cwnd/RTT so it never becomes the bottleneck
+PACING_BURST_INTERVAL = 0.002  # seconds of sending the bucket may hold, asyncio timers are ~1 ms granular
+MIN_BURST_PACKETS = 10
+
+
+class CONGESTION_CONTROLLER(abc.ABC):
+    """
+    Base class of the congestion controllers a QUIC_CONNECTION can use.
+
+    The loss recovery of the connection reports every ack-eliciting packet that is sent, acknowledged or lost,
+    and the connection only sends while `bytes_in_flight + packet size <= congestion_window`.
+    Sent packets are passed as objects with a `size` (bytes) and a `time_sent` (time.monotonic seconds).
+    A controller implements how the window grows (`on_packets_acked`) and shrinks (`on_congestion_event`).
+    """
+
+    def __init__(self, max_datagram_size: int):
+        self.max_datagram_size = max_datagram_size
+        self.congestion_window = self.initial_window()
+        self.ssthresh = math.inf
+        # packets sent before the start of the current recovery period do not cause another reduction
+        self.recovery_start_time = -math.inf
+
+    def initial_window(self) -> int:
+        return min(10 * self.max_datagram_size, max(14720, 2 * self.max_datagram_size))
+
+    def minimum_window(self) -> int:
+        return 2 * self.max_datagram_size
+
+    def set_max_datagram_size(self, max_datagram_size: int) -> None:
+        """Path MTU discovery changed the packet size, the window is kept in bytes but never below the minimum."""
+        self.max_datagram_size = max_datagram_size
+        self.congestion_window = max(self.congestion_window, self.minimum_window())
+
+    def in_slow_start(self) -> bool:
+        return self.congestion_window < self.ssthresh
+
+    def on_packet_sent(self, size: int, now: float) -> None:
+        pass
+
+    @abc.abstractmethod
+    def on_packets_acked(self, acked_packets: Iterable, now: float, smoothed_rtt: float) -> None:
+        """Grows the window for the newly acknowledged packets."""
+
+    def on_packets_lost(self, lost_packets: Iterable, now: float) -> None:
+        """Starts a new recovery period, unless every lost packet was sent inside the current one."""
+        latest_time_sent = max((packet.time_sent for packet in lost_packets), default=None)
+        if latest_time_sent is None or latest_time_sent <= self.recovery_start_time:
+            return
+        self.recovery_start_time = now
+        self.on_congestion_event(now)
+
+    @abc.abstractmethod
+    def on_congestion_event(self, now: float) -> None:
+        """Shrinks the window at the start of a recovery period."""
+
+
+class NEW_RENO(CONGESTION_CONTROLLER):
+    """NewReno as specified for QUIC in RFC 9002 appendix B: slow start, then one packet per RTT."""
+    LOSS_REDUCTION_FACTOR = 0.5
+
+    def on_packets_acked(self, acked_packets: Iterable, now: float, smoothed_rtt: float) -> None:
+        for packet in acked_packets:
+            if packet.time_sent <= self.recovery_start_time:
+                continue
+            if self.in_slow_start():
+                self.congestion_window += packet.size
+            else:
+                self.congestion_window += self.max_datagram_size * packet.size // self.congestion_window
+
+    def on_congestion_event(self, now: float) -> None:
+        self.ssthresh = self.congestion_window * self.LOSS_REDUCTION_FACTOR
+        self.congestion_window = max(int(self.ssthresh), self.minimum_window())
+
+
+class CUBIC(CONGESTION_CONTROLLER):
+    """
+    CUBIC as specified in RFC 9438. After a loss the window grows along a cubic function of the time since
+    the loss, centred on the window where the loss happened, and never slower than the Reno-friendly estimate.
+    Window arithmetic of the cubic function is done in segments of `max_datagram_size` bytes.
+    """
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, max_datagram_size: int):
+        super().__init__(max_datagram_size)
+        self.window_max = 0.0  # segments
+        self.k = 0.0  # seconds until the cubic function reaches window_max again
+        self.epoch_start: Optional[float] = None
+        self.reno_window = 0.0  # segments, the Reno-friendly estimate
+
+    def on_packets_acked(self, acked_packets: Iterable, now: float, smoothed_rtt: float) -> None:
+        for packet in acked_packets:
+            if packet.time_sent <= self.recovery_start_time:
+                continue
+            if self.in_slow_start():
+                self.congestion_window += packet.size
+                continue
+
+            segments = self.congestion_window / self.max_datagram_size
+            if self.epoch_start is None:
+                # congestion avoidance started without a loss (slow start ended at ssthresh)
+                self.epoch_start = now
+                self.window_max = segments
+                self.k = 0.0
+                self.reno_window = segments
+            elapsed = now - self.epoch_start + smoothed_rtt
+            target = self.C * (elapsed - self.k) ** 3 + self.window_max
+            # grow at most by half the window per RTT, like RFC 9438 bounds the target
+            target = min(max(target, segments), 1.5 * segments)
+            alpha = 3 * (1 - self.BETA) / (1 + self.BETA)
+            self.reno_window += alpha * (packet.size / self.max_datagram_size) / segments
+            target = max(target, self.reno_window)
+            increase = (target - segments) / segments * packet.size
+            self.congestion_window += int(increase)
+
+    def on_congestion_event(self, now: float) -> None:
+        segments = self.congestion_window / self.max_datagram_size
+        # fast convergence: release bandwidth faster if the window did not reach the previous maximum
+        if segments < self.window_max:
+            self.window_max = segments * (1 + self.BETA) / 2
+        else:
+            self.window_max = segments
+        self.ssthresh = self.congestion_window * self.BETA
+        self.congestion_window = max(int(self.ssthresh), self.minimum_window())
+        self.k = math.cbrt(self.window_max * (1 - self.BETA) / self.C)
+        self.epoch_start = now
+        self.reno_window = self.congestion_window / self.max_datagram_size
+
+
+CONGESTION_CONTROLLERS: Dict[str, Type[CONGESTION_CONTROLLER]] = {
+    'newreno': NEW_RENO,
+    'cubic': CUBIC,
+}
+
+
+def create_congestion_controller(name: str, max_datagram_size: int) -> CONGESTION_CONTROLLER:
+    """Creates the congestion controller registered under `name` in CONGESTION_CONTROLLERS."""
+    if name not in CONGESTION_CONTROLLERS:
+        raise Exception(f"Unknown congestion controller {name!r}, expected one of {list(CONGESTION_CONTROLLERS)}")
+    return CONGESTION_CONTROLLERS[name](max_datagram_size)
+
+
+class PACER:
+    """
+    Connection-wide token bucket shared by all the streams of a connection.
+    Tokens (bytes) are refilled at `PACING_GAIN * congestion_window / smoothed_rtt`, and the bucket holds at most
+    a short burst, so packets leave evenly spread over the RTT instead of in window-sized bursts.
+    """
+
+    def __init__(self, max_datagram_size: int):
+        self.max_datagram_size = max_datagram_size
+        self.rate = 0.0  # bytes per second, 0 means not limited until the first update
+        self.capacity = MIN_BURST_PACKETS * max_datagram_size
+        self.tokens = float(self.capacity)
+        self.last_refill: Optional[float] = None
+
+    def set_max_datagram_size(self, max_datagram_size: int) -> None:
+        self.max_datagram_size = max_datagram_size
+        self.capacity = max(self.capacity, MIN_BURST_PACKETS * max_datagram_size)
+
+    def update_rate(self, congestion_window: int, smoothed_rtt: float) -> None:
+        self.rate = PACING_GAIN * congestion_window / max(smoothed_rtt, 1e-6)
+        self.capacity = max(MIN_BURST_PACKETS * self.max_datagram_size, self.rate * PACING_BURST_INTERVAL)
+
+    def refill(self, now: float) -> None:
+        if self.last_refill is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def time_until_send(self, size: int, now: float) -> float:
+        """Returns how long to wait before a packet of `size` bytes may be sent, 0 if it may be sent now."""
+        self.refill(now)
+        if self.tokens >= size or self.rate == 0:
+            return 0.0
+        return (size - self.tokens) / self.rate
+
+    def on_packet_sent(self, size: int) -> None:
+        self.tokens -= size
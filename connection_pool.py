@@ -0,0 +1,101 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from QUIC import QUIC_CONNECTION, STREAM_DATA
+
+POOL_IDLE_TIMEOUT = 30.0  # seconds an unused connection is kept open for the next request
+MAX_IDLE_CONNECTIONS = 4  # idle connections kept per server address, the rest are closed when released
+# pooled connections send a PING after this many seconds without a packet, so the server does not drop them for
+# being idle (see QUIC.IDLE_TIMEOUT) while they wait in the pool
+POOL_KEEPALIVE_INTERVAL = 10.0
+
+
+class CONNECTION_POOL:
+    """
+    Keeps client connections open between transfers and hands them out again, so a request to a server that was
+    already used pays no handshake at all. A request that needs a new connection resumes it with the server's
+    ticket when it has one (see QUIC_CONNECTION.connect), so its data still leaves with the first flight.
+
+    A connection is used by one request at a time: `acquire` takes it out of the pool and `release` puts it back.
+    Connections that stay idle longer than `idle_timeout` are ended with a FIN.
+    """
+
+    def __init__(self, idle_timeout: float = POOL_IDLE_TIMEOUT, max_idle_connections: int = MAX_IDLE_CONNECTIONS,
+                 **connection_options):
+        self.idle_timeout = idle_timeout
+        self.max_idle_connections = max_idle_connections
+        # keyword arguments of every QUIC_CONNECTION the pool creates (congestion control, windows, ticket store...)
+        self.connection_options = {'keepalive_interval': POOL_KEEPALIVE_INTERVAL, **connection_options}
+        # idle connections of every server address with the time they were released, oldest first
+        self.idle: Dict[Tuple[str, int], List[Tuple[QUIC_CONNECTION, float]]] = {}
+        self.expiry_timer: Optional[asyncio.TimerHandle] = None
+        self.is_closed = False
+
+    async def acquire(self, host: str, port: int) -> QUIC_CONNECTION:
+        """Returns an idle connection to the server, or a new one."""
+        if self.is_closed:
+            raise Exception("The connection pool is closed")
+        idle_connections = self.idle.get((host, port), [])
+        while idle_connections:
+            # the most recently used connection is the least likely to have timed out on the server
+            connection, _ = idle_connections.pop()
+            if not connection.is_closed:
+                return connection
+        connection = QUIC_CONNECTION(**self.connection_options)
+        await connection.connect(host, port)
+        return connection
+
+    def release(self, connection: QUIC_CONNECTION) -> None:
+        """Puts a connection back in the pool for the next request to the same server."""
+        if connection.is_closed:
+            return
+        if self.is_closed:
+            connection.end_communication()
+            return
+        idle_connections = self.idle.setdefault(connection.peer_address, [])
+        idle_connections.append((connection, time.monotonic()))
+        while len(idle_connections) > self.max_idle_connections:
+            idle_connections.pop(0)[0].end_communication()
+        self.schedule_expiry()
+
+    async def send_data(self, host: str, port: int, list_of_files: List[STREAM_DATA], **send_options) -> None:
+        """Sends one batch of streams on a pooled connection, see QUIC_CONNECTION.send_data."""
+        connection = await self.acquire(host, port)
+        try:
+            await connection.send_data(list_of_files, **send_options)
+        except BaseException:
+            # a connection in an unknown state is not reused
+            connection.end_communication()
+            raise
+        self.release(connection)
+
+    def schedule_expiry(self) -> None:
+        if self.expiry_timer is None:
+            self.expiry_timer = asyncio.get_running_loop().call_later(self.idle_timeout, self.expire_idle)
+
+    def expire_idle(self) -> None:
+        """Ends the connections that were idle for `idle_timeout`, and checks again when the next one expires."""
+        self.expiry_timer = None
+        now = time.monotonic()
+        for address in list(self.idle):
+            idle_connections = self.idle[address]
+            while idle_connections and now - idle_connections[0][1] >= self.idle_timeout:
+                idle_connections.pop(0)[0].end_communication()
+            if not idle_connections:
+                del self.idle[address]
+        if self.idle:
+            oldest_release = min(idle_connections[0][1] for idle_connections in self.idle.values())
+            self.expiry_timer = asyncio.get_running_loop().call_later(
+                max(oldest_release + self.idle_timeout - now, 0), self.expire_idle)
+
+    def close(self) -> None:
+        """Ends every idle connection, connections still in use are ended when they are released."""
+        self.is_closed = True
+        if self.expiry_timer is not None:
+            self.expiry_timer.cancel()
+            self.expiry_timer = None
+        for idle_connections in self.idle.values():
+            for connection, _ in idle_connections:
+                connection.end_communication()
+        self.idle.clear()
@@ -0,0 +1,148 @@
+import asyncio
+import socket
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple, Union
+
+MAX_DATAGRAM_SIZE = 65535
+RECEIVE_BATCH_SIZE = 64  # datagrams read per wakeup, so one busy socket cannot starve the others on the loop
+SEND_QUEUE_HIGH_WATER = 512  # queued datagrams before the protocol is asked to pause writing
+
+DATAGRAM = Union[bytes, bytearray, memoryview]
+
+
+class BATCHED_DATAGRAM_TRANSPORT(asyncio.BaseTransport):
+    """
+    Datagram transport that moves datagrams in batches instead of one per event loop wakeup.
+
+    Receiving: when the socket becomes readable, every datagram already queued in the kernel (up to
+    RECEIVE_BATCH_SIZE) is read in one drain loop and handed to the protocol's `datagram_received` before the
+    loop moves on, so work scheduled with `call_soon` (like a coalesced ACK) runs once per batch.
+    Sending: `sendto` only queues the datagram, and one flush per loop iteration sends everything that all
+    the streams queued in that iteration. The datagram is not copied while it waits in the queue (packets are built
+    in place in their send buffer); the optional `on_sent` callback tells the caller when its buffer is free.
+
+    It implements the subset of asyncio.DatagramTransport that QUIC_CONNECTION and QUIC_SERVER use,
+    and calls the same protocol methods, so it is interchangeable with `loop.create_datagram_endpoint`.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, sock: socket.socket, protocol: asyncio.DatagramProtocol):
+        super().__init__()
+        self.loop = loop
+        self.sock = sock
+        self.protocol = protocol
+        self.send_queue: Deque[Tuple[DATAGRAM, Tuple[str, int], Optional[Callable[[], None]]]] = deque()
+        self.flush_scheduled = False
+        self.writing_paused = False
+        self.waiting_for_writable = False
+        self.closing = False
+
+        self.sock.setblocking(False)
+        self.loop.add_reader(self.sock.fileno(), self.read_ready)
+        self.loop.call_soon(self.protocol.connection_made, self)
+
+    def read_ready(self) -> None:
+        """Drains the socket, then hands the datagrams to the protocol."""
+        batch: List[Tuple[bytes, Tuple[str, int]]] = []
+        for _ in range(RECEIVE_BATCH_SIZE):
+            try:
+                batch.append(self.sock.recvfrom(MAX_DATAGRAM_SIZE))
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exc:
+                self.protocol.error_received(exc)
+                break
+        for data, address in batch:
+            if self.closing:
+                return
+            try:
+                self.protocol.datagram_received(data, address)
+            except Exception as exc:
+                # like asyncio's transports, the error is reported and the next datagrams of the batch still arrive
+                self.loop.call_exception_handler({'message': 'Exception in datagram_received', 'exception': exc,
+                                                  'transport': self, 'protocol': self.protocol})
+
+    def sendto(self, data: DATAGRAM, address: Tuple[str, int], on_sent: Optional[Callable[[], None]] = None) -> None:
+        """
+        Queues a datagram to be sent with the next flush.
+        `on_sent` is called once the datagram left (or was dropped), the buffer must not change until then.
+        """
+        if self.closing:
+            return
+        self.send_queue.append((data, address, on_sent))
+        if not self.flush_scheduled and not self.waiting_for_writable:
+            self.flush_scheduled = True
+            self.loop.call_soon(self.flush)
+        if not self.writing_paused and len(self.send_queue) >= SEND_QUEUE_HIGH_WATER:
+            self.writing_paused = True
+            self.protocol.pause_writing()
+
+    def flush(self) -> None:
+        """Sends every queued datagram, stops and waits for the socket to become writable if its buffer is full."""
+        self.flush_scheduled = False
+        send = self.sock.sendto
+        while self.send_queue:
+            data, address, on_sent = self.send_queue[0]
+            try:
+                send(data, address)
+            except (BlockingIOError, InterruptedError):
+                if not self.waiting_for_writable:
+                    self.waiting_for_writable = True
+                    self.loop.add_writer(self.sock.fileno(), self.write_ready)
+                if not self.writing_paused:
+                    self.writing_paused = True
+                    self.protocol.pause_writing()
+                return
+            except OSError as exc:
+                # like asyncio, a failed datagram is reported and dropped, UDP gives no delivery guarantee anyway
+                self.protocol.error_received(exc)
+            self.send_queue.popleft()
+            if on_sent is not None:
+                on_sent()
+
+        if self.writing_paused:
+            self.writing_paused = False
+            self.protocol.resume_writing()
+
+    def write_ready(self) -> None:
+        self.waiting_for_writable = False
+        self.loop.remove_writer(self.sock.fileno())
+        self.flush()
+
+    def get_write_buffer_size(self) -> int:
+        return len(self.send_queue)
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+    def close(self) -> None:
+        """Sends what is still queued (best effort), then closes the socket."""
+        if self.closing:
+            return
+        self.flush()
+        self.closing = True
+        self.loop.remove_reader(self.sock.fileno())
+        if self.waiting_for_writable:
+            self.loop.remove_writer(self.sock.fileno())
+        self.send_queue.clear()
+        self.sock.close()
+        self.loop.call_soon(self.protocol.connection_lost, None)
+
+    def abort(self) -> None:
+        self.close()
+
+
+async def open_datagram_transport(sock: socket.socket, protocol_factory: Callable[[], asyncio.DatagramProtocol]) \
+        -> Tuple[asyncio.BaseTransport, asyncio.DatagramProtocol]:
+    """
+    Attaches a UDP socket to the running loop. The batched transport is used when the loop can watch the socket
+    directly (selector event loops), otherwise (e.g. the Windows proactor loop) the loop's own datagram endpoint.
+    """
+    loop = asyncio.get_running_loop()
+    protocol = protocol_factory()
+    try:
+        transport = BATCHED_DATAGRAM_TRANSPORT(loop, sock, protocol)
+    except NotImplementedError:
+        return await loop.create_datagram_endpoint(lambda: protocol, sock=sock)
+    # let connection_made run before the caller uses the protocol
+    await asyncio.sleep(0)
+    return transport, protocol
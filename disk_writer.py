@@ -0,0 +1,58 @@
+import errno
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+DISK_WRITE_SIZE = 1024 * 1024  # adjacent frames are gathered into writes of up to this many bytes
+DISK_WRITE_THREADS = 4  # writes in flight at once, shared by every file the process receives
+MAX_WRITE_BUFFERS = 512  # buffers in one pwritev, below IOV_MAX on every platform
+
+disk_write_pool: Optional[ThreadPoolExecutor] = None
+
+
+def disk_write_executor() -> ThreadPoolExecutor:
+    """The thread pool that writes received streams to disk, created on first use."""
+    global disk_write_pool
+    if disk_write_pool is None:
+        disk_write_pool = ThreadPoolExecutor(DISK_WRITE_THREADS, thread_name_prefix='disk-write')
+    return disk_write_pool
+
+
+def forget_disk_write_pool() -> None:
+    """A forked process (see parallel_transfer) has none of the pool's threads, it creates its own on first use."""
+    global disk_write_pool
+    disk_write_pool = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=forget_disk_write_pool)
+
+
+def preallocate(fd: int, size: int) -> None:
+    """Reserves the file's blocks up front, so writes at any offset do not fragment it (extends it where it can't)."""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as error:
+            # file systems that cannot reserve blocks just get the size
+            if error.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    os.ftruncate(fd, size)
+
+
+def write_at(fd: int, buffers: List[memoryview], offset: int) -> None:
+    """Writes the buffers one after the other at `offset`, with one pwritev call unless the kernel writes less."""
+    if not hasattr(os, 'pwritev'):
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, b''.join(buffers))
+        return
+    while buffers:
+        written = os.pwritev(fd, buffers, offset)
+        offset += written
+        # drop the buffers that were written in full, and the written part of the next one
+        while buffers and written >= len(buffers[0]):
+            written -= len(buffers[0])
+            buffers = buffers[1:]
+        if written:
+            buffers[0] = buffers[0][written:]
@@ -0,0 +1,177 @@
+import math
+import struct
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+try:
+    import numpy
+except ImportError:  # the XOR falls back to Python's arbitrary-size integers, which are fast enough too
+    numpy = None
+
+FEC_MIN_GROUP_SIZE = 2  # data packets per repair packet at the highest loss rates (a third of the packets is repair)
+FEC_MAX_GROUP_SIZE = 32  # data packets per repair packet on a path without loss
+FEC_MAX_GROUP_SPAN = 64  # packet numbers a group may span (control packets are sent between its data packets)
+FEC_TARGET_GROUP_LOSSES = 0.25  # expected losses per group, one loss per group is what a XOR repair packet rebuilds
+FEC_LOSS_SAMPLE_PACKETS = 64  # acknowledged or lost data packets per sample of the loss rate
+FEC_LOSS_RATE_GAIN = 0.25  # weight of a new sample in the smoothed loss rate
+FEC_HISTORY_PACKETS = 2 * FEC_MAX_GROUP_SPAN  # received packets the receiver keeps to rebuild a missing one from
+# Payload of a REPAIR packet, before the XOR of the data of the group's packets: the first packet number of the group,
+# a bit mask of the packet numbers after it that belong to the group (bit i is packet number first + i), and the XOR
+# of the first bytes (the version and flag) and of the data sizes of the group's packets
+FEC_REPAIR_FORMAT = struct.Struct('!IQBH')
+
+
+class PARITY:
+    """XOR of byte strings of different sizes, the shorter ones count as padded with zeros at the end."""
+
+    def __init__(self):
+        self.size = 0
+        self.value = numpy.zeros(0, dtype=numpy.uint8) if numpy is not None else 0
+
+    def add(self, data) -> None:
+        if numpy is None:
+            self.value ^= int.from_bytes(data, 'little')
+        else:
+            if len(data) > len(self.value):
+                self.value = numpy.concatenate((self.value, numpy.zeros(len(data) - len(self.value), numpy.uint8)))
+            self.value[:len(data)] ^= numpy.frombuffer(data, dtype=numpy.uint8)
+        self.size = max(self.size, len(data))
+
+    def to_bytes(self, size: Optional[int] = None) -> bytes:
+        size = self.size if size is None else size
+        if numpy is None:
+            return self.value.to_bytes(max(size, (self.value.bit_length() + 7) // 8), 'little')[:size]
+        return self.value[:size].tobytes().ljust(size, b'\0')
+
+
+class FEC_ENCODER:
+    """
+    Sender side of forward error correction: after every group of data packets comes a REPAIR packet with the XOR
+    of their types, sizes and data, so the receiver rebuilds any one lost packet of the group without waiting a round
+    trip for its retransmission.
+
+    The group size follows the loss rate of the path, so a group expects FEC_TARGET_GROUP_LOSSES losses: the more
+    packets are lost, the more repair packets are sent. The loss rate counts the packets the receiver rebuilt (ACKs
+    carry their number) as lost, the packets it rebuilt are acknowledged and would hide the losses otherwise. A packet
+    declared lost before its REPAIR packet arrived counts twice, which errs on the side of more redundancy.
+    """
+
+    def __init__(self, min_group_size: int = FEC_MIN_GROUP_SIZE, max_group_size: int = FEC_MAX_GROUP_SIZE):
+        self.min_group_size = min_group_size
+        self.max_group_size = max_group_size
+        self.group_size = max_group_size
+        self.loss_rate = 0.0
+
+        # the group being protected
+        self.first_packet_number: Optional[int] = None
+        self.packet_mask = 0
+        self.packets = 0
+        self.types = 0
+        self.sizes = 0
+        self.parity = PARITY()
+
+        # counts of the current loss rate sample: data packets acknowledged or declared lost, and the lost ones
+        # (the packets the receiver rebuilt are acknowledged, and lost too)
+        self.outcomes = 0
+        self.lost = 0
+        self.peer_recovered_packets = 0  # the receiver's count of rebuilt packets, from the newest ACK
+
+    def protect(self, packet_number: int, packet_type: int, data) -> Optional[bytes]:
+        """
+        Adds a data packet that was just sent to the group. Returns the payload of the REPAIR packet to send when the
+        packet completes the group, or when the group was closed because the packet is too far from its start.
+        """
+        repair_payload = None
+        if self.first_packet_number is not None and packet_number - self.first_packet_number >= FEC_MAX_GROUP_SPAN:
+            repair_payload = self.flush()
+        if self.first_packet_number is None:
+            self.first_packet_number = packet_number
+        self.packet_mask |= 1 << (packet_number - self.first_packet_number)
+        self.packets += 1
+        self.types ^= packet_type
+        self.sizes ^= len(data)
+        self.parity.add(data)
+        if self.packets >= self.group_size:
+            repair_payload = self.flush()
+        return repair_payload
+
+    def flush(self) -> Optional[bytes]:
+        """Closes the group, returns its REPAIR payload (None if the group has no packets)."""
+        if self.first_packet_number is None:
+            return None
+        repair_payload = FEC_REPAIR_FORMAT.pack(self.first_packet_number, self.packet_mask, self.types,
+                                                self.sizes) + self.parity.to_bytes()
+        self.first_packet_number = None
+        self.packet_mask = self.packets = self.types = self.sizes = 0
+        self.parity = PARITY()
+        return repair_payload
+
+    def on_packets_acked(self, acked_packets: int, peer_recovered_packets: int) -> None:
+        # ACKs may arrive out of order, the count only grows
+        self.lost += max(peer_recovered_packets - self.peer_recovered_packets, 0)
+        self.peer_recovered_packets = max(self.peer_recovered_packets, peer_recovered_packets)
+        self.outcomes += acked_packets
+        self.update_loss_rate()
+
+    def on_packets_lost(self, lost_packets: int) -> None:
+        self.lost += lost_packets
+        self.outcomes += lost_packets
+        self.update_loss_rate()
+
+    def update_loss_rate(self) -> None:
+        """Takes a loss rate sample every FEC_LOSS_SAMPLE_PACKETS packets, and sizes the next groups from it."""
+        if self.outcomes < FEC_LOSS_SAMPLE_PACKETS:
+            return
+        sample = min(self.lost / self.outcomes, 1.0)
+        self.loss_rate += FEC_LOSS_RATE_GAIN * (sample - self.loss_rate)
+        self.outcomes = self.lost = 0
+        if self.loss_rate <= 0:
+            self.group_size = self.max_group_size
+        else:
+            self.group_size = max(self.min_group_size,
+                                  min(self.max_group_size, math.floor(FEC_TARGET_GROUP_LOSSES / self.loss_rate)))
+
+
+class FEC_DECODER:
+    """
+    Receiver side of forward error correction: keeps the last FEC_HISTORY_PACKETS data packets (views of their
+    datagrams, nothing is copied) and rebuilds the missing packet of a group when its REPAIR packet arrives and
+    every other packet of the group is there. A group missing more than one packet is left to retransmissions.
+    """
+
+    def __init__(self):
+        self.history: 'OrderedDict[int, Tuple[int, memoryview]]' = OrderedDict()
+        self.recovered_packets = 0
+
+    def on_packet_received(self, packet_number: int, packet_type: int, data: memoryview) -> None:
+        self.history[packet_number] = (packet_type, data)
+        while len(self.history) > FEC_HISTORY_PACKETS:
+            self.history.popitem(last=False)
+
+    def recover(self, repair_payload: memoryview, received_packet_numbers) -> Optional[Tuple[int, int, bytes]]:
+        """
+        Returns (packet number, packet type, data) of the packet the REPAIR packet rebuilds, or None if no packet
+        of its group is missing, more than one is, or a received packet of the group is no longer in the history.
+        """
+        first_packet_number, packet_mask, types, sizes = FEC_REPAIR_FORMAT.unpack_from(repair_payload)
+        missing_packet_number = None
+        parity = PARITY()
+        parity.add(repair_payload[FEC_REPAIR_FORMAT.size:])
+        for bit in range(FEC_MAX_GROUP_SPAN):
+            if not packet_mask >> bit & 1:
+                continue
+            packet_number = first_packet_number + bit
+            packet = self.history.get(packet_number)
+            if packet is not None:
+                packet_type, data = packet
+                types ^= packet_type
+                sizes ^= len(data)
+                parity.add(data)
+            elif packet_number in received_packet_numbers or missing_packet_number is not None:
+                return None
+            else:
+                missing_packet_number = packet_number
+        if missing_packet_number is None:
+            return None
+        self.recovered_packets += 1
+        return missing_packet_number, types, parity.to_bytes(sizes)
@@ -0,0 +1,80 @@
+from typing import Optional
+
+INITIAL_MAX_STREAM_DATA = 1024 * 1024  # bytes of a stream the sender may send before the first window update
+INITIAL_MAX_DATA = 4 * 1024 * 1024  # bytes of all the streams of a connection together
+MAX_STREAM_RECEIVE_WINDOW = 16 * 1024 * 1024  # the auto-tuned windows never grow beyond these
+MAX_CONNECTION_RECEIVE_WINDOW = 24 * 1024 * 1024
+CONNECTION_WINDOW_RATIO = 1.5  # the connection window is kept this much larger than the largest stream window
+WINDOW_UPDATE_THRESHOLD = 0.5  # a new limit is advertised once less than this part of the window is left
+AUTOTUNE_RTTS = 2  # the window doubles when a whole window was consumed within this many RTTs
+
+
+class RECEIVE_WINDOW:
+    """
+    Receive side of the credit of one stream (MAX_STREAM_DATA) or of a whole connection (MAX_DATA).
+
+    The sender may send data up to `max_offset`. Data counts as consumed once it was handed to the stream's storage
+    in order, and when less than WINDOW_UPDATE_THRESHOLD of the window is left, the limit moves to
+    `consumed + window`. So the data the receiver holds without having consumed it (queued packets and frames
+    after a gap) never exceeds the window.
+    With auto-tuning, a window that is used up faster than AUTOTUNE_RTTS round trips is smaller than the
+    bandwidth-delay product and doubles, up to `max_window`.
+    """
+
+    def __init__(self, window: int, max_window: int, autotune: bool = True):
+        self.window = window
+        self.max_window = max(max_window, window)
+        self.autotune = autotune
+        self.max_offset = window  # the limit advertised to the sender
+        self.consumed = 0
+        self.highest_received = 0
+        self.last_update_time: Optional[float] = None
+
+    def on_data_received(self, end_offset: int) -> None:
+        """Records data received up to `end_offset`, data beyond the advertised limit breaks the protocol."""
+        if end_offset > self.max_offset:
+            raise Exception(f"Flow control violation: data up to {end_offset}, the limit is {self.max_offset}")
+        self.highest_received = max(self.highest_received, end_offset)
+
+    def on_data_consumed(self, consumed: int) -> None:
+        self.consumed = max(self.consumed, consumed)
+
+    def update_needed(self) -> bool:
+        return self.max_offset - self.consumed < self.window * WINDOW_UPDATE_THRESHOLD
+
+    def update(self, now: float, smoothed_rtt: Optional[float]) -> int:
+        """Auto-tunes the window, moves the limit to `consumed + window` and returns the new limit."""
+        if self.autotune and smoothed_rtt is not None and self.last_update_time is not None and \
+                now - self.last_update_time < AUTOTUNE_RTTS * smoothed_rtt:
+            self.window = min(self.window * 2, self.max_window)
+        self.last_update_time = now
+        self.max_offset = max(self.max_offset, self.consumed + self.window)
+        return self.max_offset
+
+    def raise_initial_window(self, window: int) -> None:
+        """Starts with a window of at least `window` bytes, before any data was received."""
+        self.window = max(self.window, window)
+        self.max_window = max(self.max_window, self.window)
+        self.max_offset = max(self.max_offset, self.window)
+
+    def ensure_window(self, window: int) -> None:
+        """Grows the window to at least `window` bytes (the connection window follows its stream windows)."""
+        self.window = max(self.window, min(window, self.max_window))
+
+
+class SEND_CREDIT:
+    """Send side of the connection credit: the limit the peer advertised and how much of it was used."""
+
+    def __init__(self, max_data: int = INITIAL_MAX_DATA):
+        self.max_data = max_data
+        self.used = 0
+
+    def available(self) -> int:
+        return max(self.max_data - self.used, 0)
+
+    def on_max_data(self, max_data: int) -> bool:
+        """Applies a MAX_DATA update, returns True if it gave new credit (limits only ever grow)."""
+        if max_data <= self.max_data:
+            return False
+        self.max_data = max_data
+        return True
@@ -1,12 +1,32 @@
 import os
-import random
+
+CHARACTERS = b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+CHUNK_SIZE = 4 * 1024 * 1024  # bytes generated and written at a time, the file is never held in memory
+# random bytes below 208 (4 * 52) map evenly onto the characters, the others are dropped so no letter is more likely
+USABLE_BYTES = len(CHARACTERS) * (256 // len(CHARACTERS))
+CHARACTER_TABLE = bytes(CHARACTERS[byte % len(CHARACTERS)] for byte in range(256))
+DROPPED_BYTES = bytes(range(USABLE_BYTES, 256))
+
+
+def random_characters(size: int) -> bytes:
+    """`size` random letters, from bulk random bytes mapped onto CHARACTERS."""
+    data = b''
+    while len(data) < size:
+        # a fifth of the random bytes are dropped, ask for a bit more than the rest needs
+        random_bytes = os.urandom((size - len(data)) * 256 // USABLE_BYTES + 64)
+        data += random_bytes.translate(CHARACTER_TABLE, DROPPED_BYTES)
+    return data[:size]
+
 
 def generate_data_file(file_name: str, size_in_mb: int):
+    """Writes `size_in_mb` MB of random letters to the file, CHUNK_SIZE bytes at a time."""
     file_path = os.path.join(os.getcwd(), file_name)
-    characters = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
-    data = ''.join(random.choice(characters) for _ in range(size_in_mb * 1024 * 1024))
-    with open(file_path, 'w') as file:
-        file.write(data)
+    remaining = size_in_mb * 1024 * 1024
+    with open(file_path, 'wb') as file:
+        while remaining > 0:
+            chunk = random_characters(min(CHUNK_SIZE, remaining))
+            file.write(chunk)
+            remaining -= len(chunk)
 
 if __name__ == "__main__":
-    generate_data_file("random_data_file.txt", 2)
\ No newline at end of file
+    generate_data_file("random_data_file.txt", 2)
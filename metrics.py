@@ -0,0 +1,246 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# upper bounds (seconds) of the RTT histogram buckets, like Prometheus `le` labels
+RTT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+METRICS_FORMATS = ('json', 'prometheus')
+
+
+def seconds_between(start_ns: Optional[int], end_ns: Optional[int]) -> float:
+    """Duration in seconds between two perf_counter_ns readings, 0 if either one is missing."""
+    if start_ns is None or end_ns is None:
+        return 0.0
+    return max(end_ns - start_ns, 0) / 1_000_000_000
+
+
+def rate(amount: int, seconds: float) -> float:
+    """Amount per second, 0 for an empty interval (a single packet, or a stream that did not start)."""
+    return amount / seconds if seconds > 0 else 0.0
+
+
+class HISTOGRAM:
+    """Cumulative histogram with fixed bucket bounds, the last bucket counts everything above the largest bound."""
+
+    def __init__(self, buckets: Iterable[float] = RTT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float) -> None:
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def cumulative_counts(self) -> List[Tuple[str, int]]:
+        """Returns (upper bound, observations <= bound) pairs, ending with '+Inf'."""
+        counts = []
+        total = 0
+        for bound, bucket_count in zip((*self.buckets, '+Inf'), self.bucket_counts):
+            total += bucket_count
+            counts.append((str(bound), total))
+        return counts
+
+    def snapshot(self) -> dict:
+        return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max,
+                'buckets': dict(self.cumulative_counts())}
+
+
+class STREAM_METRICS:
+    """Counters of one stream, on the side that receives it (or sends it)."""
+
+    def __init__(self, stream_id: int):
+        self.stream_id = stream_id
+        self.packets = 0  # packets that carried at least one frame of the stream
+        self.frames = 0
+        self.bytes = 0  # stream data, without headers and duplicates
+        self.gap_bytes = 0  # bytes below the highest received offset that are still missing
+        self.start_ns: Optional[int] = None  # first frame
+        self.end_ns: Optional[int] = None  # stream complete
+
+    def on_frame(self, length: int, now_ns: int) -> None:
+        if self.start_ns is None:
+            self.start_ns = now_ns
+        self.frames += 1
+        self.bytes += length
+
+    def duration(self, now_ns: Optional[int] = None) -> float:
+        return seconds_between(self.start_ns, self.end_ns if self.end_ns is not None else now_ns)
+
+    def snapshot(self, now_ns: int) -> dict:
+        duration = self.duration(now_ns)
+        return {'stream_id': self.stream_id, 'packets': self.packets, 'frames': self.frames, 'bytes': self.bytes,
+                'gap_bytes': self.gap_bytes, 'complete': self.end_ns is not None, 'duration': duration,
+                'goodput': rate(self.bytes, duration)}
+
+
+class CONNECTION_METRICS:
+    """
+    Live counters, gauges and histograms of one connection.
+
+    Counters only grow and are updated on the hot path with plain integer additions. Gauges (congestion window,
+    bytes in flight, queue depths, reassembly gaps) are sampled by QUIC_CONNECTION.collect_metrics right before a
+    snapshot. All the times come from time.perf_counter_ns, which never jumps like the wall clock does.
+    """
+
+    # name, type, help of every connection counter and gauge, in export order
+    FIELDS = (
+        ('packets_sent', 'counter', 'Packets sent'),
+        ('bytes_sent', 'counter', 'Bytes sent, headers included'),
+        ('stream_bytes_sent', 'counter', 'Stream data bytes sent, retransmissions included'),
+        ('packets_received', 'counter', 'Packets received, duplicates included'),
+        ('bytes_received', 'counter', 'Bytes received, headers included'),
+        ('duplicate_packets', 'counter', 'Packets received more than once'),
+        ('stream_bytes_received', 'counter', 'Stream data bytes received'),
+        ('frames_received', 'counter', 'Stream frames received'),
+        ('packets_lost', 'counter', 'Packets declared lost'),
+        ('packets_retransmitted', 'counter', 'Lost packets whose content was sent again'),
+        ('window_updates_sent', 'counter', 'MAX_DATA and MAX_STREAM_DATA packets sent'),
+        ('compression_input_bytes', 'counter', 'Stream bytes compressed before sending'),
+        ('compression_output_bytes', 'counter', 'Compressed bytes those stream bytes were sent as'),
+        ('fec_repair_packets_sent', 'counter', 'Forward error correction REPAIR packets sent'),
+        ('fec_recovered_packets', 'counter', 'Lost packets rebuilt from REPAIR packets'),
+        ('congestion_window', 'gauge', 'Congestion window in bytes'),
+        ('bytes_in_flight', 'gauge', 'Bytes sent and not acknowledged or lost yet'),
+        ('max_datagram_size', 'gauge', 'Packet size found by path MTU discovery'),
+        ('smoothed_rtt', 'gauge', 'Smoothed RTT in seconds'),
+        ('receive_queue_depth', 'gauge', 'Received packets waiting to be processed'),
+        ('send_queue_depth', 'gauge', 'Datagrams waiting in the transport send queue'),
+        ('retransmit_queue_depth', 'gauge', 'Lost frames waiting to be sent again'),
+        ('reassembly_gap_bytes', 'gauge', 'Missing bytes below the highest received offset of open streams'),
+        ('send_credit', 'gauge', 'Stream bytes the connection may still send before the peer raises MAX_DATA'),
+        ('receive_window', 'gauge', 'Connection flow control receive window in bytes'),
+        ('fec_group_size', 'gauge', 'Stream packets per forward error correction REPAIR packet, 0 without it'),
+    )
+
+    def __init__(self, connection_id: int = 0):
+        self.connection_id = connection_id
+        self.start_ns = time.perf_counter_ns()
+        # first and last stream data sent or received, the interval goodput is measured over
+        self.data_start_ns: Optional[int] = None
+        self.data_end_ns: Optional[int] = None
+        for name, _, _ in self.FIELDS:
+            setattr(self, name, 0)
+        self.rtt = HISTOGRAM()
+        self.streams: Dict[int, STREAM_METRICS] = {}
+
+    def stream(self, stream_id: int) -> STREAM_METRICS:
+        stream_metrics = self.streams.get(stream_id)
+        if stream_metrics is None:
+            stream_metrics = self.streams[stream_id] = STREAM_METRICS(stream_id)
+        return stream_metrics
+
+    def on_data(self, now_ns: int) -> None:
+        if self.data_start_ns is None:
+            self.data_start_ns = now_ns
+        self.data_end_ns = now_ns
+
+    def goodput(self) -> float:
+        """Stream bytes per second over the interval data was moving, on the side that sent or received more."""
+        return rate(max(self.stream_bytes_sent, self.stream_bytes_received),
+                    seconds_between(self.data_start_ns, self.data_end_ns))
+
+    def snapshot(self) -> dict:
+        now_ns = time.perf_counter_ns()
+        snapshot = {'time_ns': now_ns, 'connection_id': self.connection_id,
+                    'uptime': seconds_between(self.start_ns, now_ns), 'goodput': self.goodput()}
+        for name, _, _ in self.FIELDS:
+            snapshot[name] = getattr(self, name)
+        snapshot['rtt'] = self.rtt.snapshot()
+        snapshot['streams'] = [stream_metrics.snapshot(now_ns) for stream_metrics in self.streams.values()]
+        return snapshot
+
+    def to_json_line(self) -> str:
+        return json.dumps(self.snapshot(), separators=(',', ':')) + '\n'
+
+    def to_prometheus(self) -> str:
+        """Renders the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        labels = f'connection_id="{self.connection_id}"'
+        lines = []
+        for name, metric_type, description in self.FIELDS:
+            metric = f'quic_{name}_total' if metric_type == 'counter' else f'quic_{name}'
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {metric_type}',
+                      f'{metric}{{{labels}}} {snapshot[name]}']
+
+        lines += ['# HELP quic_goodput_bytes_per_second Stream bytes per second while data was moving',
+                  '# TYPE quic_goodput_bytes_per_second gauge',
+                  f'quic_goodput_bytes_per_second{{{labels}}} {snapshot["goodput"]}']
+
+        lines += ['# HELP quic_rtt_seconds RTT samples', '# TYPE quic_rtt_seconds histogram']
+        for bound, count in self.rtt.cumulative_counts():
+            lines.append(f'quic_rtt_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines += [f'quic_rtt_seconds_sum{{{labels}}} {self.rtt.sum}',
+                  f'quic_rtt_seconds_count{{{labels}}} {self.rtt.count}']
+
+        for name, metric_type, description in (('bytes', 'counter', 'Stream data bytes'),
+                                               ('frames', 'counter', 'Stream frames'),
+                                               ('gap_bytes', 'gauge', 'Missing bytes of the stream'),
+                                               ('goodput', 'gauge', 'Stream bytes per second')):
+            metric = f'quic_stream_{name}_total' if metric_type == 'counter' else f'quic_stream_{name}'
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {metric_type}']
+            for stream_snapshot in snapshot['streams']:
+                lines.append(f'{metric}{{{labels},stream_id="{stream_snapshot["stream_id"]}"}} '
+                             f'{stream_snapshot[name]}')
+        return '\n'.join(lines) + '\n'
+
+
+def write_metrics(metrics: CONNECTION_METRICS, path: str, metrics_format: str) -> None:
+    """
+    JSON snapshots are appended to the file one per line. The Prometheus exposition replaces the file atomically,
+    so a node exporter textfile collector (or anyone else) never reads half of it.
+    """
+    if metrics_format == 'json':
+        with open(path, 'a') as output:
+            output.write(metrics.to_json_line())
+    elif metrics_format == 'prometheus':
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as output:
+            output.write(metrics.to_prometheus())
+        os.replace(temporary_path, path)
+    else:
+        raise Exception(f"Unknown metrics format {metrics_format!r}, expected one of {METRICS_FORMATS}")
+
+
+class QLOG_TRACE:
+    """
+    Optional event trace in the qlog format (draft-ietf-quic-qlog-main-schema), written as JSON text sequences:
+    a header record, then one record per event with the time in milliseconds since the trace started.
+    Only used when a connection is given a trace path, every event costs a json.dumps and a write.
+    """
+
+    def __init__(self, path: str, title: str = 'QUIC_Multi_Streams', vantage_point: str = 'client'):
+        self.output = open(path, 'w')
+        self.start_ns = time.perf_counter_ns()
+        self.write({'qlog_version': '0.3', 'qlog_format': 'JSON-SEQ', 'title': title,
+                    'trace': {'vantage_point': {'type': vantage_point},
+                              'common_fields': {'time_format': 'relative', 'reference_time': time.time() * 1000}}})
+
+    def write(self, record: dict) -> None:
+        self.output.write('\x1e' + json.dumps(record, separators=(',', ':')) + '\n')
+
+    def event(self, name: str, data: dict) -> None:
+        if self.output.closed:
+            return
+        self.write({'time': (time.perf_counter_ns() - self.start_ns) / 1_000_000, 'name': name, 'data': data})
+
+    def close(self) -> None:
+        if not self.output.closed:
+            self.output.close()
+
+
+async def export_metrics_periodically(collect, path: str, metrics_format: str, interval: float) -> None:
+    """Writes `collect()` (which returns the CONNECTION_METRICS) every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        write_metrics(collect(), path, metrics_format)
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import socket
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from typing import List, Optional, Tuple
+
+from QUIC import QUIC_CONNECTION, QUIC_SERVER
+from metrics import rate, seconds_between
+from resumption import TICKET_ISSUER
+
+ACCEPT_POLL_INTERVAL = 0.1  # seconds between checks of the stop event while a receiver worker waits for clients
+# the first batch of every connection of a parallel transfer: the connections and files of the whole transfer, and
+# the index of the connection's first file among them
+TRANSFER_HEADER_FORMAT = struct.Struct('!III')
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def shard_streams(streams_amount: int, workers: int) -> List[Tuple[int, int]]:
+    """Splits the stream indexes into at most `workers` contiguous [start, end) ranges of almost equal size."""
+    workers = max(1, min(workers, streams_amount))
+    shard_size, remainder = divmod(streams_amount, workers)
+    shards = []
+    start = 0
+    for worker in range(workers):
+        end = start + shard_size + (1 if worker < remainder else 0)
+        shards.append((start, end))
+        start = end
+    return shards
+
+
+def enable_reuse_port(sock: socket.socket) -> None:
+    """Lets every worker process bind its own socket to the same port, the kernel hashes each client to one of them."""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise Exception("SO_REUSEPORT is not supported on this platform, use a single process instead")
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+
+def send_worker(host: str, port: int, file_paths: List[str], first_index: int, connections: int, total_files: int,
+                congestion_control: str) -> dict:
+    """
+    Runs in a worker process: sends one shard of the files on its own connection and returns a snapshot of its
+    metrics.
+    The transfer header goes first, so the receiver knows how many connections to wait for and names every file by
+    its index in the list of all the files, no matter which connection carried it.
+    """
+    async def send() -> dict:
+        conn = QUIC_CONNECTION(congestion_control=congestion_control)
+        conn.connect_to(host, port)
+        await conn.send_data([TRANSFER_HEADER_FORMAT.pack(connections, total_files, first_index)])
+        await conn.send_files(file_paths)
+        # the FIN is sent once everything was acknowledged, and sent again if it is lost
+        await conn.close()
+        return conn.collect_metrics().snapshot()
+
+    return asyncio.run(send())
+
+
+def send_files_parallel(host: str, port: int, file_paths: List[str], workers: Optional[int] = None,
+                        congestion_control: str = 'newreno') -> List[dict]:
+    """
+    Sends the files from a pool of worker processes, so packing and sending use every core.
+    1. the files are split into one contiguous shard per worker
+    2. every worker opens its own connection (its own UDP socket and connection ID), sends the transfer header
+       and then its shard
+    3. the main process only waits for the workers and prints the statistics of the whole transfer
+    """
+    shards = shard_streams(len(file_paths), workers or default_workers())
+    start_ns = time.perf_counter_ns()
+    with ProcessPoolExecutor(len(shards)) as pool:
+        futures = [pool.submit(send_worker, host, port, file_paths[start:end], start, len(shards), len(file_paths),
+                               congestion_control)
+                   for start, end in shards]
+        worker_metrics = [future.result() for future in futures]
+    print_parallel_stats("Sender", worker_metrics, seconds_between(start_ns, time.perf_counter_ns()))
+    return worker_metrics
+
+
+async def receive_worker_main(host: str, port: int, file_name_pattern: str, congestion_control: str,
+                              ticket_secret: bytes, ready, results, stop) -> None:
+    # every worker checks tickets with the same secret, a resumed client may land on any of them
+    server = QUIC_SERVER(congestion_control=congestion_control, ticket_issuer=TICKET_ISSUER(ticket_secret))
+    enable_reuse_port(server.sock)
+    await server.listen_to(host, port)
+    ready.put(os.getpid())
+
+    async def receive_session(session: QUIC_CONNECTION) -> None:
+        try:
+            header = await session.receive_data()
+            if header is None or len(header) != 1 or len(header[0]) != TRANSFER_HEADER_FORMAT.size:
+                raise Exception("A client did not start with a transfer header, send with send_files_parallel")
+            connections, total_files, first_index = TRANSFER_HEADER_FORMAT.unpack(header[0])
+            file_paths = []
+            while True:
+                file_batch = await session.receive_files(file_name_pattern, first_index + len(file_paths))
+                if file_batch is None:
+                    break
+                file_paths.extend(file_batch)
+        except Exception as error:
+            # the main process raises it, instead of waiting for a client that will never be counted
+            results.put(error)
+            return
+        results.put((connections, total_files, first_index, file_paths, session.collect_metrics().snapshot()))
+
+    sessions = []
+    while not stop.is_set():
+        try:
+            session = await asyncio.wait_for(server.accept(), ACCEPT_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            continue
+        sessions.append(asyncio.create_task(receive_session(session)))
+    await asyncio.gather(*sessions)
+    server.close()
+
+
+def receive_worker(host: str, port: int, file_name_pattern: str, congestion_control: str,
+                   ticket_secret: bytes, ready, results, stop) -> None:
+    """Runs in a worker process: serves every client the kernel hands to this process's socket."""
+    asyncio.run(receive_worker_main(host, port, file_name_pattern, congestion_control, ticket_secret,
+                                    ready, results, stop))
+
+
+class PARALLEL_RECEIVER:
+    """
+    Receives files from many connections on one port with a pool of worker processes.
+
+    Every worker binds a QUIC_SERVER socket to the same port with SO_REUSEPORT, and the kernel spreads the clients
+    between them by their address, so all the packets of a connection reach the same process, which parses and
+    reassembles them without talking to the others. The main process only tells the workers when to stop and
+    collects the statistics and the received files.
+    """
+
+    def __init__(self, workers: Optional[int] = None, congestion_control: str = 'newreno'):
+        self.workers = workers or default_workers()
+        self.congestion_control = congestion_control
+        self.manager = None
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.futures = []
+        self.ready = self.results = self.stop = None
+        self.start_ns = None
+
+    def listen_to(self, host: str, port: int, file_name_pattern: str) -> None:
+        """Starts the workers and returns once every one of them is listening."""
+        print(f"Listening for incoming connections on {host}:{port} with {self.workers} worker processes")
+        self.manager = Manager()
+        self.ready, self.results, self.stop = self.manager.Queue(), self.manager.Queue(), self.manager.Event()
+        self.pool = ProcessPoolExecutor(self.workers)
+        ticket_secret = os.urandom(32)
+        self.futures = [self.pool.submit(receive_worker, host, port, file_name_pattern, self.congestion_control,
+                                         ticket_secret, self.ready, self.results, self.stop)
+                        for _ in range(self.workers)]
+        for _ in range(self.workers):
+            self.ready.get()
+        self.start_ns = time.perf_counter_ns()
+
+    def receive_files(self, connections: Optional[int] = None) -> List[str]:
+        """
+        Waits until every client of the transfer sent its files and ended, returns the paths of all the files in the
+        order they were sent in (every client sent a contiguous range of them).
+        1. the transfer header of the first client that ends tells how many connections and files to wait for
+        2. raises if it disagrees with `connections` (when given) or with the header of another client
+        3. raises if the clients sent fewer or more files than the transfer has
+        """
+        session_files = []
+        connection_metrics = []
+        transfer = None
+        while transfer is None or len(session_files) < transfer[0]:
+            result = self.results.get()
+            if isinstance(result, Exception):
+                raise result
+            sender_connections, total_files, first_index, file_paths, session_metrics = result
+            if transfer is None:
+                transfer = (sender_connections, total_files)
+                if connections is not None and sender_connections != connections:
+                    raise Exception(f"The sender opened {sender_connections} connections, "
+                                    f"the receiver expected {connections}")
+            elif (sender_connections, total_files) != transfer:
+                raise Exception(f"The clients disagree on the transfer: {transfer[0]} connections and {transfer[1]} "
+                                f"files, then {sender_connections} connections and {total_files} files")
+            session_files.append((first_index, file_paths))
+            connection_metrics.append(session_metrics)
+        received_files = sum(len(file_paths) for _, file_paths in session_files)
+        if received_files != transfer[1]:
+            raise Exception(f"Received {received_files} of the {transfer[1]} files of the transfer")
+        print_parallel_stats("Receiver", connection_metrics, seconds_between(self.start_ns, time.perf_counter_ns()))
+        session_files.sort(key=lambda first_index_files: first_index_files[0])
+        return [file_path for _, file_paths in session_files for file_path in file_paths]
+
+    def close(self) -> None:
+        if self.pool is None:
+            return
+        self.stop.set()
+        for future in self.futures:
+            future.result()
+        self.pool.shutdown()
+        self.manager.shutdown()
+        self.pool = None
+
+
+def print_parallel_stats(side: str, connection_metrics: List[dict], total_time: float) -> None:
+    """Prints the goodput of every connection (from its metrics snapshot) and of the whole transfer."""
+    print(f"********** {side} Parallel Transfer Statistics **********\n")
+    total_bytes = 0
+    for index, metrics in enumerate(connection_metrics):
+        stream_bytes = max(metrics['stream_bytes_sent'], metrics['stream_bytes_received'])
+        total_bytes += stream_bytes
+        print(f"Connection {index}: {stream_bytes} bytes, {metrics['packets_sent'] + metrics['packets_received']} "
+              f"packets, {metrics['packets_lost']} lost, {metrics['goodput']:.2f} bytes/sec")
+    print(f"\nOverall average bytes per second: {rate(total_bytes, total_time):.2f} bytes/sec")
+    print("********** End of Statistics **********")
@@ -0,0 +1,128 @@
+import socket
+import sys
+from typing import Optional
+
+BASE_DATAGRAM_SIZE = 1200  # UDP payload every IPv4/IPv6 path carries, the QUIC minimum
+ETHERNET_DATAGRAM_SIZE = 1472  # UDP payload of a 1500-byte Ethernet MTU (20 bytes IPv4 + 8 bytes UDP header)
+MAX_PROBES = 3  # a size is given up after this many lost probes
+SEARCH_GRANULARITY = 32  # the search stops once the unknown range is smaller than this
+RAISE_INTERVAL = 600  # seconds, a finished search is repeated after this to find a larger path MTU
+BLACK_HOLE_PTO_COUNT = 3  # consecutive probe timeouts after which packets fall back to the base size
+
+# Linux socket options, not exported by the socket module
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+
+
+def disable_fragmentation(sock: socket.socket) -> None:
+    """
+    Sets the Don't Fragment bit on the socket's datagrams, so a datagram larger than the path MTU is dropped
+    (or refused with EMSGSIZE) instead of being fragmented. Only Linux supports it, elsewhere probes that are too
+    large may still arrive fragmented, which only makes the search settle on a larger size.
+    """
+    if not sys.platform.startswith('linux'):
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+    except OSError:
+        pass
+
+
+class PATH_MTU_DISCOVERY:
+    """
+    Packetization-layer path MTU discovery (RFC 8899) of one connection.
+
+    The connection starts at BASE_DATAGRAM_SIZE and sends padding-only probe packets of larger sizes. An acknowledged
+    probe raises `max_datagram_size` to the probe size, a probe size that is lost MAX_PROBES times becomes the upper
+    bound of the search. The search tries ETHERNET_DATAGRAM_SIZE first, then halves the range between the largest
+    acknowledged and the smallest failed size. Lost probes are not a congestion signal and are not retransmitted,
+    and a probe the kernel refuses with EMSGSIZE fails at once. When full-size packets stop getting through (EMSGSIZE
+    from the kernel, or repeated probe timeouts), the size falls back to the base and the search starts over.
+    """
+
+    def __init__(self, max_size: int, base_size: int = BASE_DATAGRAM_SIZE):
+        self.max_size = max_size
+        self.base_size = min(base_size, max_size)
+        self.max_datagram_size = self.base_size
+        self.search_low = self.base_size  # largest size known to get through
+        self.search_high = max_size  # smallest size known not to get through, or the largest size allowed
+        self.high_failed = False  # whether `search_high` was lost MAX_PROBES times
+        self.probe_size: Optional[int] = None  # size of the probe in flight
+        self.probe_count = 0  # probes of `probe_size` that were lost
+        self.search_done_time: Optional[float] = None
+
+    def next_probe_size(self, now: float) -> Optional[int]:
+        """Returns the size of the probe to send now, or None if a probe is in flight or the search is done."""
+        if self.probe_size is not None:
+            return None
+        if self.search_done_time is not None:
+            if now - self.search_done_time < RAISE_INTERVAL:
+                return None
+            # look for a larger path MTU again
+            self.search_done_time = None
+            self.search_high = self.max_size
+            self.high_failed = False
+
+        if self.search_high - self.search_low < SEARCH_GRANULARITY:
+            self.search_done_time = now
+            return None
+        if self.search_low < ETHERNET_DATAGRAM_SIZE < self.search_high:
+            size = ETHERNET_DATAGRAM_SIZE
+        elif not self.high_failed:
+            # the largest allowed size may simply work (e.g. on loopback or jumbo frame links)
+            size = self.search_high
+        else:
+            size = (self.search_low + self.search_high) // 2
+        self.probe_size = size
+        return size
+
+    def on_probe_acked(self, size: int) -> None:
+        if size > self.max_datagram_size:
+            self.max_datagram_size = size
+        self.search_low = max(self.search_low, size)
+        if size == self.probe_size:
+            self.probe_size = None
+            self.probe_count = 0
+
+    def on_probe_lost(self, size: int) -> None:
+        if size != self.probe_size:
+            return
+        self.probe_size = None
+        self.probe_count += 1
+        if self.probe_count >= MAX_PROBES:
+            self.on_probe_failed(size)
+
+    def on_probe_failed(self, size: int) -> None:
+        """The path does not carry the probe's size, it becomes the upper bound of the search."""
+        self.probe_size = None
+        self.probe_count = 0
+        self.search_high = size
+        self.high_failed = True
+
+    def on_packet_too_big(self) -> None:
+        """
+        The kernel refused a datagram as larger than the path MTU it knows. While a probe is in flight it is the only
+        datagram larger than an acknowledged size, so only the probe failed. Otherwise the path cannot carry
+        `max_datagram_size` anymore: fall back to the base size and search again below it.
+        """
+        if self.probe_size is not None and self.probe_size > self.max_datagram_size:
+            self.on_probe_failed(self.probe_size)
+            return
+        self.fall_back(high_failed=True)
+
+    def on_black_hole(self) -> None:
+        """
+        Full-size packets stopped getting through (repeated probe timeouts): fall back to the base size. The timeouts
+        may have been plain loss, so the size that was acknowledged is probed again first instead of ruled out.
+        """
+        self.fall_back(high_failed=False)
+
+    def fall_back(self, high_failed: bool) -> None:
+        if self.max_datagram_size > self.base_size:
+            self.search_high = self.max_datagram_size
+            self.high_failed = high_failed
+        self.max_datagram_size = self.base_size
+        self.search_low = self.base_size
+        self.probe_size = None
+        self.probe_count = 0
+        self.search_done_time = None
@@ -1,8 +1,12 @@
 import asyncio
 from QUIC import QUIC_CONNECTION
+from parallel_transfer import PARALLEL_RECEIVER
 
 BIND_ADDRESS = '0.0.0.0'
 LISTEN_PORT = 9191
+# more than 1 receives with a pool of worker processes sharing the port (SO_REUSEPORT), from a sender that uses
+# send_files_parallel (with any number of workers), which tells how many connections it opens
+WORKERS = 1
 
 
 async def accept_data() -> None:
@@ -10,20 +14,27 @@ async def accept_data() -> None:
     conn.listen_to(BIND_ADDRESS, LISTEN_PORT)
 
     while True:
-        data_batch = await conn.receive_data()
-        if data_batch is None:
-            break
-
         """
-        taking the data_batch and writing each data chunk to a separate file
+        each stream of the batch is written to a separate file while its frames arrive
         """
-        for index, data_chunk in enumerate(data_batch):
-            file_name = f"output_f{index}.txt"
-            with open(file_name, "wb") as output_file:
-                output_file.write(data_chunk)
+        file_batch = await conn.receive_files("output_f{index}.txt")
+        if file_batch is None:
+            break
 
     conn.end_communication()
 
 
+def accept_data_parallel(workers: int) -> None:
+    receiver = PARALLEL_RECEIVER(workers)
+    receiver.listen_to(BIND_ADDRESS, LISTEN_PORT, "output_f{index}.txt")
+    try:
+        receiver.receive_files()
+    finally:
+        receiver.close()
+
+
 if __name__ == '__main__':
-    asyncio.run(accept_data())
+    if WORKERS > 1:
+        accept_data_parallel(WORKERS)
+    else:
+        asyncio.run(accept_data())
@@ -0,0 +1,80 @@
+import hashlib
+import hmac
+import os
+import struct
+import time
+from typing import Dict, Optional, Tuple
+
+TICKET_LIFETIME = 24 * 3600  # seconds a resumption ticket is accepted after it was issued
+# ticket body: wall clock time it was issued, and the flow control limits the server started the connection with
+TICKET_FORMAT = struct.Struct('!dQQ')
+TICKET_MAC_LENGTH = 16  # bytes of the HMAC-SHA256 tag that authenticates the body
+
+
+class TICKET_ISSUER:
+    """
+    Issues and checks the resumption tickets of a server.
+
+    A ticket is the server's own record of a past handshake: when it was issued and the initial flow control limits
+    the server gave, with an HMAC over the record and the client's host, keyed by a secret only the server knows.
+    So the server needs no per-client state, a ticket cannot be forged or moved to another address, and one issued
+    by another server process (another secret) or older than `lifetime` is recognized as such.
+    """
+
+    def __init__(self, secret: Optional[bytes] = None, lifetime: float = TICKET_LIFETIME):
+        self.secret = secret if secret is not None else os.urandom(32)
+        self.lifetime = lifetime
+
+    def mac(self, body: bytes, host: str) -> bytes:
+        return hmac.new(self.secret, body + host.encode(), hashlib.sha256).digest()[:TICKET_MAC_LENGTH]
+
+    def issue(self, host: str, max_data: int, max_stream_data: int) -> bytes:
+        body = TICKET_FORMAT.pack(time.time(), max_data, max_stream_data)
+        return body + self.mac(body, host)
+
+    def open(self, ticket: bytes, host: str) -> Tuple[bool, Optional[Tuple[int, int]]]:
+        """
+        Returns (valid, (max_data, max_stream_data)). The limits of a ticket that is not valid are what the ticket
+        claims, they are None if the ticket is malformed.
+        """
+        if len(ticket) != TICKET_FORMAT.size + TICKET_MAC_LENGTH:
+            return False, None
+        body, tag = ticket[:TICKET_FORMAT.size], ticket[TICKET_FORMAT.size:]
+        issue_time, max_data, max_stream_data = TICKET_FORMAT.unpack(body)
+        valid = hmac.compare_digest(tag, self.mac(body, host)) and 0 <= time.time() - issue_time <= self.lifetime
+        return valid, (max_data, max_stream_data)
+
+
+class SESSION_TICKET:
+    """What a client keeps from a handshake to resume with: the opaque ticket and the limits the server gave."""
+
+    def __init__(self, ticket: bytes, max_data: int, max_stream_data: int):
+        self.ticket = ticket
+        self.max_data = max_data
+        self.max_stream_data = max_stream_data
+        self.received_time = time.monotonic()
+
+
+class TICKET_STORE:
+    """The newest ticket of every server address, dropped once it is older than the server would accept."""
+
+    def __init__(self, lifetime: float = TICKET_LIFETIME):
+        self.lifetime = lifetime
+        self.tickets: Dict[Tuple[str, int], SESSION_TICKET] = {}
+
+    def get(self, address: Tuple[str, int]) -> Optional[SESSION_TICKET]:
+        ticket = self.tickets.get(address)
+        if ticket is not None and time.monotonic() - ticket.received_time > self.lifetime:
+            del self.tickets[address]
+            return None
+        return ticket
+
+    def put(self, address: Tuple[str, int], ticket: SESSION_TICKET) -> None:
+        self.tickets[address] = ticket
+
+    def remove(self, address: Tuple[str, int]) -> None:
+        self.tickets.pop(address, None)
+
+
+# tickets of every client connection of the process that is not given its own store
+session_tickets = TICKET_STORE()
@@ -1,31 +1,36 @@
 import asyncio
 from QUIC import QUIC_CONNECTION
+from parallel_transfer import send_files_parallel
 
 LOCAL_ADDRESS = '127.0.0.1'
 TARGET_PORT = 9191
 FILE_TO_SEND = "random_data_file.txt"
+NUM_OF_STREAMS = 3
+# more than 1 sends the streams from a pool of worker processes, each worker on its own connection
+# (a receiver with WORKERS > 1 needs this mode, PARALLEL_TRANSFER = True sends in it with a single worker too)
+WORKERS = 1
+PARALLEL_TRANSFER = False
 
 
 async def transmit_data(file_to_send: str, num_of_streams: int):
     """
-    This method is used to send data to the receiver. The data is read from a file and sent to the receiver.
+    This method is used to send data to the receiver. The file is sent on each of the streams.
     The method is defined as an asynchronous method to allow for the use of the await keyword,
-    which is used to wait for the completion of the send_data method.
+    which is used to wait for the completion of the send_files method.
+    send_files memory-maps the file, so it is read lazily and never loaded into memory as a whole.
     """
     conn = QUIC_CONNECTION()
     conn.connect_to(LOCAL_ADDRESS, TARGET_PORT)
 
-    with open(file_to_send, "rb") as file:
-        content = file.read()
-
     # num_of_streams = int(input("Enter the desired number of streams: "))
-    payload = [content] * num_of_streams
-    await conn.send_data(payload)
+    await conn.send_files([file_to_send] * num_of_streams)
 
-    # Adding a small delay before closing the connection
-    await asyncio.sleep(0.01)
-    conn.end_communication()
+    # the FIN is sent once everything was acknowledged, and sent again if it is lost
+    await conn.close()
 
 
 if __name__ == '__main__':
-    asyncio.run(transmit_data(FILE_TO_SEND, 3))
+    if WORKERS > 1 or PARALLEL_TRANSFER:
+        send_files_parallel(LOCAL_ADDRESS, TARGET_PORT, [FILE_TO_SEND] * NUM_OF_STREAMS, WORKERS)
+    else:
+        asyncio.run(transmit_data(FILE_TO_SEND, NUM_OF_STREAMS))
@@ -0,0 +1,153 @@
+import asyncio
+import math
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+DEFAULT_STREAM_PRIORITY = 3  # like HTTP urgency: 0 is the most urgent level, 7 the least
+DEFAULT_STREAM_WEIGHT = 1
+SCHEDULER_QUANTUM = 1200  # default bytes a stream of weight 1 may send per round before the next stream of its level
+STREAM_SEND_BUFFER_SIZE = 1024 * 1024  # bytes an async iterator may buffer ahead of the packetizer
+
+
+class SEND_STREAM:
+    """
+    The send side of one stream: the data its producer wrote that was not packed into a packet yet.
+
+    Chunks are kept as memoryviews, so a bytes-like stream is written once as a single view and every frame
+    is a slice of it. A producer reading an async iterator waits on `space_available` while more than
+    STREAM_SEND_BUFFER_SIZE bytes are buffered.
+    Data is only packed up to `max_stream_data`, the flow control limit the receiver advertised for the stream, so
+    a stream without credit keeps its data buffered (and its producer waiting) until a MAX_STREAM_DATA raises it.
+    """
+
+    def __init__(self, stream_id: int, priority: int = DEFAULT_STREAM_PRIORITY, weight: int = DEFAULT_STREAM_WEIGHT,
+                 max_frame_payload: Optional[int] = None, on_data: Optional[Callable[[], None]] = None,
+                 max_stream_data: float = math.inf):
+        self.stream_id = stream_id
+        self.priority = priority
+        self.weight = weight
+        self.max_frame_payload = max_frame_payload
+        self.on_data = on_data
+        self.max_stream_data = max_stream_data
+        self.frame_flags = 0  # flags every frame of the stream carries (the codec of a compressed stream)
+
+        self.chunks: Deque[memoryview] = deque()
+        self.buffered_bytes = 0
+        self.offset = 0  # offset of the next byte to pack
+        self.finished = False  # the producer wrote all the data
+        self.fin_sent = False
+        self.fin_packed = asyncio.Event()  # set once the last frame of the stream was packed into a packet
+        self.deficit = 0  # bytes the stream may still send in its current round
+        self.space_available = asyncio.Event()
+        self.space_available.set()
+
+    def write(self, data) -> None:
+        view = memoryview(data)
+        if len(view) != 0:
+            self.chunks.append(view)
+            self.buffered_bytes += len(view)
+        if self.buffered_bytes >= STREAM_SEND_BUFFER_SIZE:
+            self.space_available.clear()
+        if self.on_data is not None:
+            self.on_data()
+
+    def finish(self) -> None:
+        self.finished = True
+        if self.on_data is not None:
+            self.on_data()
+
+    def has_data(self, max_bytes: int = 1) -> bool:
+        """
+        True if some of the data can be packed in `max_bytes` without going beyond the stream's credit,
+        or only the FIN of the stream is left to send.
+        """
+        if self.buffered_bytes != 0:
+            return max_bytes > 0 and self.offset < self.max_stream_data
+        return self.finished and not self.fin_sent
+
+    def on_max_stream_data(self, max_stream_data: int) -> None:
+        """Applies a MAX_STREAM_DATA update, limits only ever grow."""
+        self.max_stream_data = max(self.max_stream_data, max_stream_data)
+
+    def is_done(self) -> bool:
+        return self.fin_sent
+
+    def read(self, max_bytes: int) -> Tuple[int, memoryview, bool]:
+        """Takes up to `max_bytes` from the front of the buffer, returns (offset, data, is_last_frame)."""
+        if self.max_frame_payload is not None:
+            max_bytes = min(max_bytes, self.max_frame_payload)
+        max_bytes = min(max_bytes, self.max_stream_data - self.offset)
+        data = memoryview(b'')
+        if self.chunks:
+            chunk = self.chunks[0]
+            data = chunk[:max_bytes]
+            if len(data) == len(chunk):
+                self.chunks.popleft()
+            else:
+                self.chunks[0] = chunk[len(data):]
+        offset = self.offset
+        self.offset += len(data)
+        self.buffered_bytes -= len(data)
+        if self.buffered_bytes < STREAM_SEND_BUFFER_SIZE:
+            self.space_available.set()
+        is_last_frame = self.finished and self.buffered_bytes == 0
+        if is_last_frame:
+            self.fin_sent = True
+            self.fin_packed.set()
+        return offset, data, is_last_frame
+
+
+class STREAM_SCHEDULER:
+    """
+    Decides which stream the next frame of a packet comes from.
+
+    Streams are served by strict priority: a level is only served when no more urgent level has data ready.
+    Inside a level, streams share the bandwidth by deficit round robin: each round a stream may send
+    `quantum * weight` bytes before the next stream gets its turn. A stream that has no data ready
+    (its producer is waiting, or it ran out of flow control credit) loses its turn and its deficit,
+    so it cannot burst later.
+    """
+
+    def __init__(self, quantum: int = SCHEDULER_QUANTUM):
+        self.levels: Dict[int, Deque[SEND_STREAM]] = {}
+        self.quantum = quantum
+
+    def add(self, stream: SEND_STREAM) -> None:
+        self.levels.setdefault(stream.priority, deque()).append(stream)
+
+    def is_empty(self) -> bool:
+        return not self.levels
+
+    def next_frame(self, space: int, max_bytes: int,
+                   frame_header_size: Optional[Callable[[int, int], int]] = None
+                   ) -> Optional[Tuple[SEND_STREAM, int, memoryview, bool]]:
+        """
+        Returns (stream, offset, data, is_last_frame) for the next frame, or None if no stream has data ready.
+        The frame takes at most `space` bytes of the packet with its header, whose size `frame_header_size` gives
+        from the stream ID and offset (nothing without it), and carries at most `max_bytes` of data.
+        """
+        for priority in sorted(self.levels):
+            queue = self.levels[priority]
+            for _ in range(len(queue)):
+                stream = queue[0]
+                room = space
+                if frame_header_size is not None:
+                    room -= frame_header_size(stream.stream_id, stream.offset)
+                stream_max_bytes = min(room, max_bytes)
+                if room < 0 or not stream.has_data(stream_max_bytes):
+                    stream.deficit = 0
+                    queue.rotate(-1)
+                    continue
+                if stream.deficit <= 0:
+                    stream.deficit += self.quantum * stream.weight
+                offset, data, is_last_frame = stream.read(min(stream_max_bytes, stream.deficit))
+                # an empty FIN frame still uses a turn
+                stream.deficit -= max(len(data), 1)
+                if stream.is_done():
+                    queue.popleft()
+                elif stream.deficit <= 0:
+                    queue.rotate(-1)
+                if not queue:
+                    del self.levels[priority]
+                return stream, offset, data, is_last_frame
+        return None
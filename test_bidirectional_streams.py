@@ -0,0 +1,132 @@
+"""Unit tests of the bidirectional streams: STREAM_READER on frames in any order, and STREAM_WRITER end to end."""
+import asyncio
+import random
+import unittest
+
+from QUIC import (BIDIRECTIONAL_STREAM_ID_BASE, FRAME_FLAGS, IN_ORDER_STREAM, QUIC_CONNECTION, QUIC_FRAME, QUIC_SERVER,
+                  STREAM_READER)
+
+STREAM_ID = BIDIRECTIONAL_STREAM_ID_BASE
+
+
+def frames(data: bytes, frame_size: int = 100):
+    return [QUIC_FRAME(STREAM_ID, offset, data[offset:offset + frame_size],
+                       FRAME_FLAGS.FIN if offset + frame_size >= len(data) else FRAME_FLAGS.NONE)
+            for offset in range(0, len(data), frame_size)]
+
+
+class StreamReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.reads = []
+
+    def reader(self) -> STREAM_READER:
+        return STREAM_READER(STREAM_ID, lambda reader: self.reads.append(reader.contiguous_size()))
+
+    def test_in_order_stream_is_abstract(self):
+        with self.assertRaises(TypeError):
+            IN_ORDER_STREAM()
+
+    def test_data_is_readable_as_soon_as_it_arrives_in_order(self):
+        async def main():
+            reader = self.reader()
+            data_frames = frames(bytes(range(250)))
+            reader.add_frame(data_frames[1])
+            # the first frame is missing, the second one waits behind the gap
+            self.assertEqual(reader.data(), b'')
+            reader.add_frame(data_frames[0])
+            self.assertEqual(await reader.read(150), bytes(range(150)))
+            self.assertEqual(self.reads, [150])
+            self.assertEqual(reader.contiguous_size(), 150)
+            # a retransmission of what was read is not returned again
+            reader.add_frame(data_frames[1])
+            self.assertEqual(reader.data(), bytes(range(150, 200)))
+            reader.add_frame(data_frames[2])
+            self.assertEqual(await reader.read(), bytes(range(150, 250)))
+            self.assertTrue(reader.at_eof())
+            self.assertEqual(await reader.read(10), b'')
+
+        asyncio.run(main())
+
+    def test_read_waits_for_the_next_data(self):
+        async def main():
+            reader = self.reader()
+            data = random.Random(1).randbytes(1000)
+            data_frames = frames(data)
+            random.Random(2).shuffle(data_frames)
+
+            async def receive_frames():
+                for frame in data_frames:
+                    await asyncio.sleep(0)
+                    reader.add_frame(frame)
+
+            received, _ = await asyncio.gather(reader.readexactly(1000), receive_frames())
+            self.assertEqual(received, data)
+            self.assertEqual(reader.pending, [])
+
+        asyncio.run(main())
+
+    def test_the_end_of_a_stream_that_was_read(self):
+        async def main():
+            reader = self.reader()
+            reader.add_frame(QUIC_FRAME(STREAM_ID, 0, b'abc'))
+            self.assertEqual(await reader.read(3), b'abc')
+            self.assertFalse(reader.at_eof())
+            # an empty frame with the FIN ends the stream, the connection learns it was read to the end
+            reader.add_frame(QUIC_FRAME(STREAM_ID, 3, b'', FRAME_FLAGS.FIN))
+            self.assertTrue(reader.at_eof())
+            self.assertEqual(self.reads, [3, 3])
+            with self.assertRaises(asyncio.IncompleteReadError):
+                await reader.readexactly(1)
+
+        asyncio.run(main())
+
+    def test_a_closed_connection_wakes_the_reader(self):
+        async def main():
+            reader = self.reader()
+            read = asyncio.create_task(reader.read(10))
+            await asyncio.sleep(0)
+            reader.on_connection_closed()
+            with self.assertRaises(ConnectionResetError):
+                await read
+
+        asyncio.run(main())
+
+
+class BidirectionalStreamTest(unittest.TestCase):
+    def test_request_and_response(self):
+        requests = [b'request %d ' % index * 1000 for index in range(3)]
+
+        async def main():
+            server = QUIC_SERVER()
+            await server.listen_to('127.0.0.1', 0)
+            client = QUIC_CONNECTION()
+            await client.connect(*server.sock.getsockname())
+            session = await server.accept()
+
+            async def serve():
+                for _ in requests:
+                    reader, writer = await session.accept_stream()
+                    writer.write(b'echo: ' + await reader.read())
+                    await writer.drain()
+                    writer.close()
+
+            async def request(data: bytes) -> bytes:
+                reader, writer = await client.open_stream()
+                writer.write(data)
+                writer.close()
+                self.assertTrue(writer.is_closing())
+                with self.assertRaises(Exception):
+                    writer.write(b'after close')
+                await writer.wait_closed()
+                return await reader.read()
+
+            responses = await asyncio.gather(*(request(data) for data in requests), serve())
+            await client.close()
+            server.close()
+            return responses[:-1]
+
+        self.assertEqual(asyncio.run(main()), [b'echo: ' + data for data in requests])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""Unit tests of the stream compression: picking a codec from a sample, and DECOMPRESSING_STREAM."""
+import asyncio
+import os
+import random
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from QUIC import DECOMPRESSING_STREAM, FRAME_FLAGS, QUIC_FRAME, STREAM_REASSEMBLER
+from compression import (AVAILABLE_CODECS, CODEC, COMPRESSION_SAMPLE_SIZE, DECOMPRESSOR, compression_executor,
+                         create_compressor, select_codec)
+
+SLOW_SEND_RATE = 1_000_000  # bytes per second, compressing text beats sending it as it is
+FAST_SEND_RATE = 1e15
+FRAME_SIZE = 1000
+
+
+def text(size: int, seed: int = 1) -> bytes:
+    """Random words of a small alphabet, which compress well but not trivially."""
+    text_random = random.Random(seed)
+    words = [''.join(text_random.choice('abcdefghij') for _ in range(text_random.randint(2, 8))) for _ in range(500)]
+    data = ' '.join(text_random.choice(words) for _ in range(size // 5 + 1)).encode()
+    return data[:size]
+
+
+def compress(data: bytes, codec: CODEC) -> bytes:
+    compressor = create_compressor(codec)
+    return compressor.compress(data) + compressor.flush()
+
+
+def frames(data: bytes, frame_size: int = FRAME_SIZE):
+    return [QUIC_FRAME(1, offset, data[offset:offset + frame_size],
+                       FRAME_FLAGS.FIN if offset + frame_size >= len(data) else FRAME_FLAGS.NONE)
+            for offset in range(0, len(data), frame_size)]
+
+
+def select_codec_of_text() -> CODEC:
+    """Picks the codec of a text sample on a slow path, in a worker process the way a parallel sender does."""
+    return asyncio.run(asyncio.wait_for(select_codec(text(COMPRESSION_SAMPLE_SIZE), AVAILABLE_CODECS, SLOW_SEND_RATE),
+                                        5))
+
+
+class STORING_SINK(STREAM_REASSEMBLER):
+    """A sink in memory whose data counts as stored only up to `stored`, like a file sink waiting for the disk."""
+
+    def __init__(self):
+        super().__init__()
+        self.stored = 0
+
+    def contiguous_size(self) -> int:
+        return min(self.stored, super().contiguous_size())
+
+
+class SelectCodecTest(unittest.TestCase):
+    def select(self, sample: bytes, codecs: CODEC, send_rate: float) -> CODEC:
+        return asyncio.run(select_codec(sample, codecs, send_rate))
+
+    def test_compressible_data_on_a_slow_path(self):
+        codec = self.select(text(COMPRESSION_SAMPLE_SIZE), AVAILABLE_CODECS, SLOW_SEND_RATE)
+        self.assertNotEqual(codec, CODEC.NONE)
+        self.assertTrue(codec & AVAILABLE_CODECS)
+        # only a codec the other side supports is picked
+        self.assertEqual(self.select(text(COMPRESSION_SAMPLE_SIZE), CODEC.ZLIB, SLOW_SEND_RATE), CODEC.ZLIB)
+
+    def test_data_is_sent_as_it_is(self):
+        sample = text(COMPRESSION_SAMPLE_SIZE)
+        # random bytes do not compress, a fast path is faster than any codec
+        self.assertEqual(self.select(random.Random(2).randbytes(COMPRESSION_SAMPLE_SIZE), AVAILABLE_CODECS,
+                                     SLOW_SEND_RATE), CODEC.NONE)
+        self.assertEqual(self.select(sample, AVAILABLE_CODECS, FAST_SEND_RATE), CODEC.NONE)
+        self.assertEqual(self.select(sample, CODEC.NONE, SLOW_SEND_RATE), CODEC.NONE)
+        self.assertEqual(self.select(b'', AVAILABLE_CODECS, SLOW_SEND_RATE), CODEC.NONE)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+    def test_a_forked_process_gets_its_own_pool(self):
+        # the threads of the parent's pool do not exist in the child, the codecs would never be measured
+        compression_executor().submit(sum, [1, 2]).result()
+        with ProcessPoolExecutor(1, mp_context=get_context('fork')) as pool:
+            self.assertNotEqual(pool.submit(select_codec_of_text).result(timeout=30), CODEC.NONE)
+
+    def test_unsupported_codec(self):
+        with self.assertRaises(Exception):
+            DECOMPRESSOR(CODEC.NONE)
+        with self.assertRaises(Exception):
+            create_compressor(CODEC.NONE)
+
+
+class DecompressingStreamTest(unittest.TestCase):
+    def test_frames_in_any_order(self):
+        data = text(200_000)
+        for codec in (CODEC.ZLIB, CODEC.LZMA):
+            if not codec & AVAILABLE_CODECS:
+                continue
+            compressed_frames = frames(compress(data, codec))
+            # reordered, with some frames received twice
+            received_frames = compressed_frames + random.Random(3).sample(compressed_frames, 10)
+            random.Random(4).shuffle(received_frames)
+            stream = DECOMPRESSING_STREAM(STREAM_REASSEMBLER(), codec)
+            for frame in received_frames:
+                self.assertFalse(stream.is_complete())
+                stream.add_frame(frame)
+                if stream.is_complete():
+                    break
+            self.assertTrue(stream.is_complete(), codec)
+            self.assertEqual(bytes(stream.data()), data)
+            # only the frames after a gap were ever kept
+            self.assertEqual(stream.pending, [])
+
+    def test_consumed_once_the_sink_stored_the_output(self):
+        compressed_frames = frames(compress(text(100_000), CODEC.ZLIB))
+        sink = STORING_SINK()
+        stream = DECOMPRESSING_STREAM(sink, CODEC.ZLIB)
+        stream.add_frame(compressed_frames[0])
+        stream.add_frame(compressed_frames[1])
+        self.assertGreater(stream.output_offset, 0)
+        # nothing of the output is stored yet, so none of the compressed bytes are consumed
+        self.assertEqual(stream.contiguous_size(), 0)
+        first_output = stream.checkpoints[0][1]
+        sink.stored = first_output
+        self.assertEqual(stream.contiguous_size(), FRAME_SIZE)
+        sink.stored = stream.output_offset
+        self.assertEqual(stream.contiguous_size(), 2 * FRAME_SIZE)
+        # a frame after a gap is not consumed until the gap is filled
+        stream.add_frame(compressed_frames[3])
+        sink.stored = stream.output_offset
+        self.assertEqual(stream.contiguous_size(), 2 * FRAME_SIZE)
+        stream.add_frame(compressed_frames[2])
+        sink.stored = stream.output_offset
+        self.assertEqual(stream.contiguous_size(), 4 * FRAME_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
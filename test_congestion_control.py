@@ -0,0 +1,59 @@
+"""Unit tests of the congestion controllers: the abstract base, slow start and the reduction on a congestion event."""
+import unittest
+from types import SimpleNamespace
+
+from congestion_control import CONGESTION_CONTROLLER, CONGESTION_CONTROLLERS, create_congestion_controller
+
+PACKET_SIZE = 1200
+
+
+def packets(amount: int, time_sent: float = 1.0):
+    return [SimpleNamespace(size=PACKET_SIZE, time_sent=time_sent) for _ in range(amount)]
+
+
+class CongestionControllerTest(unittest.TestCase):
+    def test_a_controller_missing_a_method_fails_when_created(self):
+        class WITHOUT_REDUCTION(CONGESTION_CONTROLLER):
+            def on_packets_acked(self, acked_packets, now, smoothed_rtt):
+                pass
+
+        with self.assertRaises(TypeError):
+            WITHOUT_REDUCTION(PACKET_SIZE)
+        with self.assertRaises(TypeError):
+            CONGESTION_CONTROLLER(PACKET_SIZE)
+
+    def test_unknown_controller(self):
+        with self.assertRaises(Exception):
+            create_congestion_controller('vegas', PACKET_SIZE)
+
+    def test_slow_start_then_one_reduction_per_recovery_period(self):
+        for name in CONGESTION_CONTROLLERS:
+            controller = create_congestion_controller(name, PACKET_SIZE)
+            initial_window = controller.congestion_window
+            controller.on_packets_acked(packets(10), 2.0, 0.05)
+            self.assertEqual(controller.congestion_window, initial_window + 10 * PACKET_SIZE, name)
+
+            window = controller.congestion_window
+            controller.on_packets_lost(packets(1, time_sent=2.0), 3.0)
+            reduced_window = controller.congestion_window
+            self.assertLess(reduced_window, window, name)
+            self.assertFalse(controller.in_slow_start(), name)
+            # packets sent before the recovery period started do not reduce the window again, nor grow it
+            controller.on_packets_lost(packets(3, time_sent=2.5), 3.5)
+            controller.on_packets_acked(packets(3, time_sent=2.5), 3.5, 0.05)
+            self.assertEqual(controller.congestion_window, reduced_window, name)
+            # packets sent after it grow the window slower than slow start did
+            controller.on_packets_acked(packets(10, time_sent=4.0), 4.1, 0.05)
+            self.assertGreater(controller.congestion_window, reduced_window, name)
+            self.assertLess(controller.congestion_window, reduced_window + 10 * PACKET_SIZE, name)
+
+    def test_window_never_below_the_minimum(self):
+        for name in CONGESTION_CONTROLLERS:
+            controller = create_congestion_controller(name, PACKET_SIZE)
+            for loss in range(20):
+                controller.on_packets_lost(packets(1, time_sent=loss + 0.5), loss + 1.0)
+            self.assertEqual(controller.congestion_window, controller.minimum_window(), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
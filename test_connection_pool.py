@@ -0,0 +1,86 @@
+"""Unit tests of CONNECTION_POOL: reusing idle connections, expiring them, and resuming new ones with a ticket."""
+import asyncio
+import unittest
+
+from QUIC import QUIC_SERVER
+from connection_pool import CONNECTION_POOL
+from resumption import TICKET_STORE
+
+LOCAL_HOST = '127.0.0.1'
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def run_with_server(self, test, **pool_options) -> None:
+        """Runs `test(pool, server, address)` with a pool that keeps its own tickets, and closes both."""
+        async def main():
+            server = QUIC_SERVER()
+            await server.listen_to(LOCAL_HOST, 0)
+            pool = CONNECTION_POOL(ticket_store=TICKET_STORE(), **pool_options)
+            try:
+                await test(pool, server, server.sock.getsockname())
+            finally:
+                pool.close()
+                server.close()
+
+        asyncio.run(main())
+
+    def test_a_released_connection_is_reused(self):
+        async def test(pool, server, address):
+            connection = await pool.acquire(*address)
+            session = await server.accept()
+            pool.release(connection)
+            for payload in (b'first request', b'second request'):
+                received, _ = await asyncio.gather(session.receive_data(), pool.send_data(*address, [payload]))
+                self.assertEqual(bytes(received[0]), payload)
+            self.assertIs(await pool.acquire(*address), connection)
+            # both requests went on the first connection without a handshake, the server saw a single session
+            self.assertEqual(len(server.sessions), 1)
+            pool.release(connection)
+
+        self.run_with_server(test)
+
+    def test_idle_connections_expire(self):
+        async def test(pool, server, address):
+            connection = await pool.acquire(*address)
+            pool.release(connection)
+            self.assertFalse(connection.is_closed)
+            await asyncio.sleep(0.2)
+            self.assertTrue(connection.is_closed)
+            self.assertEqual(pool.idle, {})
+
+        self.run_with_server(test, idle_timeout=0.05)
+
+    def test_only_max_idle_connections_are_kept(self):
+        async def test(pool, server, address):
+            first, second = await pool.acquire(*address), await pool.acquire(*address)
+            self.assertIsNot(first, second)
+            pool.release(first)
+            pool.release(second)
+            self.assertTrue(first.is_closed)
+            self.assertIs(await pool.acquire(*address), second)
+            pool.release(second)
+
+        self.run_with_server(test, max_idle_connections=1)
+
+    def test_a_new_connection_resumes_with_the_ticket(self):
+        async def test(pool, server, address):
+            first = await pool.acquire(*address)
+            self.assertFalse(first.resumed)
+            first.end_communication()
+            # a closed connection is not handed out again, the next one is resumed with the server's ticket
+            pool.release(first)
+            second = await pool.acquire(*address)
+            self.assertIsNot(second, first)
+            self.assertTrue(second.resumed)
+            await server.accept()
+            session = await server.accept()
+            received, _ = await asyncio.gather(session.receive_data(), second.send_data([b'0-RTT data']))
+            self.assertTrue(session.resumed)
+            self.assertEqual(bytes(received[0]), b'0-RTT data')
+            pool.release(second)
+
+        self.run_with_server(test)
+
+
+if __name__ == '__main__':
+    unittest.main()
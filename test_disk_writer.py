@@ -0,0 +1,131 @@
+"""Unit tests of the disk writes: write_at and preallocate out of order, the pool after a fork, FILE_STREAM_WRITER."""
+import asyncio
+import errno
+import os
+import random
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from unittest import mock
+
+import disk_writer
+from QUIC import FILE_STREAM_WRITER, FRAME_FLAGS, QUIC_FRAME
+from disk_writer import disk_write_executor, preallocate, write_at
+
+FRAME_SIZE = 1000
+
+
+def read_file(file_path: str) -> bytes:
+    with open(file_path, 'rb') as file:
+        return file.read()
+
+
+def write_in_pool() -> int:
+    """Runs in a forked process: a write through the pool, as a receiver worker of parallel_transfer makes."""
+    return disk_write_executor().submit(sum, [1, 2]).result(timeout=5)
+
+
+class DiskWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'stream.bin')
+        self.fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT)
+
+    def tearDown(self):
+        os.close(self.fd)
+        self.directory.cleanup()
+
+    def test_writes_at_any_offset_of_a_preallocated_file(self):
+        data = random.Random(1).randbytes(10 * FRAME_SIZE)
+        preallocate(self.fd, len(data))
+        self.assertEqual(os.fstat(self.fd).st_size, len(data))
+        offsets = list(range(0, len(data), 2 * FRAME_SIZE))
+        random.Random(2).shuffle(offsets)
+        for offset in offsets:
+            # every write gathers two frames
+            write_at(self.fd, [memoryview(data)[offset:offset + FRAME_SIZE],
+                               memoryview(data)[offset + FRAME_SIZE:offset + 2 * FRAME_SIZE]], offset)
+        self.assertEqual(read_file(self.file_path), data)
+
+    def test_short_writes_are_continued(self):
+        def short_pwritev(fd, buffers, offset):
+            # the kernel may write less than asked, here at most 7 bytes at a time
+            return os.pwrite(fd, b''.join(buffers)[:7], offset)
+
+        data = bytes(range(100))
+        with mock.patch.object(disk_writer.os, 'pwritev', short_pwritev):
+            write_at(self.fd, [memoryview(data[:30]), memoryview(data[30:31]), memoryview(data[31:])], 5)
+        self.assertEqual(read_file(self.file_path), bytes(5) + data)
+
+    def test_preallocate_falls_back_to_the_size(self):
+        unsupported = OSError(errno.EOPNOTSUPP, "Operation not supported")
+        with mock.patch.object(disk_writer.os, 'posix_fallocate', side_effect=unsupported, create=True):
+            preallocate(self.fd, 5000)
+        self.assertEqual(os.fstat(self.fd).st_size, 5000)
+        # other errors, like a full disk, are raised
+        no_space = OSError(errno.ENOSPC, "No space left on device")
+        with mock.patch.object(disk_writer.os, 'posix_fallocate', side_effect=no_space, create=True):
+            with self.assertRaises(OSError):
+                preallocate(self.fd, 10_000)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+    def test_a_forked_process_gets_its_own_pool(self):
+        # the threads of the parent's pool do not exist in the child, its writes would never run
+        self.assertEqual(disk_write_executor().submit(sum, [1, 2]).result(), 3)
+        with ProcessPoolExecutor(1, mp_context=get_context('fork')) as pool:
+            self.assertEqual(pool.submit(write_in_pool).result(timeout=30), 3)
+
+
+class FileStreamWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'stream.bin')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def receive(self, frames) -> FILE_STREAM_WRITER:
+        """Receives the frames into a file one per loop iteration, like batches of datagrams, and closes it."""
+        async def main():
+            writer = FILE_STREAM_WRITER(self.file_path, lambda: self.written.append(writer.contiguous_size()))
+            try:
+                for frame in frames:
+                    writer.add_frame(frame)
+                    await asyncio.sleep(0)
+            finally:
+                writer.close()
+            await writer.wait_closed()
+            return writer
+
+        self.written = []
+        return asyncio.run(main())
+
+    def test_frames_in_any_order(self):
+        data = random.Random(3).randbytes(50 * FRAME_SIZE + 10)
+        frames = [QUIC_FRAME(1, offset, data[offset:offset + FRAME_SIZE],
+                             FRAME_FLAGS.FIN if offset + FRAME_SIZE >= len(data) else FRAME_FLAGS.NONE)
+                  for offset in range(0, len(data), FRAME_SIZE)]
+        random.Random(4).shuffle(frames)
+        writer = self.receive(frames + frames[:5])
+        self.assertTrue(writer.is_complete())
+        self.assertEqual(writer.data(), self.file_path)
+        self.assertEqual(read_file(self.file_path), data)
+        # the data counts as consumed once it is on disk, and the file was closed
+        self.assertEqual(writer.contiguous_size(), len(data))
+        self.assertEqual(self.written[-1], len(data))
+        self.assertIsNone(writer.fd)
+
+    def test_empty_stream(self):
+        writer = self.receive([QUIC_FRAME(1, 0, b'', FRAME_FLAGS.FIN)])
+        self.assertTrue(writer.is_complete())
+        self.assertEqual(read_file(self.file_path), b'')
+
+    def test_a_failed_write_is_raised(self):
+        with mock.patch('QUIC.write_at', side_effect=OSError(errno.EIO, "Input/output error")):
+            with self.assertRaises(OSError):
+                self.receive([QUIC_FRAME(1, 0, b'data', FRAME_FLAGS.FIN)])
+
+
+if __name__ == '__main__':
+    unittest.main()
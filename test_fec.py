@@ -0,0 +1,62 @@
+"""Unit tests of the forward error correction encoder and decoder."""
+import random
+import unittest
+
+from QUIC import RANGE_SET
+from fec import FEC_DECODER, FEC_ENCODER
+
+
+class FecTest(unittest.TestCase):
+    GROUP_SIZE = 5
+
+    def send_group(self):
+        """Protects one group of packets of different types and sizes, returns them and the REPAIR payload."""
+        encoder = FEC_ENCODER(max_group_size=self.GROUP_SIZE)
+        generator = random.Random(2)
+        packets = [(10 + index, index % 3, generator.randbytes(100 + 37 * index)) for index in range(self.GROUP_SIZE)]
+        repair_payloads = [encoder.protect(*packet) for packet in packets]
+        self.assertEqual(repair_payloads[:-1], [None] * (self.GROUP_SIZE - 1))
+        self.assertIsNotNone(repair_payloads[-1])
+        return packets, memoryview(repair_payloads[-1])
+
+    def receive(self, packets, lost_positions):
+        decoder = FEC_DECODER()
+        received_packet_numbers = RANGE_SET()
+        for position, (packet_number, packet_type, data) in enumerate(packets):
+            if position not in lost_positions:
+                decoder.on_packet_received(packet_number, packet_type, memoryview(data))
+                received_packet_numbers.add(packet_number, packet_number + 1)
+        return decoder, received_packet_numbers
+
+    def test_rebuilds_every_position(self):
+        packets, repair_payload = self.send_group()
+        for position in range(self.GROUP_SIZE):
+            decoder, received_packet_numbers = self.receive(packets, {position})
+            self.assertEqual(decoder.recover(repair_payload, received_packet_numbers), packets[position], position)
+            self.assertEqual(decoder.recovered_packets, 1)
+
+    def test_nothing_to_rebuild(self):
+        packets, repair_payload = self.send_group()
+        decoder, received_packet_numbers = self.receive(packets, set())
+        self.assertIsNone(decoder.recover(repair_payload, received_packet_numbers))
+
+    def test_two_losses_are_left_to_retransmissions(self):
+        packets, repair_payload = self.send_group()
+        decoder, received_packet_numbers = self.receive(packets, {1, 3})
+        self.assertIsNone(decoder.recover(repair_payload, received_packet_numbers))
+        self.assertEqual(decoder.recovered_packets, 0)
+
+    def test_flush_closes_a_partial_group(self):
+        encoder = FEC_ENCODER(max_group_size=self.GROUP_SIZE)
+        packets = [(1, 0, b'first'), (3, 1, b'the third packet')]
+        for packet in packets:
+            self.assertIsNone(encoder.protect(*packet))
+        repair_payload = memoryview(encoder.flush())
+        self.assertIsNone(encoder.flush())
+        decoder, received_packet_numbers = self.receive(packets, {1})
+        # packet number 2 is not part of the group (a control packet), only packet 3 is missing
+        self.assertEqual(decoder.recover(repair_payload, received_packet_numbers), packets[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
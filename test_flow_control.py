@@ -0,0 +1,110 @@
+"""Unit tests of the flow control credit: RECEIVE_WINDOW updates and auto-tuning, SEND_CREDIT, small windows."""
+import asyncio
+import unittest
+
+from QUIC import QUIC_CONNECTION, QUIC_SERVER
+from flow_control import AUTOTUNE_RTTS, RECEIVE_WINDOW, SEND_CREDIT, WINDOW_UPDATE_THRESHOLD
+
+WINDOW = 1000
+MAX_WINDOW = 8000
+RTT = 0.1
+
+
+class ReceiveWindowTest(unittest.TestCase):
+    def test_data_beyond_the_limit_breaks_the_protocol(self):
+        window = RECEIVE_WINDOW(WINDOW, MAX_WINDOW)
+        window.on_data_received(WINDOW)
+        self.assertEqual(window.highest_received, WINDOW)
+        with self.assertRaises(Exception):
+            window.on_data_received(WINDOW + 1)
+
+    def test_update_once_the_threshold_is_consumed(self):
+        window = RECEIVE_WINDOW(WINDOW, MAX_WINDOW, autotune=False)
+        window.on_data_consumed(int(WINDOW * WINDOW_UPDATE_THRESHOLD))
+        self.assertFalse(window.update_needed())
+        window.on_data_consumed(int(WINDOW * WINDOW_UPDATE_THRESHOLD) + 1)
+        self.assertTrue(window.update_needed())
+        self.assertEqual(window.update(1.0, RTT), window.consumed + WINDOW)
+        self.assertFalse(window.update_needed())
+        # consumption never goes back, and the limit never shrinks
+        window.on_data_consumed(10)
+        self.assertEqual(window.consumed, int(WINDOW * WINDOW_UPDATE_THRESHOLD) + 1)
+        self.assertEqual(window.update(2.0, RTT), window.consumed + WINDOW)
+
+    def test_autotuning_doubles_a_window_used_up_within_a_few_rtts(self):
+        window = RECEIVE_WINDOW(WINDOW, MAX_WINDOW)
+        window.update(1.0, RTT)
+        self.assertEqual(window.window, WINDOW)
+        now = 1.0
+        for expected_window in (2 * WINDOW, 4 * WINDOW, MAX_WINDOW, MAX_WINDOW):
+            now += AUTOTUNE_RTTS * RTT / 2
+            window.update(now, RTT)
+            self.assertEqual(window.window, expected_window)
+        # updates further apart than AUTOTUNE_RTTS round trips keep the window
+        window = RECEIVE_WINDOW(WINDOW, MAX_WINDOW)
+        window.update(1.0, RTT)
+        window.update(1.0 + AUTOTUNE_RTTS * RTT * 2, RTT)
+        self.assertEqual(window.window, WINDOW)
+        # without auto-tuning or an RTT sample, the window stays too
+        for autotune, smoothed_rtt in ((False, RTT), (True, None)):
+            window = RECEIVE_WINDOW(WINDOW, MAX_WINDOW, autotune)
+            window.update(1.0, smoothed_rtt)
+            window.update(1.001, smoothed_rtt)
+            self.assertEqual(window.window, WINDOW)
+
+    def test_raise_and_ensure_window(self):
+        window = RECEIVE_WINDOW(WINDOW, MAX_WINDOW)
+        window.raise_initial_window(WINDOW // 2)
+        self.assertEqual((window.window, window.max_offset), (WINDOW, WINDOW))
+        window.raise_initial_window(2 * MAX_WINDOW)
+        self.assertEqual((window.window, window.max_window, window.max_offset), (2 * MAX_WINDOW,) * 3)
+        window = RECEIVE_WINDOW(WINDOW, MAX_WINDOW)
+        window.ensure_window(3 * WINDOW)
+        self.assertEqual(window.window, 3 * WINDOW)
+        window.ensure_window(2 * MAX_WINDOW)
+        self.assertEqual(window.window, MAX_WINDOW)
+        # only the next update advertises the larger window
+        self.assertEqual(window.max_offset, WINDOW)
+
+
+class SendCreditTest(unittest.TestCase):
+    def test_limits_only_grow(self):
+        credit = SEND_CREDIT(WINDOW)
+        credit.used = WINDOW - 100
+        self.assertEqual(credit.available(), 100)
+        self.assertFalse(credit.on_max_data(WINDOW))
+        self.assertFalse(credit.on_max_data(WINDOW // 2))
+        self.assertEqual(credit.max_data, WINDOW)
+        self.assertTrue(credit.on_max_data(2 * WINDOW))
+        self.assertEqual(credit.available(), WINDOW + 100)
+        credit.used = 3 * WINDOW
+        self.assertEqual(credit.available(), 0)
+
+
+class SmallWindowsTest(unittest.TestCase):
+    def test_a_transfer_larger_than_the_windows_completes(self):
+        payloads = [bytes(range(256)) * 800, b'z' * 150_000]
+
+        async def main():
+            server = QUIC_SERVER(stream_receive_window=16 * 1024, connection_receive_window=32 * 1024,
+                                 autotune_windows=False)
+            await server.listen_to('127.0.0.1', 0)
+            client = QUIC_CONNECTION()
+            await client.connect(*server.sock.getsockname())
+            self.assertEqual(client.send_credit.max_data, 32 * 1024)
+            self.assertEqual(client.peer_initial_max_stream_data, 16 * 1024)
+            session = await server.accept()
+            received, _ = await asyncio.gather(session.receive_data(), client.send_data(payloads))
+            credit = client.send_credit.max_data
+            await client.close()
+            server.close()
+            return received, credit
+
+        received, credit = asyncio.run(main())
+        self.assertEqual([bytes(data) for data in received], payloads)
+        # the sender only got past the first window with the MAX_DATA updates of the receiver
+        self.assertGreaterEqual(credit, sum(map(len, payloads)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Unit tests of the ACK ranges and of LOSS_RECOVERY: RTT samples, packet and time threshold losses, probe timeouts."""
+import asyncio
+import time
+import unittest
+
+from QUIC import FLAGS, LOSS_RECOVERY, QUIC_PACKET, SENT_PACKET
+from congestion_control import NEW_RENO
+
+PACKET_SIZE = 1200
+
+
+class AckRangesTest(unittest.TestCase):
+    def test_round_trip(self):
+        ack_ranges = [(40, 45), (10, 20), (0, 1)]
+        packet = QUIC_PACKET(FLAGS.ACK, 1)
+        packet.link_ack_ranges(ack_ranges, 0.0125, 3)
+        self.assertEqual(packet.read_ack_ranges(), (0.0125, ack_ranges, 3))
+
+    def test_ranges_that_do_not_fit_are_left_out(self):
+        ack_ranges = [(start, start + 1) for start in range(1000, 0, -2)]
+        packet = QUIC_PACKET(FLAGS.ACK, 1, max_size=200)
+        packet.link_ack_ranges(ack_ranges, 0)
+        ack_delay, read_ranges, _ = packet.read_ack_ranges()
+        # the newest ranges come first, so the ones that are left out are the oldest
+        self.assertTrue(0 < len(read_ranges) < len(ack_ranges))
+        self.assertEqual(read_ranges, ack_ranges[:len(read_ranges)])
+        self.assertLessEqual(packet.header_length + packet.data_length, 200)
+
+
+class LossRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.lost = []
+        self.probes = []
+
+    def on_packets_lost(self, lost_packets, is_probe: bool = False) -> None:
+        (self.probes if is_probe else self.lost).extend(lost_packet.packet_number for lost_packet in lost_packets)
+
+    def run_recovery(self, test) -> None:
+        """Runs `test(recovery, send)` on an event loop, the loss timer needs one."""
+        async def main():
+            recovery = LOSS_RECOVERY(self.on_packets_lost, NEW_RENO(PACKET_SIZE))
+
+            def send(packet_number: int, age: float = 0.0) -> None:
+                packet = QUIC_PACKET(FLAGS.DATA_PACKET, packet_number)
+                recovery.on_packet_sent(SENT_PACKET(packet, PACKET_SIZE, time.monotonic() - age))
+
+            try:
+                test(recovery, send)
+            finally:
+                recovery.stop()
+
+        asyncio.run(main())
+
+    def test_ack_removes_the_covered_packets(self):
+        def test(recovery, send):
+            for packet_number in range(6):
+                send(packet_number, age=0.1)
+            self.assertEqual(recovery.bytes_in_flight, 6 * PACKET_SIZE)
+            acked = recovery.on_ack_received([(3, 4), (0, 2)], 0)
+            self.assertEqual([packet.packet_number for packet in acked], [0, 1, 3])
+            self.assertEqual(list(recovery.sent_packets), [2, 4, 5])
+            self.assertEqual(recovery.bytes_in_flight, 3 * PACKET_SIZE)
+            self.assertEqual(self.lost, [])
+            # the RTT sample comes from the largest acknowledged packet
+            self.assertTrue(recovery.has_rtt_sample)
+            self.assertAlmostEqual(recovery.latest_rtt, 0.1, delta=0.05)
+            # acknowledging them again changes nothing
+            self.assertEqual(recovery.on_ack_received([(0, 2)], 0), [])
+
+        self.run_recovery(test)
+
+    def test_packet_threshold_loss(self):
+        def test(recovery, send):
+            for packet_number in range(8):
+                send(packet_number)
+            recovery.on_ack_received([(5, 6)], 0)
+            # packets PACKET_THRESHOLD or more below the largest acknowledged one are lost
+            self.assertEqual(self.lost, [0, 1, 2])
+            self.assertEqual(list(recovery.sent_packets), [3, 4, 6, 7])
+            self.assertEqual(recovery.lost_packets_amount, 3)
+
+        self.run_recovery(test)
+
+    def test_time_threshold_loss(self):
+        def test(recovery, send):
+            send(0, age=1.0)
+            send(1, age=0.1)
+            send(2, age=0.1)
+            recovery.on_ack_received([(2, 3)], 0)
+            # packet 0 was sent long enough before the acknowledged one, packet 1 only waits for its loss timer
+            self.assertEqual(self.lost, [0])
+            self.assertEqual(list(recovery.sent_packets), [1])
+            recovery.sent_packets[1].time_sent -= recovery.loss_delay()
+            recovery.on_loss_timeout()
+            self.assertEqual(self.lost, [0, 1])
+            self.assertFalse(recovery.has_packets_in_flight())
+
+        self.run_recovery(test)
+
+    def test_probe_timeout(self):
+        def test(recovery, send):
+            for packet_number in range(4):
+                send(packet_number)
+            first_pto = recovery.probe_timeout()
+            recovery.on_loss_timeout()
+            # the oldest packets are sent again as probes, and stay in flight until acknowledged or lost
+            self.assertEqual(self.probes, [0, 1])
+            self.assertEqual(self.lost, [])
+            self.assertEqual(len(recovery.sent_packets), 4)
+            self.assertEqual(recovery.pto_count, 1)
+            self.assertEqual(recovery.probe_timeout(), 2 * first_pto)
+            recovery.on_loss_timeout()
+            self.assertEqual(self.probes, [0, 1, 2, 3])
+            # an ACK resets the backoff
+            recovery.on_ack_received([(0, 4)], 0)
+            self.assertEqual(recovery.pto_count, 0)
+            self.assertIsNone(recovery.loss_timer)
+
+        self.run_recovery(test)
+
+
+if __name__ == '__main__':
+    unittest.main()
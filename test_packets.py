@@ -0,0 +1,93 @@
+"""Unit tests of the packet codec: serializing and parsing packets in both wire formats."""
+import unittest
+
+from QUIC import FLAGS, FRAME_FLAGS, QUIC_PACKET, STREAM_COUNT_FORMAT, VERSION
+
+CONNECTION_ID = 0x0123_4567_89AB_CDEF
+# (stream ID, offset, data, is last frame, flags), the IDs and offsets cover every varint size
+FRAMES = [(1, 0, b'first frame', False, FRAME_FLAGS.NONE),
+          (70, 20_000, b'x' * 300, True, FRAME_FLAGS.ZLIB),
+          (1 << 20, (1 << 40) + 5, b'', False, FRAME_FLAGS.DIGEST),
+          (3, 64, b'the last frame of the packet', True, FRAME_FLAGS.NONE)]
+
+
+def round_trip(packet: QUIC_PACKET):
+    """Serializes the packet and parses a copy of the datagram, as the receiver gets it."""
+    return QUIC_PACKET.deserialize_data(bytes(packet.serialize_data()))
+
+
+class PacketTest(unittest.TestCase):
+    def stream_packet(self, version: int, frames=FRAMES, packet_number: int = 1_000_000) -> QUIC_PACKET:
+        packet = QUIC_PACKET(FLAGS.DATA_PACKET, packet_number, version=version)
+        packet.connection_id = CONNECTION_ID
+        for stream_id, offset, data, is_last_frame, frame_flags in frames:
+            packet.link_frame(stream_id, offset, data, is_last_frame, frame_flags)
+        return packet
+
+    def check_frames(self, received_frames, frames=FRAMES):
+        self.assertEqual([(frame.stream_id, frame.offset, bytes(frame.frame_data), frame.frame_flags)
+                          for frame in received_frames],
+                         [(stream_id, offset, data, frame_flags | (FRAME_FLAGS.FIN if is_last_frame else 0))
+                          for stream_id, offset, data, is_last_frame, frame_flags in frames])
+
+    def test_stream_packet_round_trip_in_every_version(self):
+        for version in VERSION:
+            packet = self.stream_packet(version)
+            received_packet, received_frames = round_trip(packet)
+            self.assertEqual(received_packet.version, version)
+            self.assertEqual(received_packet.packet_flag, FLAGS.DATA_PACKET)
+            self.assertEqual(received_packet.packet_ID, 1_000_000)
+            self.assertEqual(received_packet.connection_id, CONNECTION_ID)
+            self.check_frames(received_frames)
+
+    def test_compact_last_frame_takes_the_rest_of_the_packet(self):
+        for frames in (FRAMES[:1], FRAMES):
+            fixed = self.stream_packet(VERSION.FIXED_HEADERS, frames)
+            compact = self.stream_packet(VERSION.VARINT_HEADERS, frames)
+            datagram = bytes(compact.serialize_data())
+            self.assertLess(len(datagram), len(fixed.serialize_data()))
+            # the last frame ends the datagram and carries no length on the wire
+            received_packet, received_frames = QUIC_PACKET.deserialize_data(datagram)
+            self.check_frames(received_frames, frames)
+            self.assertFalse(any(frame.frame_flags & FRAME_FLAGS.LENGTH for frame in received_frames))
+            self.assertEqual(bytes(received_frames[-1].frame_data), datagram[len(datagram) - len(frames[-1][2]):])
+
+    def test_full_packet(self):
+        for version in VERSION:
+            packet = QUIC_PACKET(FLAGS.LAST_PACKET, 7, max_size=1200, version=version)
+            data = bytes(range(256)) * 10
+            room = packet.free_space() - packet.frame_header_size(5, 0)
+            packet.link_frame(5, 0, data[:room], True)
+            self.assertEqual(packet.free_space(), 0)
+            with self.assertRaises(Exception):
+                packet.link_frame(5, room, b'x')
+            datagram = bytes(packet.serialize_data())
+            self.assertLessEqual(len(datagram), 1200)
+            self.check_frames(QUIC_PACKET.deserialize_data(datagram)[1], [(5, 0, data[:room], True, 0)])
+
+    def test_control_packet_round_trip(self):
+        for version in VERSION:
+            packet = QUIC_PACKET(FLAGS.END_OF_DATA, 42, version=version)
+            packet.append_data(STREAM_COUNT_FORMAT.pack(11, 3))
+            received_packet, received_frames = round_trip(packet)
+            self.assertEqual(received_packet.packet_flag, FLAGS.END_OF_DATA)
+            self.assertEqual(received_packet.packet_ID, 42)
+            self.assertEqual(STREAM_COUNT_FORMAT.unpack(received_packet.packet_data), (11, 3))
+            self.assertEqual(received_frames, [])
+
+    def test_padded_probe_has_its_size(self):
+        for version in VERSION:
+            packet = QUIC_PACKET(FLAGS.PMTU_PROBE, 3, max_size=1400, version=version)
+            packet.append_padding()
+            datagram = bytes(packet.serialize_data())
+            self.assertEqual(len(datagram), 1400)
+            self.assertEqual(QUIC_PACKET.deserialize_data(datagram)[0].packet_flag, FLAGS.PMTU_PROBE)
+
+    def test_malformed_datagrams_raise(self):
+        for datagram in (b'', b'\x00', b'\xff' * 3):
+            with self.assertRaises(Exception):
+                QUIC_PACKET.deserialize_data(datagram)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Unit tests of the multi-process transfer: sharding the files, and the transfer header that counts the connections."""
+import asyncio
+import filecmp
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from QUIC import QUIC_CONNECTION
+from parallel_transfer import PARALLEL_RECEIVER, send_files_parallel, shard_streams
+
+LOCAL_HOST = '127.0.0.1'
+FILES_AMOUNT = 5
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((LOCAL_HOST, 0))
+        return sock.getsockname()[1]
+
+
+class ShardStreamsTest(unittest.TestCase):
+    def test_contiguous_shards_of_almost_equal_size(self):
+        self.assertEqual(shard_streams(10, 3), [(0, 4), (4, 7), (7, 10)])
+        self.assertEqual(shard_streams(2, 8), [(0, 1), (1, 2)])
+        self.assertEqual(shard_streams(0, 4), [(0, 0)])
+
+
+class ParallelTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_paths = []
+        for index in range(FILES_AMOUNT):
+            file_path = os.path.join(self.directory.name, f'sent_{index}.bin')
+            with open(file_path, 'wb') as file:
+                file.write(os.urandom(100_000 + index * 1000))
+            self.file_paths.append(file_path)
+        self.port = free_port()
+        self.receiver = PARALLEL_RECEIVER(2)
+        self.receiver.listen_to(LOCAL_HOST, self.port, os.path.join(self.directory.name, 'received_{index}.bin'))
+
+    def tearDown(self):
+        self.receiver.close()
+        self.directory.cleanup()
+
+    def send_in_background(self, target, *args) -> threading.Thread:
+        sender = threading.Thread(target=target, args=args)
+        sender.start()
+        return sender
+
+    def test_the_receiver_learns_the_connections_from_the_sender(self):
+        sender = self.send_in_background(send_files_parallel, LOCAL_HOST, self.port, self.file_paths, 3)
+        received = self.receiver.receive_files()
+        sender.join()
+        # every file is named by its index in the whole transfer, whichever connection carried it
+        self.assertEqual(received, [os.path.join(self.directory.name, f'received_{index}.bin')
+                                    for index in range(FILES_AMOUNT)])
+        for sent_path, received_path in zip(self.file_paths, received):
+            self.assertTrue(filecmp.cmp(sent_path, received_path, shallow=False))
+
+    def test_a_mismatching_connection_count_raises(self):
+        sender = self.send_in_background(send_files_parallel, LOCAL_HOST, self.port, self.file_paths, 3)
+        try:
+            with self.assertRaisesRegex(Exception, "opened 3 connections"):
+                self.receiver.receive_files(2)
+        finally:
+            sender.join()
+
+    def test_a_client_without_a_transfer_header_raises(self):
+        async def send():
+            conn = QUIC_CONNECTION()
+            conn.connect_to(LOCAL_HOST, self.port)
+            await conn.send_files(self.file_paths)
+            await conn.close()
+
+        sender = self.send_in_background(asyncio.run, send())
+        try:
+            with self.assertRaisesRegex(Exception, "transfer header"):
+                self.receiver.receive_files()
+        finally:
+            sender.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Unit tests of the path MTU search, driven by the outcomes of its probes."""
+import unittest
+
+from path_mtu import (BASE_DATAGRAM_SIZE, ETHERNET_DATAGRAM_SIZE, MAX_PROBES, SEARCH_GRANULARITY,
+                      PATH_MTU_DISCOVERY)
+
+MAX_SIZE = 9000
+MAX_SEARCH_PROBES = 50  # a binary search between 1200 and 9000 bytes takes far fewer
+
+
+def search(discovery: PATH_MTU_DISCOVERY, path_mtu: int, refused: bool = True):
+    """
+    Runs the search on a path that carries datagrams up to `path_mtu` bytes: larger probes are refused by the kernel
+    with EMSGSIZE (`refused`), or lost. Returns the sizes that were probed.
+    """
+    probed = []
+    while (size := discovery.next_probe_size(0)) is not None:
+        probed.append(size)
+        if len(probed) > MAX_SEARCH_PROBES:
+            raise AssertionError(f"The search does not end: {probed[:20]}...")
+        if size <= path_mtu:
+            discovery.on_probe_acked(size)
+        elif refused:
+            discovery.on_packet_too_big()
+        else:
+            for _ in range(MAX_PROBES):
+                discovery.next_probe_size(0)
+                discovery.on_probe_lost(size)
+    return probed
+
+
+class PathMtuTest(unittest.TestCase):
+    def test_refused_probe_keeps_the_acknowledged_size(self):
+        # an Ethernet path with the Don't Fragment bit: 1472 is acknowledged, the kernel refuses 9000 with EMSGSIZE
+        discovery = PATH_MTU_DISCOVERY(MAX_SIZE)
+        self.assertEqual(discovery.next_probe_size(0), ETHERNET_DATAGRAM_SIZE)
+        discovery.on_probe_acked(ETHERNET_DATAGRAM_SIZE)
+        self.assertEqual(discovery.next_probe_size(0), MAX_SIZE)
+        discovery.on_packet_too_big()
+        self.assertEqual(discovery.max_datagram_size, ETHERNET_DATAGRAM_SIZE)
+        probed = search(discovery, ETHERNET_DATAGRAM_SIZE)
+        # the search only probes between the acknowledged and the refused sizes, and never goes back below
+        self.assertTrue(all(ETHERNET_DATAGRAM_SIZE < size < MAX_SIZE for size in probed), probed)
+        self.assertEqual(discovery.max_datagram_size, ETHERNET_DATAGRAM_SIZE)
+        self.assertIsNotNone(discovery.search_done_time)
+
+    def test_search_converges_on_the_path_mtu(self):
+        for path_mtu in (1250, ETHERNET_DATAGRAM_SIZE, 4000, MAX_SIZE):
+            for refused in (True, False):
+                discovery = PATH_MTU_DISCOVERY(MAX_SIZE)
+                search(discovery, path_mtu, refused)
+                self.assertLessEqual(discovery.max_datagram_size, path_mtu)
+                self.assertGreater(discovery.max_datagram_size, path_mtu - SEARCH_GRANULARITY)
+
+    def test_a_probe_size_fails_after_max_probes_losses(self):
+        discovery = PATH_MTU_DISCOVERY(MAX_SIZE)
+        for _ in range(MAX_PROBES - 1):
+            self.assertEqual(discovery.next_probe_size(0), ETHERNET_DATAGRAM_SIZE)
+            discovery.on_probe_lost(ETHERNET_DATAGRAM_SIZE)
+        self.assertFalse(discovery.high_failed)
+        self.assertEqual(discovery.next_probe_size(0), ETHERNET_DATAGRAM_SIZE)
+        discovery.on_probe_lost(ETHERNET_DATAGRAM_SIZE)
+        self.assertEqual((discovery.search_high, discovery.high_failed), (ETHERNET_DATAGRAM_SIZE, True))
+        self.assertEqual(discovery.max_datagram_size, BASE_DATAGRAM_SIZE)
+
+    def test_packet_too_big_without_a_probe_falls_back(self):
+        # the path got smaller: a packet of the acknowledged size is refused
+        discovery = PATH_MTU_DISCOVERY(MAX_SIZE)
+        search(discovery, ETHERNET_DATAGRAM_SIZE)
+        discovery.on_packet_too_big()
+        self.assertEqual(discovery.max_datagram_size, BASE_DATAGRAM_SIZE)
+        self.assertEqual((discovery.search_high, discovery.high_failed), (ETHERNET_DATAGRAM_SIZE, True))
+        search(discovery, 1400)
+        self.assertGreater(discovery.max_datagram_size, 1400 - SEARCH_GRANULARITY)
+
+    def test_black_hole_probes_the_acknowledged_size_again(self):
+        # probe timeouts may be plain loss, the size that worked is tried again first and restored
+        discovery = PATH_MTU_DISCOVERY(MAX_SIZE)
+        search(discovery, ETHERNET_DATAGRAM_SIZE)
+        discovery.on_black_hole()
+        self.assertEqual(discovery.max_datagram_size, BASE_DATAGRAM_SIZE)
+        self.assertEqual(discovery.next_probe_size(0), ETHERNET_DATAGRAM_SIZE)
+        discovery.on_probe_acked(ETHERNET_DATAGRAM_SIZE)
+        self.assertEqual(discovery.max_datagram_size, ETHERNET_DATAGRAM_SIZE)
+
+    def test_late_loss_of_a_refused_probe_is_ignored(self):
+        discovery = PATH_MTU_DISCOVERY(MAX_SIZE)
+        discovery.on_probe_acked(discovery.next_probe_size(0))
+        refused_size = discovery.next_probe_size(0)
+        discovery.on_packet_too_big()
+        next_size = discovery.next_probe_size(0)
+        # the refused probe is declared lost by loss recovery later, the probe in flight is another one
+        discovery.on_probe_lost(refused_size)
+        self.assertEqual(discovery.probe_size, next_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
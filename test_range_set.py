@@ -0,0 +1,71 @@
+"""Unit tests of RANGE_SET, the received byte ranges and packet numbers."""
+import random
+import unittest
+
+from QUIC import RANGE_SET
+
+
+class RangeSetTest(unittest.TestCase):
+    def test_disjoint_ranges_stay_sorted(self):
+        ranges = RANGE_SET()
+        ranges.add(20, 30)
+        ranges.add(0, 5)
+        ranges.add(10, 15)
+        self.assertEqual(list(ranges), [(0, 5), (10, 15), (20, 30)])
+
+    def test_overlapping_and_adjacent_ranges_merge(self):
+        ranges = RANGE_SET()
+        ranges.add(0, 10)
+        ranges.add(5, 15)
+        self.assertEqual(list(ranges), [(0, 15)])
+        ranges.add(15, 20)
+        self.assertEqual(list(ranges), [(0, 20)])
+        ranges.add(25, 30)
+        ranges.add(24, 25)
+        self.assertEqual(list(ranges), [(0, 20), (24, 30)])
+
+    def test_range_bridging_several_ranges(self):
+        ranges = RANGE_SET()
+        for start in range(0, 50, 10):
+            ranges.add(start, start + 5)
+        ranges.add(3, 42)
+        self.assertEqual(list(ranges), [(0, 45)])
+
+    def test_contained_and_empty_ranges_change_nothing(self):
+        ranges = RANGE_SET()
+        ranges.add(0, 10)
+        ranges.add(2, 8)
+        ranges.add(12, 12)
+        ranges.add(15, 11)
+        self.assertEqual(list(ranges), [(0, 10)])
+
+    def test_covers_contains_and_gaps(self):
+        ranges = RANGE_SET()
+        ranges.add(5, 10)
+        ranges.add(20, 30)
+        self.assertTrue(ranges.covers(5, 10))
+        self.assertTrue(ranges.covers(21, 29))
+        self.assertFalse(ranges.covers(5, 11))
+        self.assertFalse(ranges.covers(0, 6))
+        self.assertIn(5, ranges)
+        self.assertNotIn(10, ranges)
+        self.assertNotIn(4, ranges)
+        self.assertEqual(ranges.gaps(), [(0, 5), (10, 20)])
+        self.assertEqual(ranges.gaps(40), [(0, 5), (10, 20), (30, 40)])
+
+    def test_matches_a_set_of_integers(self):
+        generator = random.Random(1)
+        ranges = RANGE_SET()
+        expected = set()
+        for _ in range(500):
+            start = generator.randrange(1000)
+            end = start + generator.randrange(20)
+            ranges.add(start, end)
+            expected.update(range(start, end))
+        self.assertEqual({value for start, end in ranges for value in range(start, end)}, expected)
+        # the ranges are merged: none of them touches the next one
+        self.assertTrue(all(end < next_start for end, next_start in zip(ranges.ends, ranges.starts[1:])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Unit tests of the resumption tickets: checking and expiring them, and the windows a ticket gives a session."""
+import time
+import unittest
+
+from QUIC import QUIC_CONNECTION, RESUMPTION_STATUS_FORMAT, TRANSPORT_PARAMETERS_FORMAT
+from flow_control import INITIAL_MAX_DATA, INITIAL_MAX_STREAM_DATA
+from resumption import SESSION_TICKET, TICKET_FORMAT, TICKET_ISSUER, TICKET_STORE
+
+HOST = '127.0.0.1'
+MAX_DATA = 10 * INITIAL_MAX_DATA
+MAX_STREAM_DATA = 10 * INITIAL_MAX_STREAM_DATA
+
+
+class TicketIssuerTest(unittest.TestCase):
+    def test_an_issued_ticket_is_valid_for_its_host(self):
+        issuer = TICKET_ISSUER()
+        ticket = issuer.issue(HOST, MAX_DATA, MAX_STREAM_DATA)
+        self.assertEqual(issuer.open(ticket, HOST), (True, (MAX_DATA, MAX_STREAM_DATA)))
+        # another server process accepts it too when it shares the secret
+        self.assertTrue(TICKET_ISSUER(issuer.secret).open(ticket, HOST)[0])
+
+    def test_tickets_that_are_not_valid(self):
+        issuer = TICKET_ISSUER()
+        ticket = issuer.issue(HOST, MAX_DATA, MAX_STREAM_DATA)
+        forged = TICKET_FORMAT.pack(time.time(), 2 * MAX_DATA, MAX_STREAM_DATA) + ticket[TICKET_FORMAT.size:]
+        for other_ticket, host, other_issuer in ((ticket, '10.0.0.1', issuer), (ticket, HOST, TICKET_ISSUER()),
+                                                 (forged, HOST, issuer)):
+            valid, limits = other_issuer.open(other_ticket, host)
+            self.assertFalse(valid)
+            # the limits a ticket claims are returned, but only trusted when it is valid
+            self.assertIsNotNone(limits)
+        self.assertEqual(issuer.open(ticket[:-1], HOST), (False, None))
+
+    def test_a_ticket_expires_after_its_lifetime(self):
+        issuer = TICKET_ISSUER(lifetime=60)
+        body = TICKET_FORMAT.pack(time.time() - 61, MAX_DATA, MAX_STREAM_DATA)
+        self.assertFalse(issuer.open(body + issuer.mac(body, HOST), HOST)[0])
+        body = TICKET_FORMAT.pack(time.time() - 59, MAX_DATA, MAX_STREAM_DATA)
+        self.assertTrue(issuer.open(body + issuer.mac(body, HOST), HOST)[0])
+        # nor is one issued in the future accepted
+        body = TICKET_FORMAT.pack(time.time() + 60, MAX_DATA, MAX_STREAM_DATA)
+        self.assertFalse(issuer.open(body + issuer.mac(body, HOST), HOST)[0])
+
+
+class TicketStoreTest(unittest.TestCase):
+    def test_tickets_are_dropped_after_their_lifetime(self):
+        store = TICKET_STORE(lifetime=60)
+        address = (HOST, 9191)
+        session_ticket = SESSION_TICKET(b'ticket', MAX_DATA, MAX_STREAM_DATA)
+        store.put(address, session_ticket)
+        self.assertIs(store.get(address), session_ticket)
+        session_ticket.received_time -= 61
+        self.assertIsNone(store.get(address))
+        self.assertEqual(store.tickets, {})
+
+
+class AcceptHandshakeTest(unittest.TestCase):
+    def accept(self, ticket: bytes, issuer: TICKET_ISSUER):
+        """Handles a SYN with the ticket on the server side, returns (resumed, receive windows, SYN_ACK payload)."""
+        server_side = QUIC_CONNECTION()
+        try:
+            server_side.peer_address = (HOST, 9191)
+            client_parameters = TRANSPORT_PARAMETERS_FORMAT.pack(INITIAL_MAX_DATA, INITIAL_MAX_STREAM_DATA, 0, 1)
+            response = server_side.accept_handshake(memoryview(client_parameters + ticket), issuer)
+            return (server_side.resumed, (server_side.receive_window.max_offset, server_side.stream_receive_window),
+                    response)
+        finally:
+            server_side.sock.close()
+
+    def test_a_valid_ticket_raises_the_windows(self):
+        issuer = TICKET_ISSUER()
+        resumed, windows, response = self.accept(issuer.issue(HOST, MAX_DATA, MAX_STREAM_DATA), issuer)
+        self.assertTrue(resumed)
+        self.assertEqual(windows, (MAX_DATA, MAX_STREAM_DATA))
+        self.assertTrue(RESUMPTION_STATUS_FORMAT.unpack_from(response, TRANSPORT_PARAMETERS_FORMAT.size)[0])
+
+    def test_a_ticket_that_is_not_valid_keeps_the_configured_windows(self):
+        issuer = TICKET_ISSUER()
+        expired_body = TICKET_FORMAT.pack(time.time() - 2 * issuer.lifetime, MAX_DATA, MAX_STREAM_DATA)
+        for ticket in (TICKET_ISSUER().issue(HOST, MAX_DATA, MAX_STREAM_DATA),
+                       issuer.issue('10.0.0.1', MAX_DATA, MAX_STREAM_DATA),
+                       expired_body + issuer.mac(expired_body, HOST), b'malformed'):
+            resumed, windows, response = self.accept(ticket, issuer)
+            self.assertFalse(resumed)
+            self.assertEqual(windows, (INITIAL_MAX_DATA, INITIAL_MAX_STREAM_DATA))
+            # the SYN_ACK still carries a new ticket, of the configured windows
+            new_ticket = bytes(response[TRANSPORT_PARAMETERS_FORMAT.size + RESUMPTION_STATUS_FORMAT.size:])
+            self.assertEqual(issuer.open(new_ticket, HOST), (True, (INITIAL_MAX_DATA, INITIAL_MAX_STREAM_DATA)))
+
+
+if __name__ == '__main__':
+    unittest.main()
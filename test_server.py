@@ -0,0 +1,107 @@
+"""Unit tests of QUIC_SERVER: demultiplexing clients by connection ID on one socket, dropping malformed datagrams."""
+import asyncio
+import socket
+import unittest
+
+from QUIC import QUIC_CONNECTION, QUIC_SERVER
+from datagram_io import open_datagram_transport
+
+LOCAL_HOST = '127.0.0.1'
+# datagrams that are not packets: too short for a header, an unknown version, empty
+MALFORMED_DATAGRAMS = [b'\x00', b'\xff' * 3, b'']
+
+
+class ServerTest(unittest.TestCase):
+    def run_clients(self, payloads, stray_datagrams=()):
+        """
+        Connects one client per payload to a server, sends `stray_datagrams` to the server from another socket
+        between the handshakes and the data, returns {client connection ID: (session connection ID, data received)}.
+        """
+        async def main():
+            server = QUIC_SERVER()
+            await server.listen_to(LOCAL_HOST, 0)
+            address = server.sock.getsockname()
+            clients = [QUIC_CONNECTION() for _ in payloads]
+            for client in clients:
+                await client.connect(*address)
+            sessions = [await server.accept() for _ in clients]
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as stray_socket:
+                for datagram in stray_datagrams:
+                    stray_socket.sendto(datagram, address)
+                received = await asyncio.gather(*(session.receive_data() for session in sessions),
+                                                *(client.send_data([payload])
+                                                  for client, payload in zip(clients, payloads)))
+            # the session of every client, found by its connection ID
+            session_data = {session.connection_id: (session.connection_id, bytes(streams[0]))
+                            for session, streams in zip(sessions, received)}
+            results = {client.connection_id: session_data[client.connection_id] for client in clients}
+            for client in clients:
+                await client.close()
+            server.close()
+            return results
+
+        return asyncio.run(main())
+
+    def test_sessions_get_the_packets_of_their_connection_id(self):
+        payloads = [b'a' * 50_000, b'b' * 70_000, b'c' * 10]
+        results = self.run_clients(payloads)
+        self.assertEqual(len(results), len(payloads))
+        for (connection_id, (session_connection_id, data)), payload in zip(results.items(), payloads):
+            self.assertEqual(session_connection_id, connection_id)
+            self.assertEqual(data, payload)
+
+    def test_malformed_datagrams_are_dropped(self):
+        payloads = [b'x' * 30_000, b'y' * 30_000]
+        results = self.run_clients(payloads, MALFORMED_DATAGRAMS * 5)
+        self.assertEqual([data for _, data in results.values()], payloads)
+
+    def test_dispatch_ignores_malformed_datagrams(self):
+        server = QUIC_SERVER()
+        try:
+            for datagram in MALFORMED_DATAGRAMS:
+                server.dispatch(datagram, (LOCAL_HOST, 9))
+            self.assertEqual(server.sessions, {})
+        finally:
+            server.sock.close()
+
+
+class RECORDING_PROTOCOL(asyncio.DatagramProtocol):
+    """Records the datagrams it gets, and fails on the ones that start with `fail_on`."""
+
+    def __init__(self, fail_on: bytes):
+        self.fail_on = fail_on
+        self.received = []
+        self.all_received = asyncio.Event()
+
+    def datagram_received(self, data: bytes, address) -> None:
+        if data.startswith(self.fail_on):
+            raise Exception("Malformed datagram")
+        self.received.append(data)
+        if len(self.received) == 2:
+            self.all_received.set()
+
+
+class BatchedTransportTest(unittest.TestCase):
+    def test_a_failing_datagram_does_not_drop_the_rest_of_the_batch(self):
+        async def main():
+            loop = asyncio.get_running_loop()
+            errors = []
+            loop.set_exception_handler(lambda _, context: errors.append(context['exception']))
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((LOCAL_HOST, 0))
+            transport, protocol = await open_datagram_transport(sock, lambda: RECORDING_PROTOCOL(b'bad'))
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+                # queued in the kernel before the loop reads, so the three datagrams are read in one batch
+                for datagram in (b'first', b'bad', b'last'):
+                    sender.sendto(datagram, sock.getsockname())
+                await asyncio.wait_for(protocol.all_received.wait(), 5)
+            transport.close()
+            return protocol.received, errors
+
+        received, errors = asyncio.run(main())
+        self.assertEqual(received, [b'first', b'last'])
+        self.assertEqual(len(errors), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
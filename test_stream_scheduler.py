@@ -0,0 +1,70 @@
+"""Unit tests of the stream scheduler: strict priority between levels, deficit round robin inside one."""
+import unittest
+
+from stream_scheduler import SEND_STREAM, STREAM_SCHEDULER
+
+
+class StreamSchedulerTest(unittest.TestCase):
+    QUANTUM = 100
+
+    def stream(self, stream_id: int, size: int, priority: int = 3, weight: int = 1) -> SEND_STREAM:
+        stream = SEND_STREAM(stream_id, priority, weight)
+        stream.write(bytes(size))
+        stream.finish()
+        return stream
+
+    def frames(self, scheduler: STREAM_SCHEDULER, max_bytes: int = 1000):
+        """Every frame the scheduler packs until its streams are sent, as (stream ID, data size, is last frame)."""
+        frames = []
+        while (frame := scheduler.next_frame(max_bytes, max_bytes)) is not None:
+            stream, offset, data, is_last_frame = frame
+            frames.append((stream.stream_id, len(data), is_last_frame))
+        return frames
+
+    def test_deficit_round_robin_shares_by_weight(self):
+        scheduler = STREAM_SCHEDULER(self.QUANTUM)
+        scheduler.add(self.stream(1, 10_000, weight=1))
+        scheduler.add(self.stream(2, 10_000, weight=2))
+        scheduler.add(self.stream(3, 10_000, weight=1))
+        frames = self.frames(scheduler)
+        # while every stream has data, each round sends quantum * weight bytes of each of them
+        sent = {1: 0, 2: 0, 3: 0}
+        for stream_id, size, _ in frames[:30]:
+            sent[stream_id] += size
+        self.assertEqual(frames[:3], [(1, 100, False), (2, 200, False), (3, 100, False)])
+        self.assertEqual(sent, {1: 1000, 2: 2000, 3: 1000})
+        self.assertTrue(scheduler.is_empty())
+        self.assertEqual(sum(size for _, size, _ in frames), 30_000)
+
+    def test_stream_without_credit_loses_its_turn(self):
+        scheduler = STREAM_SCHEDULER(self.QUANTUM)
+        blocked = self.stream(1, 1000)
+        blocked.max_stream_data = 0
+        scheduler.add(blocked)
+        scheduler.add(self.stream(2, 300))
+        self.assertEqual([stream_id for stream_id, _, _ in self.frames(scheduler)], [2, 2, 2])
+        blocked.on_max_stream_data(1000)
+        self.assertEqual(self.frames(scheduler), [(1, 100, False)] * 9 + [(1, 100, True)])
+
+    def test_strict_priority(self):
+        scheduler = STREAM_SCHEDULER(self.QUANTUM)
+        scheduler.add(self.stream(1, 500, priority=5))
+        scheduler.add(self.stream(2, 300, priority=0))
+        scheduler.add(self.stream(3, 300, priority=3))
+        scheduler.add(self.stream(4, 300, priority=0))
+        frames = self.frames(scheduler)
+        stream_ids = [stream_id for stream_id, _, _ in frames]
+        # a level is only served once every more urgent stream sent its last frame
+        self.assertEqual(stream_ids, [2, 4] * 3 + [3] * 3 + [1] * 5)
+        self.assertEqual([stream_id for stream_id, _, is_last_frame in frames if is_last_frame], [2, 4, 3, 1])
+
+    def test_urgent_stream_preempts_a_running_level(self):
+        scheduler = STREAM_SCHEDULER(self.QUANTUM)
+        scheduler.add(self.stream(1, 1000, priority=3))
+        self.assertEqual(scheduler.next_frame(1000, 1000)[0].stream_id, 1)
+        scheduler.add(self.stream(2, 200, priority=1))
+        self.assertEqual([stream_id for stream_id, _, _ in self.frames(scheduler)], [2, 2] + [1] * 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""Unit tests of the timer wheel, on a clock the tests move forward."""
+import unittest
+
+from timer_wheel import TIMER_WHEEL
+
+
+class MANUAL_CLOCK_LOOP:
+    """The part of an event loop a TIMER_WHEEL uses, with a clock the test moves forward."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.calls = []
+
+    def time(self) -> float:
+        return self.now
+
+    def call_at(self, when: float, callback):
+        call = [when, callback]
+        self.calls.append(call)
+        return call
+
+    def call_exception_handler(self, context: dict) -> None:
+        raise context['exception']
+
+    def run_until(self, now: float) -> None:
+        """Moves the clock to `now`, running the wheel's wake-ups on the way at their time."""
+        while self.calls and min(when for when, _ in self.calls) <= now:
+            call = min(self.calls, key=lambda call: call[0])
+            self.calls.remove(call)
+            self.now = max(self.now, call[0])
+            call[1]()
+        self.now = now
+
+
+class TimerWheelTest(unittest.TestCase):
+    TICK = 1.0
+    SLOTS = 4
+
+    def setUp(self):
+        self.loop = MANUAL_CLOCK_LOOP()
+        self.wheel = TIMER_WHEEL(self.loop, self.TICK, self.SLOTS)
+        self.fired = []
+
+    def fire(self, name: str) -> None:
+        self.fired.append((name, self.loop.time()))
+
+    def test_fires_at_its_tick(self):
+        self.wheel.call_later(2.5, self.fire, 'timer')
+        self.loop.run_until(2.9)
+        self.assertEqual(self.fired, [])
+        self.loop.run_until(10)
+        self.assertEqual(self.fired, [('timer', 3.0)])
+        # an empty wheel does not wake up the loop
+        self.assertEqual(self.loop.calls, [])
+
+    def test_cancelled_timer_does_not_fire(self):
+        cancelled = self.wheel.call_later(2, self.fire, 'cancelled')
+        self.wheel.call_later(2, self.fire, 'kept')
+        cancelled.cancel()
+        self.loop.run_until(10)
+        self.assertEqual(self.fired, [('kept', 2.0)])
+        self.assertEqual(self.wheel.timers, 0)
+
+    def test_timer_beyond_one_turn_waits_for_its_rotation(self):
+        # 10 ticks is two and a half turns of a 4 slot wheel, the slot is passed twice before the timer is due
+        self.wheel.call_later(10, self.fire, 'late')
+        self.wheel.call_later(2, self.fire, 'same slot')
+        self.loop.run_until(9.5)
+        self.assertEqual(self.fired, [('same slot', 2.0)])
+        self.loop.run_until(20)
+        self.assertEqual(self.fired, [('same slot', 2.0), ('late', 10.0)])
+
+    def test_rescheduling_from_a_callback_across_rotations(self):
+        # like a keepalive: every run schedules the next one, further than a turn of the wheel away
+        def reschedule(count: int) -> None:
+            self.fire(f'run {count}')
+            if count < 3:
+                self.wheel.call_later(6, reschedule, count + 1)
+
+        self.wheel.call_later(1, reschedule, 1)
+        self.loop.run_until(30)
+        self.assertEqual(self.fired, [('run 1', 1.0), ('run 2', 7.0), ('run 3', 13.0)])
+
+    def test_cancel_and_reschedule(self):
+        # like an idle timer pushed back by every received packet
+        timer = self.wheel.call_later(3, self.fire, 'idle')
+        for now in (2, 4, 6):
+            self.loop.run_until(now)
+            timer.cancel()
+            timer = self.wheel.call_later(3, self.fire, 'idle')
+        self.loop.run_until(20)
+        self.assertEqual(self.fired, [('idle', 9.0)])
+
+    def test_pause_longer_than_a_turn(self):
+        # the loop was busy for several turns, every timer that became due fires once on the next wake-up
+        for delay in (1, 2, 3, 9):
+            self.wheel.call_later(delay, self.fire, delay)
+        self.loop.calls.clear()
+        self.loop.now = 12.5
+        self.wheel.advance()
+        self.assertEqual(sorted(name for name, _ in self.fired), [1, 2, 3, 9])
+        self.assertEqual(self.wheel.timers, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+"""Unit tests of the variable-length integers of the wire format."""
+import unittest
+
+from varint import MAX_VARINT, pack_varint_into, unpack_varint_from, varint_size
+
+
+class VarintTest(unittest.TestCase):
+    # the largest value of every size, and the smallest of the next one
+    BOUNDARIES = [(0, 1), (63, 1), (64, 2), (16383, 2), (16384, 4), ((1 << 30) - 1, 4), (1 << 30, 8),
+                  (MAX_VARINT, 8)]
+
+    def test_sizes(self):
+        for value, size in self.BOUNDARIES:
+            self.assertEqual(varint_size(value), size, value)
+
+    def test_round_trip_at_boundaries(self):
+        for value, size in self.BOUNDARIES:
+            buffer = bytearray(1 + size + 1)
+            end = pack_varint_into(buffer, 1, value)
+            self.assertEqual(end, 1 + size, value)
+            self.assertEqual(unpack_varint_from(buffer, 1), (value, 1 + size), value)
+            # the two high bits of the first byte give the size
+            self.assertEqual(buffer[1] >> 6, size.bit_length() - 1, value)
+
+    def test_too_large(self):
+        with self.assertRaises(Exception):
+            varint_size(MAX_VARINT + 1)
+        with self.assertRaises(Exception):
+            pack_varint_into(bytearray(8), 0, MAX_VARINT + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
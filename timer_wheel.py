@@ -0,0 +1,93 @@
+import asyncio
+import math
+import weakref
+from typing import Callable, List, Optional
+
+WHEEL_TICK = 0.05  # seconds, the precision of the wheel's timers
+WHEEL_SLOTS = 512  # one turn of the wheel covers WHEEL_TICK * WHEEL_SLOTS seconds, later timers wait for more turns
+
+
+class TIMER:
+    """A callback scheduled on a TIMER_WHEEL, `cancel` stops it from running."""
+    __slots__ = ('tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, tick: int, callback: Callable[..., None], args: tuple):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class TIMER_WHEEL:
+    """
+    Hashed timing wheel for the coarse timers of every connection on an event loop (handshake, idle, keepalive).
+
+    A timer goes into the slot of the tick it expires at, so scheduling and cancelling are O(1) whatever the
+    number of timers, and a cancelled timer is only dropped when the wheel reaches its slot. The wheel wakes up
+    once per tick, and only while it holds timers, instead of every connection keeping its own handles in the
+    loop's heap, so thousands of sessions each with a few timers cost the loop one timer.
+    Timers fire up to one tick late. Loss detection needs the RTT's precision and keeps its own loop timer.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, tick: float = WHEEL_TICK, slots: int = WHEEL_SLOTS):
+        self.loop = loop
+        self.tick = tick
+        self.slots: List[List[TIMER]] = [[] for _ in range(slots)]
+        self.current_tick = self.tick_at(loop.time())
+        self.timers = 0  # timers in the slots, cancelled ones included
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+    def tick_at(self, when: float) -> int:
+        return math.floor(when / self.tick)
+
+    def call_later(self, delay: float, callback: Callable[..., None], *args) -> TIMER:
+        """Runs `callback(*args)` once `delay` seconds passed, like loop.call_later."""
+        tick = max(math.ceil((self.loop.time() + delay) / self.tick), self.current_tick + 1)
+        timer = TIMER(tick, callback, args)
+        self.slots[tick % len(self.slots)].append(timer)
+        self.timers += 1
+        if self.handle is None:
+            self.handle = self.loop.call_at((self.current_tick + 1) * self.tick, self.advance)
+        return timer
+
+    def advance(self) -> None:
+        """Fires the timers of every slot the clock went past since the last tick."""
+        self.handle = None
+        now_tick = self.tick_at(self.loop.time())
+        due = []
+        # after a pause longer than a turn every slot is visited once
+        for tick in range(self.current_tick + 1, min(now_tick, self.current_tick + len(self.slots)) + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if any(timer.tick <= now_tick for timer in slot):
+                due.extend(timer for timer in slot if timer.tick <= now_tick)
+                slot[:] = [timer for timer in slot if timer.tick > now_tick]
+        self.timers -= len(due)
+        # the callbacks may schedule timers, they go after the current tick
+        self.current_tick = max(self.current_tick, now_tick)
+        for timer in due:
+            if not timer.cancelled:
+                self.run(timer)
+        if self.timers and self.handle is None:
+            self.handle = self.loop.call_at((self.current_tick + 1) * self.tick, self.advance)
+
+    def run(self, timer: TIMER) -> None:
+        try:
+            timer.callback(*timer.args)
+        except Exception as error:
+            self.loop.call_exception_handler({'message': 'Exception in a timer wheel callback', 'exception': error})
+
+
+# one wheel per event loop, shared by every connection (and server session) running on it
+timer_wheels: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, TIMER_WHEEL]' = weakref.WeakKeyDictionary()
+
+
+def timer_wheel() -> TIMER_WHEEL:
+    """The wheel of the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    wheel = timer_wheels.get(loop)
+    if wheel is None:
+        wheel = timer_wheels[loop] = TIMER_WHEEL(loop)
+    return wheel
@@ -0,0 +1,52 @@
+import struct
+from typing import Tuple
+
+# QUIC variable-length integers (RFC 9000, section 16): the two high bits of the first byte give the size of the
+# integer (1, 2, 4 or 8 bytes), the remaining bits hold the value in network byte order
+MAX_VARINT = (1 << 62) - 1
+VARINT16 = struct.Struct('!H')
+VARINT32 = struct.Struct('!I')
+VARINT64 = struct.Struct('!Q')
+
+
+def varint_size(value: int) -> int:
+    """Bytes the value takes encoded."""
+    if value < 1 << 6:
+        return 1
+    if value < 1 << 14:
+        return 2
+    if value < 1 << 30:
+        return 4
+    if value <= MAX_VARINT:
+        return 8
+    raise Exception(f"{value} does not fit in a variable-length integer")
+
+
+def pack_varint_into(buffer, position: int, value: int) -> int:
+    """Writes the value at `position` in its shortest encoding, returns the position after it."""
+    if value < 1 << 6:
+        buffer[position] = value
+        return position + 1
+    if value < 1 << 14:
+        VARINT16.pack_into(buffer, position, value | 0x4000)
+        return position + 2
+    if value < 1 << 30:
+        VARINT32.pack_into(buffer, position, value | 0x8000_0000)
+        return position + 4
+    if value <= MAX_VARINT:
+        VARINT64.pack_into(buffer, position, value | 0xC000_0000_0000_0000)
+        return position + 8
+    raise Exception(f"{value} does not fit in a variable-length integer")
+
+
+def unpack_varint_from(buffer, position: int) -> Tuple[int, int]:
+    """Reads the integer at `position`, returns (value, position after it)."""
+    first_byte = buffer[position]
+    size_bits = first_byte >> 6
+    if size_bits == 0:
+        return first_byte, position + 1
+    if size_bits == 1:
+        return VARINT16.unpack_from(buffer, position)[0] & 0x3FFF, position + 2
+    if size_bits == 2:
+        return VARINT32.unpack_from(buffer, position)[0] & 0x3FFF_FFFF, position + 4
+    return VARINT64.unpack_from(buffer, position)[0] & MAX_VARINT, position + 8